@@ -1,9 +1,13 @@
 # app.py - Production Ready Version with PostgreSQL Support - FIXED VERSION
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, stream_with_context, g, has_app_context
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from sqlalchemy import event, exc
+from sqlalchemy.dialects import postgresql, sqlite
 import datetime
 import os
 import logging
@@ -11,20 +15,99 @@ from logging.handlers import RotatingFileHandler
 import pytz
 import csv
 import io
-from typing import Optional, List, Dict, Any
+import json
+import base64
+import zlib
+import time
+import bisect
+import heapq
+import queue
+import atexit
+import threading
+import sqlite3
+import socket
+import glob
+import hashlib
+import functools
+import math
+import mmap
+import struct
+import contextlib
+import contextvars
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from operator import itemgetter
+from typing import Annotated, Optional, List, Dict, Any
+
+# Optional: fast JSON encoding
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional: compiled (struct) decoding of ingest payloads
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+# Optional: Arrow IPC / Parquet exports
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Optional: cross-process file locks (Unix only)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Optional: Prometheus metrics endpoint
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
 
 # --- App Configuration ---
+class TimedJSONProvider(DefaultJSONProvider):
+    """Default Flask JSON provider that records response serialization time"""
+    
+    def response(self, *args, **kwargs):
+        started = time.perf_counter()
+        response = super().response(*args, **kwargs)
+        metrics.observe_serialization(time.perf_counter() - started)
+        return response
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes responses with orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    
+    def response(self, *args, **kwargs):
+        started = time.perf_counter()
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS)
+        metrics.observe_serialization(time.perf_counter() - started)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app) if orjson is not None else TimedJSONProvider(app)
 
 # Environment-based configuration
 ENV = os.getenv('FLASK_ENV', 'development')
 DEBUG = ENV == 'development'
 
 # CORS Configuration
+CORS_ORIGINS = ["http://localhost:3000", "http://127.0.0.1:3000", "http://localhost:5173", 
+                "http://127.0.0.1:5173", "https://*.vercel.app", "https://*.netlify.app"]
 CORS(app, resources={
     r"/api/*": {
-        "origins": ["http://localhost:3000", "http://127.0.0.1:3000", "http://localhost:5173", 
-                   "http://127.0.0.1:5173", "https://*.vercel.app", "https://*.netlify.app"],
+        "origins": CORS_ORIGINS,
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
         "allow_headers": ["Content-Type", "Authorization"]
     }
@@ -34,6 +117,8 @@ CORS(app, resources={
 IRAN_TZ = pytz.timezone('Asia/Tehran')
 
 # Rate Limiting Configuration - INCREASED LIMITS
+# (RATELIMIT_ENABLED=false turns limits off, e.g. for benchmark.py load runs)
+app.config['RATELIMIT_ENABLED'] = os.getenv('RATELIMIT_ENABLED', 'true').lower() == 'true'
 limiter = Limiter(
     key_func=get_remote_address,
     app=app,
@@ -64,10 +149,411 @@ else:
     app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DATABASE_PATH}'
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Dialect name, usable without an app context (the ASGI entry point runs outside one)
+DATABASE_BACKEND = app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0].split('+', 1)[0]
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-change-in-production')
 
+# Batch ingestion limits
+MAX_BATCH_FRAMES = int(os.getenv('MAX_BATCH_FRAMES', 2000))
+
+# Plausible value range per sensor type (same bounds the dashboard clamps to).
+# SENSOR_RANGE_MODE: 'drop' skips out-of-range readings, 'reject' fails the frame, 'off' disables
+SENSOR_RANGES = {
+    'temperature': (-50, 70),
+    'humidity': (0, 100),
+    'air_quality': (0, 5000),
+    'light_level': (0, 10000),
+    'light': (0, 10000),
+    'pressure': (800, 1200),
+}
+SENSOR_RANGE_MODE = os.getenv('SENSOR_RANGE_MODE', 'drop')
+
+# Ingest mode: 'sync' commits per request, 'buffered' queues readings for a background writer
+INGEST_MODE = os.getenv('INGEST_MODE', 'sync')
+INGEST_QUEUE_MAX = int(os.getenv('INGEST_QUEUE_MAX', 10000))         # frames
+INGEST_FLUSH_SIZE = int(os.getenv('INGEST_FLUSH_SIZE', 500))         # readings per commit
+INGEST_FLUSH_INTERVAL = float(os.getenv('INGEST_FLUSH_INTERVAL', 1.0))  # seconds
+
+# Idempotent ingest: frames with a `seq` are deduplicated per device against an in-memory
+# window of recent sequence numbers, backed by the ingest_sequence unique key
+INGEST_SEQ_WINDOW = int(os.getenv('INGEST_SEQ_WINDOW', 1024))              # seq numbers per device
+INGEST_SEQ_RETENTION_DAYS = int(os.getenv('INGEST_SEQ_RETENTION_DAYS', 7))  # 0 keeps them forever
+DEVICE_CLOCK_SKEW = float(os.getenv('DEVICE_CLOCK_SKEW', 300))  # seconds a device clock may run ahead
+DEVICE_MAX_BACKFILL = float(os.getenv('DEVICE_MAX_BACKFILL', 30 * 86400))  # seconds a device timestamp may lag behind
+
+# Offline ingest spool: readings the database cannot take are appended to local segment
+# files and replayed once it recovers (off unless a directory is set). After a failed
+# commit, ingest skips the database for one replay interval instead of waiting on it again.
+# Records the database rejects on replay are moved to dead-letter.jsonl in the same directory.
+INGEST_SPOOL_DIR = os.getenv('INGEST_SPOOL_DIR', '')
+INGEST_SPOOL_SEGMENT_BYTES = int(os.getenv('INGEST_SPOOL_SEGMENT_BYTES', 16 * 1024 * 1024))
+INGEST_SPOOL_FSYNC = os.getenv('INGEST_SPOOL_FSYNC', 'true').lower() == 'true'
+INGEST_SPOOL_REPLAY_INTERVAL = float(os.getenv('INGEST_SPOOL_REPLAY_INTERVAL', 5))  # seconds
+INGEST_SPOOL_REPLAY_BATCH = int(os.getenv('INGEST_SPOOL_REPLAY_BATCH', 5000))      # readings per transaction
+
+# Latest-value cache: optional shared SQLite file so all gunicorn workers agree
+LATEST_CACHE_PATH = os.getenv('LATEST_CACHE_PATH')
+
+# Streaming alerts, evaluated on every committed reading. Static thresholds match the
+# dashboard's warning/critical colors; max_rate is in units per minute and min_std floors
+# the EWMA standard deviation used for anomaly z-scores (sensor types without a rule get
+# no anomaly scoring). ALERT_RULES (JSON) overrides entries per sensor type, e.g.
+# {"temperature": {"critical": [0, 45]}}; null is unbounded.
+ALERTS_ENABLED = os.getenv('ALERTS_ENABLED', 'true').lower() == 'true'
+DEFAULT_ALERT_RULES = {
+    'temperature': {'warning': [15, 30], 'critical': [5, 40], 'max_rate': 2.0, 'min_std': 0.2},
+    'humidity': {'warning': [30, 70], 'critical': [20, 85], 'max_rate': 10.0, 'min_std': 1.0},
+    'air_quality': {'warning': [None, 1000], 'critical': [None, 2000], 'max_rate': 500.0, 'min_std': 10.0},
+    'light_level': {'warning': [5, 5000], 'min_std': 10.0},
+    'pressure': {'warning': [1000, 1030], 'critical': [980, 1050], 'max_rate': 1.0, 'min_std': 0.3},
+}
+ALERT_RULES = {**DEFAULT_ALERT_RULES}
+for _sensor_type, _overrides in json.loads(os.getenv('ALERT_RULES') or '{}').items():
+    ALERT_RULES[_sensor_type] = {**ALERT_RULES.get(_sensor_type, {}), **_overrides}
+ALERT_EWMA_ALPHA = float(os.getenv('ALERT_EWMA_ALPHA', 0.05))   # weight of the newest reading
+ALERT_ZSCORE = float(os.getenv('ALERT_ZSCORE', 4.0))            # |z| that counts as an anomaly
+ALERT_WARMUP = int(os.getenv('ALERT_WARMUP', 30))               # readings before z-scores are trusted
+ALERT_COOLDOWN = float(os.getenv('ALERT_COOLDOWN', 300))        # seconds; a re-trigger reopens the last alert
+ALERT_RATE_MIN_INTERVAL = float(os.getenv('ALERT_RATE_MIN_INTERVAL', 10))  # seconds spanned by a rate check
+ALERT_RETENTION_DAYS = int(os.getenv('ALERT_RETENTION_DAYS', 90))  # resolved alerts, 0 keeps them forever
+
+# Historical aggregation: allowed bucket widths (seconds) and point budget
+AGGREGATE_BUCKETS = [5, 10, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400]
+AGGREGATE_DEFAULT_POINTS = 300
+AGGREGATE_MAX_POINTS = 2000
+# Raw points LTTB may hold for one series; longer series fall back to bucket aggregation
+LTTB_MAX_SOURCE_POINTS = int(os.getenv('LTTB_MAX_SOURCE_POINTS', 100000))
+
+# Export streaming: rows fetched and formatted per batch
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 5000))
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+# Rollup tables: resolutions (seconds) maintained incrementally by a background job
+ROLLUP_RESOLUTIONS = [60, 3600, 86400]
+ROLLUP_ENABLED = os.getenv('ROLLUP_ENABLED', 'true').lower() == 'true'
+ROLLUP_INTERVAL = float(os.getenv('ROLLUP_INTERVAL', 60))     # seconds between runs
+ROLLUP_BATCH_SIZE = int(os.getenv('ROLLUP_BATCH_SIZE', 50000))  # reading ids per transaction
+# PostgreSQL hands out ids at insert time, so an id can become visible after higher ones.
+# Rollups only fold ids that were already allocated this many seconds ago.
+ROLLUP_SAFETY_LAG = float(os.getenv('ROLLUP_SAFETY_LAG', 30))
+
+# Live stream (SSE): per-subscriber queue size, keepalive interval, and an optional
+# directory of Unix datagram sockets used to fan events out across gunicorn workers
+STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', 100))
+STREAM_KEEPALIVE = float(os.getenv('STREAM_KEEPALIVE', 15))  # seconds
+STREAM_SOCKET_DIR = os.getenv('STREAM_SOCKET_DIR')
+STREAM_DATAGRAM_BYTES = int(os.getenv('STREAM_DATAGRAM_BYTES', 32768))  # max size of one fan-out datagram
+STREAM_SEND_TIMEOUT = float(os.getenv('STREAM_SEND_TIMEOUT', 0.5))      # seconds a full peer is retried
+
+# Read endpoint response cache (invalidated on every ingest commit)
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 10))  # seconds, 0 disables
+RESPONSE_CACHE_MAX = int(os.getenv('RESPONSE_CACHE_MAX', 256))   # entries (LRU)
+
+# Storage: monthly partitions (PostgreSQL only) and retention of raw readings
+PARTITION_READINGS = os.getenv('PARTITION_READINGS', 'false').lower() == 'true'
+PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', 2))
+RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', 0))  # raw readings, 0 keeps everything
+RETENTION_MINUTE_ROLLUP_DAYS = int(os.getenv('RETENTION_MINUTE_ROLLUP_DAYS', 90))
+RETENTION_INTERVAL = float(os.getenv('RETENTION_INTERVAL', 3600))  # seconds between runs
+RETENTION_DELETE_BATCH = int(os.getenv('RETENTION_DELETE_BATCH', 10000))
+# Per-day ingest counters (only today's is read), total counters are kept forever
+INGEST_COUNTER_RETENTION_DAYS = int(os.getenv('INGEST_COUNTER_RETENTION_DAYS', 7))
+
+# Device registry cache (name/location/first_seen) refresh interval
+DEVICE_REGISTRY_TTL = int(os.getenv('DEVICE_REGISTRY_TTL', 300))  # seconds
+DEVICE_REGISTRY_MISS_TTL = int(os.getenv('DEVICE_REGISTRY_MISS_TTL', 30))  # seconds an unknown id stays unknown
+
+# Device presence: last_seen is tracked in memory and written back in batches
+DEVICE_OFFLINE_AFTER = float(os.getenv('DEVICE_OFFLINE_AFTER', 300))       # seconds without data
+PRESENCE_FLUSH_INTERVAL = float(os.getenv('PRESENCE_FLUSH_INTERVAL', 15))  # seconds between writes
+PRESENCE_HISTORY = int(os.getenv('PRESENCE_HISTORY', 500))                 # transitions kept for the API
+
+# Storage profile (see STORAGE_PROFILES) and optional read replica for read endpoints
+STORAGE_PROFILE = os.getenv('STORAGE_PROFILE', 'default')
+DATABASE_READ_URL = os.getenv('DATABASE_READ_URL')
+
+# Prometheus metrics at /metrics (needs prometheus_client). With several gunicorn workers,
+# PROMETHEUS_MULTIPROC_DIR (set by gunicorn.conf.py) makes a scrape report all of them
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+# --- Metrics ---
+# Labels use the route pattern (e.g. /api/devices/<device_id>/status), never the raw
+# path, so the number of series stays bounded
+DB_TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+class RequestMetrics:
+    """Per-request state: route label, start time and database statement totals"""
+    __slots__ = ('endpoint', 'started', 'db_queries', 'db_seconds')
+    
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_seconds = 0.0
+
+# Context variable rather than flask.g so the ASGI routes and their greenlet-run queries share it
+current_request_metrics = contextvars.ContextVar('current_request_metrics', default=None)
+
+class Metrics:
+    """Prometheus collectors for requests, database statements and ingest; no-ops when disabled"""
+    
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        if not enabled:
+            return
+        
+        Counter, Histogram = prometheus_client.Counter, prometheus_client.Histogram
+        self.requests = Counter(
+            'http_requests_total', 'HTTP requests served', ['method', 'endpoint', 'status'])
+        self.request_latency = Histogram(
+            'http_request_duration_seconds', 'Time to produce the response', ['method', 'endpoint'])
+        self.request_db_queries = Histogram(
+            'http_request_db_queries', 'Database statements executed per request', ['endpoint'],
+            buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89))
+        self.request_db_time = Histogram(
+            'http_request_db_seconds', 'Database time per request', ['endpoint'], buckets=DB_TIME_BUCKETS)
+        self.serialization = Histogram(
+            'http_response_serialization_seconds', 'JSON encoding time of responses', ['endpoint'],
+            buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+        self.rate_limited = Counter(
+            'http_rate_limit_rejections_total', 'Requests rejected by the rate limiter', ['endpoint'])
+        self.db_query_time = Histogram(
+            'db_query_duration_seconds', 'Duration of single database statements', ['engine'],
+            buckets=DB_TIME_BUCKETS)
+        self.ingest_rows = Counter('ingest_rows_total', 'Sensor readings committed')
+        self.ingest_commit = Histogram(
+            'ingest_commit_duration_seconds', 'Insert and commit time of ingest transactions', ['path'],
+            buckets=DB_TIME_BUCKETS)
+    
+    def attach(self, name: str, engine):
+        """Time every statement executed on `engine`"""
+        if not self.enabled:
+            return
+        query_time = self.db_query_time.labels(name)
+        
+        @event.listens_for(engine, 'before_cursor_execute')
+        def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+            conn.info['query_started'] = time.perf_counter()
+        
+        @event.listens_for(engine, 'after_cursor_execute')
+        def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+            started = conn.info.pop('query_started', None)
+            if started is None:
+                return
+            elapsed = time.perf_counter() - started
+            query_time.observe(elapsed)
+            state = current_request_metrics.get()
+            if state is not None:
+                state.db_queries += 1
+                state.db_seconds += elapsed
+    
+    def start_request(self, endpoint: str) -> Optional[RequestMetrics]:
+        if not self.enabled:
+            return None
+        state = RequestMetrics(endpoint)
+        current_request_metrics.set(state)
+        return state
+    
+    def finish_request(self, state: Optional[RequestMetrics], endpoint: str, method: str, status: int):
+        """Record a finished request; `state` is None if it was rejected before start_request"""
+        if not self.enabled:
+            return
+        self.requests.labels(method, endpoint, str(status)).inc()
+        if state is None:
+            return
+        current_request_metrics.set(None)
+        self.request_latency.labels(method, endpoint).observe(time.perf_counter() - state.started)
+        self.request_db_queries.labels(endpoint).observe(state.db_queries)
+        self.request_db_time.labels(endpoint).observe(state.db_seconds)
+    
+    def observe_serialization(self, seconds: float):
+        state = current_request_metrics.get() if self.enabled else None
+        if state is not None:
+            self.serialization.labels(state.endpoint).observe(seconds)
+    
+    def observe_rate_limited(self, endpoint: str):
+        if self.enabled:
+            self.rate_limited.labels(endpoint).inc()
+    
+    def observe_ingest(self, row_count: int):
+        if self.enabled:
+            self.ingest_rows.inc(row_count)
+    
+    def time_ingest_commit(self, path: str):
+        """Context manager timing one ingest transaction (sync, batch, buffered or async)"""
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self.ingest_commit.labels(path).time()
+    
+    def render(self) -> bytes:
+        """Text exposition of this process, or of every worker in multiprocess mode"""
+        if PROMETHEUS_MULTIPROC_DIR:
+            registry = prometheus_client.CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = prometheus_client.REGISTRY
+        return prometheus_client.generate_latest(registry)
+
+metrics = Metrics(METRICS_ENABLED and prometheus_client is not None)
+
+# --- Storage Profiles ---
+# Pool sizing applies to PostgreSQL and file-based SQLite; pragmas are applied to
+# every new SQLite connection (cache_size is negative KiB, mmap_size is bytes)
+STORAGE_PROFILES = {
+    # Balanced settings for one small server
+    'default': {
+        'pool_size': 10, 'max_overflow': 20, 'pool_recycle': 1800, 'pool_timeout': 30,
+        'sqlite_pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -32000,
+                           'mmap_size': 134217728, 'temp_store': 'MEMORY'}
+    },
+    # Many concurrent devices and dashboards on a machine with memory to spare
+    'throughput': {
+        'pool_size': 20, 'max_overflow': 40, 'pool_recycle': 1800, 'pool_timeout': 30,
+        'sqlite_pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -131072,
+                           'mmap_size': 1073741824, 'temp_store': 'MEMORY'}
+    },
+    # fsync on every commit - survives power loss at the cost of write latency
+    'durable': {
+        'pool_size': 10, 'max_overflow': 10, 'pool_recycle': 1800, 'pool_timeout': 30,
+        'sqlite_pragmas': {'journal_mode': 'WAL', 'synchronous': 'FULL', 'cache_size': -32000,
+                           'mmap_size': 134217728, 'temp_store': 'MEMORY'}
+    },
+    # Small boards (Raspberry Pi class)
+    'low-memory': {
+        'pool_size': 5, 'max_overflow': 5, 'pool_recycle': 1800, 'pool_timeout': 30,
+        'sqlite_pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -4000,
+                           'mmap_size': 0, 'temp_store': 'DEFAULT'}
+    },
+    # SQLAlchemy defaults and rollback journaling (the behaviour before profiles existed)
+    'legacy': {
+        'pool_size': 5, 'max_overflow': 10, 'pool_recycle': -1, 'pool_timeout': 30,
+        'sqlite_pragmas': {}
+    },
+}
+
+if STORAGE_PROFILE not in STORAGE_PROFILES:
+    raise ValueError(f"Unknown STORAGE_PROFILE {STORAGE_PROFILE!r}, expected one of: {', '.join(STORAGE_PROFILES)}")
+
+# Resolved profile; individual pool settings can still be overridden from the environment
+STORAGE_SETTINGS = dict(STORAGE_PROFILES[STORAGE_PROFILE])
+for setting, env_name in (('pool_size', 'DB_POOL_SIZE'), ('max_overflow', 'DB_MAX_OVERFLOW'),
+                          ('pool_recycle', 'DB_POOL_RECYCLE'), ('pool_timeout', 'DB_POOL_TIMEOUT')):
+    if os.getenv(env_name):
+        STORAGE_SETTINGS[setting] = int(os.getenv(env_name))
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': STORAGE_SETTINGS['pool_size'],
+    'max_overflow': STORAGE_SETTINGS['max_overflow'],
+    'pool_recycle': STORAGE_SETTINGS['pool_recycle'],
+    'pool_timeout': STORAGE_SETTINGS['pool_timeout'],
+    'pool_pre_ping': DATABASE_BACKEND != 'sqlite'
+}
+if DATABASE_READ_URL:
+    if DATABASE_READ_URL.startswith("postgres://"):
+        DATABASE_READ_URL = DATABASE_READ_URL.replace("postgres://", "postgresql://", 1)
+    app.config['SQLALCHEMY_BINDS'] = {'replica': DATABASE_READ_URL}
+
+class PoolMonitor:
+    """Checkout counters for every engine's connection pool (saturation metrics)"""
+    
+    def __init__(self):
+        self._pools = {}
+        self._lock = threading.Lock()
+    
+    def attach(self, name: str, engine):
+        pool = engine.pool
+        stats = {'checkouts': 0, 'peak_checked_out': 0, 'saturated_checkouts': 0}
+        with self._lock:
+            self._pools[name] = (pool, stats)
+        
+        capacity = self._capacity(pool)
+        
+        @event.listens_for(pool, 'checkout')
+        def on_checkout(*args):
+            checked_out = pool.checkedout() if hasattr(pool, 'checkedout') else 0
+            with self._lock:
+                stats['checkouts'] += 1
+                stats['peak_checked_out'] = max(stats['peak_checked_out'], checked_out)
+                if capacity and checked_out >= capacity:
+                    stats['saturated_checkouts'] += 1  # the next checkout has to wait
+    
+    @staticmethod
+    def _capacity(pool) -> Optional[int]:
+        """pool_size + max_overflow, or None for unbounded / non-queue pools"""
+        if not hasattr(pool, '_max_overflow') or pool._max_overflow < 0:
+            return None
+        return pool.size() + pool._max_overflow
+    
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            pools = list(self._pools.items())
+        result = {}
+        for name, (pool, stats) in pools:
+            entry = {'pool': type(pool).__name__, **stats}
+            if hasattr(pool, 'checkedout'):
+                capacity = self._capacity(pool)
+                entry.update({
+                    'size': pool.size(),
+                    'max_overflow': pool._max_overflow,
+                    'checked_out': pool.checkedout(),
+                    'checked_in': pool.checkedin(),
+                    'overflow': max(pool.overflow(), 0),
+                    'saturation': round(pool.checkedout() / capacity, 3) if capacity else None
+                })
+            result[name] = entry
+        return result
+
+pool_monitor = PoolMonitor()
+
+def configure_storage_engine(name: str, engine):
+    """Apply the SQLite pragma profile on connect and start pool and query monitoring"""
+    pragmas = STORAGE_SETTINGS['sqlite_pragmas']
+    if engine.dialect.name == 'sqlite' and pragmas:
+        @event.listens_for(engine, 'connect')
+        def apply_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma, value in pragmas.items():
+                cursor.execute(f'PRAGMA {pragma}={value}')
+            cursor.close()
+    pool_monitor.attach(name, engine)
+    metrics.attach(name, engine)
+
+def sqlite_pragma_values(engine) -> Dict[str, Any]:
+    """Current values of the profile's pragmas on a pooled connection"""
+    with engine.connect() as conn:
+        return {pragma: conn.exec_driver_sql(f'PRAGMA {pragma}').scalar()
+                for pragma in STORAGE_SETTINGS['sqlite_pragmas']}
+
+class RoutingSession(FlaskSQLAlchemySession):
+    """Session that sends SELECTs of @read_replica endpoints to the replica engine"""
+    
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and DATABASE_READ_URL and not self._flushing
+                and getattr(clause, 'is_select', False)
+                and has_app_context() and g.get('use_read_replica')):
+            return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def read_replica(view):
+    """Route the endpoint's SELECTs to DATABASE_READ_URL when one is configured"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_read_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
 # Initialize database
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+with app.app_context():
+    for bind_key, bind_engine in db.engines.items():
+        configure_storage_engine(bind_key or 'primary', bind_engine)
 
 # Logging Configuration
 if ENV == 'production':
@@ -93,138 +579,3292 @@ def utc_to_iran_time(utc_dt: datetime.datetime) -> datetime.datetime:
 
 def format_iran_time(dt: datetime.datetime) -> str:
     """Format Iran time for display"""
-    iran_dt = utc_to_iran_time(dt) if dt.tzinfo is None else dt.astimezone(IRAN_TZ)
-    return iran_dt.strftime('%Y-%m-%d %H:%M:%S IRST')
+    if dt.tzinfo is None:
+        return f"{(dt + iran_utc_offset(dt)).isoformat(' ', 'seconds')} IRST"
+    return dt.astimezone(IRAN_TZ).strftime('%Y-%m-%d %H:%M:%S IRST')
+
+# Tehran offset periods (naive UTC start -> offset); no DST since 2022, so the
+# last period covers every current reading
+_IRAN_TRANSITION_TIMES = list(getattr(IRAN_TZ, '_utc_transition_times', []))
+_IRAN_TRANSITION_OFFSETS = [info[0] for info in getattr(IRAN_TZ, '_transition_info', [])]
+
+def iran_utc_offset(utc_dt: datetime.datetime) -> datetime.timedelta:
+    """UTC offset of Asia/Tehran at a naive UTC instant"""
+    if not _IRAN_TRANSITION_TIMES:
+        return utc_to_iran_time(utc_dt).utcoffset()
+    index = bisect.bisect_right(_IRAN_TRANSITION_TIMES, utc_dt) - 1
+    return _IRAN_TRANSITION_OFFSETS[max(index, 0)]
+
+def format_iran_columns(timestamps: List[datetime.datetime]):
+    """Format a whole column of naive UTC timestamps at once.
+    
+    Returns (utc_iso, iran, persian) lists. The offset is looked up once per
+    transition period rather than localized per row through pytz.
+    """
+    utc_iso, iran, persian = [], [], []
+    period_start = period_end = None
+    offset = None
+    
+    for ts in timestamps:
+        if offset is None or not (period_start <= ts < period_end):
+            index = bisect.bisect_right(_IRAN_TRANSITION_TIMES, ts) - 1
+            if index < 0 or not _IRAN_TRANSITION_TIMES:
+                offset = utc_to_iran_time(ts).utcoffset()
+                period_start = period_end = ts
+            else:
+                offset = _IRAN_TRANSITION_OFFSETS[index]
+                period_start = _IRAN_TRANSITION_TIMES[index]
+                period_end = (_IRAN_TRANSITION_TIMES[index + 1]
+                              if index + 1 < len(_IRAN_TRANSITION_TIMES) else datetime.datetime.max)
+        
+        local = (ts + offset).isoformat(' ', 'seconds')
+        utc_iso.append(ts.isoformat())
+        iran.append(f"{local} IRST")
+        persian.append(local.replace('-', '/'))
+    
+    return utc_iso, iran, persian
+
+def parse_frame_timestamp(value) -> Optional[datetime.datetime]:
+    """Parse a frame timestamp (ISO-8601 or epoch seconds) to naive UTC"""
+    if value is None or isinstance(value, bool):
+        return None
+    
+    if isinstance(value, (int, float)):
+        # Firmware sends millis() uptime here - only accept real epoch values
+        if value < 946684800:  # 2000-01-01
+            return None
+        return datetime.datetime.utcfromtimestamp(value)
+    
+    if isinstance(value, str):
+        try:
+            parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(pytz.utc).replace(tzinfo=None)
+        return parsed
+    
+    return None
+
+# --- Database Models ---
+class Device(db.Model):
+    """Device registration table"""
+    id = db.Column(db.String(50), primary_key=True)  # MAC Address
+    name = db.Column(db.String(100), nullable=True)
+    location = db.Column(db.String(200), nullable=True)
+    first_seen = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    last_seen = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    is_active = db.Column(db.Boolean, default=True)
+
+class DeviceKey(db.Model):
+    """Dictionary of device ids; readings store the integer key"""
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(50), unique=True, nullable=False)  # MAC Address
+
+class SensorType(db.Model):
+    """Dictionary of (sensor type, unit) pairs; readings store the small integer id"""
+    id = db.Column(db.SmallInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    unit = db.Column(db.String(10), nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('name', 'unit', name='uq_sensor_type_name_unit'),
+    )
+
+class SensorReading(db.Model):
+    """Sensor readings storage table (dictionary-encoded device and sensor type)"""
+    id = db.Column(db.Integer, primary_key=True)
+    device_key = db.Column(db.Integer, db.ForeignKey('device_key.id'), nullable=False)
+    sensor_type_id = db.Column(db.SmallInteger, db.ForeignKey('sensor_type.id'), nullable=False)
+    value = db.Column(db.Float, nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    
+    # Add index for better performance
+    __table_args__ = (
+        db.Index('idx_device_sensor_time', 'device_key', 'sensor_type_id', 'timestamp'),
+        db.Index('idx_reading_time', 'timestamp'),
+    )
+
+class IngestSequence(db.Model):
+    """Sequence numbers already stored per device (the unique key behind ingest dedupe)"""
+    device_key = db.Column(db.Integer, db.ForeignKey('device_key.id'), primary_key=True)
+    seq = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('idx_ingest_sequence_received', 'received_at'),
+    )
+
+class SensorRollup(db.Model):
+    """Per-device, per-sensor aggregates at 1-minute / 1-hour / 1-day resolution"""
+    id = db.Column(db.Integer, primary_key=True)
+    resolution = db.Column(db.Integer, nullable=False)  # bucket width in seconds
+    device_id = db.Column(db.String(50), nullable=False)
+    sensor_type = db.Column(db.String(50), nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)  # UTC
+    unit = db.Column(db.String(10), nullable=False)
+    reading_count = db.Column(db.Integer, nullable=False, default=0)
+    value_sum = db.Column(db.Float, nullable=False, default=0.0)
+    value_min = db.Column(db.Float, nullable=False)
+    value_max = db.Column(db.Float, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('resolution', 'device_id', 'sensor_type', 'bucket_start', name='uq_rollup_bucket'),
+        db.Index('idx_rollup_resolution_time', 'resolution', 'bucket_start'),
+    )
+
+class IngestCounter(db.Model):
+    """Reading counts kept up to date on ingest: all-time ('total') and per Iran calendar day"""
+    device_id = db.Column(db.String(50), primary_key=True)
+    period = db.Column(db.String(10), primary_key=True)  # 'total' or Iran date YYYY-MM-DD
+    reading_count = db.Column(db.BigInteger, nullable=False, default=0)
+    first_at = db.Column(db.DateTime, nullable=False)  # UTC
+    last_at = db.Column(db.DateTime, nullable=False)   # UTC
+
+class Alert(db.Model):
+    """Alerts raised by the streaming rules engine; open while resolved_at is NULL"""
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(50), nullable=False)
+    sensor_type = db.Column(db.String(50), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)      # threshold, rate_of_change or anomaly
+    severity = db.Column(db.String(10), nullable=False)  # warning or critical
+    value = db.Column(db.Float, nullable=False)          # reading that triggered it
+    detail = db.Column(db.Float, nullable=True)          # limit crossed, rate per minute or z-score
+    message = db.Column(db.String(200), nullable=False)
+    triggered_at = db.Column(db.DateTime, nullable=False)  # UTC, reading timestamp
+    resolved_at = db.Column(db.DateTime, nullable=True)
+    opened_by = db.Column(db.String(80), nullable=True)    # host:pid of the worker whose state holds it open
+    
+    __table_args__ = (
+        db.Index('idx_alert_series', 'device_id', 'sensor_type', 'kind', 'resolved_at'),
+        db.Index('idx_alert_triggered', 'triggered_at'),
+    )
+
+class RollupWatermark(db.Model):
+    """Highest sensor_reading id already folded into the rollup tables"""
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+class IngestCheckpoint(db.Model):
+    """Ingest progress markers: replay offsets of spool segments ('spool:<segment>')
+    and the counter backfill claim ('ingest_counters', position = last reading id counted)"""
+    name = db.Column(db.String(100), primary_key=True)
+    position = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+# --- Partitioned Storage (PostgreSQL) ---
+def create_partitioned_reading_table(conn, name: str = 'sensor_reading'):
+    """Create sensor_reading as a RANGE-partitioned table (new PostgreSQL databases only).
+    
+    A partitioned table's primary key must include the partition key, so the
+    table key is (id, timestamp) while the ORM keeps using id alone.
+    """
+    DeviceKey.__table__.create(conn, checkfirst=True)
+    SensorType.__table__.create(conn, checkfirst=True)
+    conn.execute(db.text(
+        f'CREATE TABLE IF NOT EXISTS {name} ('
+        'id SERIAL, '
+        'device_key INTEGER NOT NULL REFERENCES device_key (id), '
+        'sensor_type_id SMALLINT NOT NULL REFERENCES sensor_type (id), '
+        'value DOUBLE PRECISION NOT NULL, '
+        'timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL, '
+        'PRIMARY KEY (id, timestamp)'
+        ') PARTITION BY RANGE (timestamp)'
+    ))
+    conn.execute(db.text(
+        f'CREATE TABLE IF NOT EXISTS {name}_default PARTITION OF {name} DEFAULT'))
+
+def migrate_to_dictionary_schema():
+    """Convert a sensor_reading table with string columns to the dictionary-encoded schema.
+    
+    The new table is built as sensor_reading_new and swapped in within one
+    transaction (an explicit BEGIN IMMEDIATE on SQLite, whose driver would
+    otherwise run the DDL outside it), so a crash leaves the old table intact.
+    A sensor_reading_legacy table left behind by an interrupted earlier
+    migration is merged in and dropped. Reading ids are preserved so the rollup
+    watermark and the counter backfill checkpoint stay valid.
+    """
+    inspector = db.inspect(db.engine)
+    if not inspector.has_table('sensor_reading'):
+        return
+    if 'device_key' in {column['name'] for column in inspector.get_columns('sensor_reading')} \
+            and not inspector.has_table('sensor_reading_legacy'):
+        return
+    
+    postgres = db.engine.dialect.name == 'postgresql'
+    with db.engine.connect() as conn:
+        # Serialize concurrent workers, then re-check under the lock
+        if postgres:
+            conn.execute(db.text('SELECT pg_advisory_xact_lock(1502)'))
+        else:
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+        inspector = db.inspect(conn)
+        if 'device_key' not in {column['name'] for column in inspector.get_columns('sensor_reading')}:
+            source, target = 'sensor_reading', 'sensor_reading_new'
+        elif inspector.has_table('sensor_reading_legacy'):
+            source, target = 'sensor_reading_legacy', 'sensor_reading'
+        else:
+            conn.rollback()
+            return
+        
+        app.logger.info(f"Migrating {source} to the dictionary-encoded schema")
+        db.metadata.create_all(conn, tables=[DeviceKey.__table__, SensorType.__table__])
+        conn.execute(db.text(
+            'INSERT INTO sensor_type (name, unit) '
+            f'SELECT DISTINCT l.sensor_type, l.unit FROM {source} l WHERE NOT EXISTS ('
+            'SELECT 1 FROM sensor_type st WHERE st.name = l.sensor_type AND st.unit = l.unit)'))
+        conn.execute(db.text(
+            'INSERT INTO device_key (device_id) '
+            f'SELECT DISTINCT l.device_id FROM {source} l WHERE NOT EXISTS ('
+            'SELECT 1 FROM device_key dk WHERE dk.device_id = l.device_id)'))
+        
+        if target == 'sensor_reading_new':
+            # Index names are schema-wide, so free them for the new table
+            for index in inspector.get_indexes('sensor_reading'):
+                conn.execute(db.text(f"DROP INDEX IF EXISTS {index['name']}"))
+            conn.execute(db.text('DROP TABLE IF EXISTS sensor_reading_new'))
+            partitioned = PARTITION_READINGS and postgres
+            if partitioned:
+                create_partitioned_reading_table(conn, 'sensor_reading_new')
+            else:
+                metadata = db.MetaData()
+                DeviceKey.__table__.to_metadata(metadata)
+                SensorType.__table__.to_metadata(metadata)
+                SensorReading.__table__.to_metadata(metadata, name='sensor_reading_new').create(conn)
+            resume_filter = ''
+        else:
+            partitioned = postgres and conn.execute(db.text(
+                'SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid '
+                "WHERE c.relname = 'sensor_reading'"
+            )).first() is not None
+            resume_filter = 'AND NOT EXISTS (SELECT 1 FROM sensor_reading r WHERE r.id = l.id)'
+        
+        # A partitioned table cannot hold readings without a timestamp
+        timestamp_filter = 'AND l.timestamp IS NOT NULL' if partitioned else ''
+        migrated = conn.execute(db.text(
+            f'INSERT INTO {target} (id, device_key, sensor_type_id, value, timestamp) '
+            f'SELECT l.id, dk.id, st.id, l.value, l.timestamp FROM {source} l '
+            'JOIN device_key dk ON dk.device_id = l.device_id '
+            'JOIN sensor_type st ON st.name = l.sensor_type AND st.unit = l.unit '
+            f'WHERE 1 = 1 {resume_filter} {timestamp_filter}'
+        )).rowcount
+        conn.execute(db.text(f'DROP TABLE {source}'))
+        
+        if target == 'sensor_reading_new':
+            conn.execute(db.text('ALTER TABLE sensor_reading_new RENAME TO sensor_reading'))
+            if partitioned:
+                conn.execute(db.text('ALTER TABLE sensor_reading_new_default RENAME TO sensor_reading_default'))
+                for index in SensorReading.__table__.indexes:
+                    index.create(conn)
+        
+        if postgres:
+            conn.execute(db.text(
+                "SELECT setval(pg_get_serial_sequence('sensor_reading', 'id'), "
+                "COALESCE((SELECT max(id) FROM sensor_reading), 1))"))
+        conn.commit()
+    
+    app.logger.info(f"Migrated {migrated} readings to the dictionary-encoded schema")
+
+def readings_partitioned() -> bool:
+    """True when sensor_reading is a native partitioned table"""
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return db.session.execute(db.text(
+        'SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid '
+        "WHERE c.relname = 'sensor_reading'"
+    )).first() is not None
+
+def month_start(year: int, month: int) -> datetime.date:
+    """First day of a month, normalizing month overflow in either direction"""
+    year += (month - 1) // 12
+    month = (month - 1) % 12 + 1
+    return datetime.date(year, month, 1)
+
+def ensure_reading_partitions() -> int:
+    """Create monthly partitions from last month up to PARTITION_MONTHS_AHEAD ahead, plus
+    every month that has rows sitting in the DEFAULT partition (legacy or early data).
+    
+    Each month is its own transaction, so one failure does not hold back the others.
+    Returns the number of partitions created.
+    """
+    today = datetime.datetime.utcnow().date()
+    first = month_start(today.year, today.month - 1)
+    last = month_start(today.year, today.month + PARTITION_MONTHS_AHEAD)
+    with db.engine.connect() as conn:
+        oldest, newest = conn.execute(db.text(
+            'SELECT min(timestamp), max(timestamp) FROM sensor_reading_default')).one()
+    if oldest is not None:
+        first = min(first, month_start(oldest.year, oldest.month))
+        last = max(last, month_start(newest.year, newest.month))
+    
+    created = 0
+    lower = first
+    while lower <= last:
+        upper = month_start(lower.year, lower.month + 1)
+        try:
+            if create_reading_partition(lower, upper):
+                created += 1
+        except Exception as e:
+            app.logger.error(f"Creating the {lower:%Y-%m} reading partition failed: {e}")
+        lower = upper
+    return created
+
+def create_reading_partition(lower: datetime.date, upper: datetime.date) -> bool:
+    """Create one monthly partition, moving its rows out of DEFAULT first.
+    
+    PostgreSQL refuses a new partition whose range DEFAULT still holds rows for,
+    so such months are built as a plain table, filled from DEFAULT and attached.
+    """
+    name = f"sensor_reading_p{lower.strftime('%Y%m')}"
+    bounds = f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+    in_range = {'lower': lower, 'upper': upper}
+    with db.engine.begin() as conn:
+        # Serialize workers creating partitions at startup
+        conn.execute(db.text('SELECT pg_advisory_xact_lock(1503)'))
+        if conn.execute(db.text('SELECT to_regclass(:name)'), {'name': name}).scalar() is not None:
+            return False
+        
+        if conn.execute(db.text(
+                'SELECT 1 FROM sensor_reading_default WHERE timestamp >= :lower AND timestamp < :upper LIMIT 1'),
+                in_range).first() is None:
+            conn.execute(db.text(f'CREATE TABLE {name} PARTITION OF sensor_reading {bounds}'))
+            return True
+        
+        conn.execute(db.text(f'CREATE TABLE {name} (LIKE sensor_reading INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+        moved = conn.execute(db.text(
+            'WITH moved AS (DELETE FROM sensor_reading_default '
+            'WHERE timestamp >= :lower AND timestamp < :upper RETURNING *) '
+            f'INSERT INTO {name} SELECT * FROM moved'), in_range).rowcount
+        conn.execute(db.text(f'ALTER TABLE sensor_reading ATTACH PARTITION {name} {bounds}'))
+    app.logger.info(f"Partition {name}: moved {moved} readings out of the default partition")
+    return True
+
+def monthly_reading_partitions() -> List[tuple]:
+    """(name, lower, upper) of every monthly partition, oldest first"""
+    names = db.session.execute(db.text(
+        'SELECT c.relname FROM pg_inherits i '
+        'JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent '
+        "WHERE p.relname = 'sensor_reading' AND c.relname LIKE 'sensor_reading_p%'"
+    )).scalars().all()
+    partitions = []
+    for name in names:
+        lower = datetime.datetime.strptime(name[-6:], '%Y%m')
+        upper = datetime.datetime.combine(month_start(lower.year, lower.month + 1), datetime.time())
+        partitions.append((name, lower, upper))
+    return sorted(partitions, key=lambda p: p[1])
+
+def move_legacy_checkpoints():
+    """Move ingest checkpoints that older releases kept in rollup_watermark to ingest_checkpoint"""
+    legacy = db.session.query(RollupWatermark).filter(db.or_(
+        RollupWatermark.name.like('spool:%'), RollupWatermark.name == 'ingest_counters'
+    )).all()
+    if not legacy:
+        return
+    for row in legacy:
+        if db.session.get(IngestCheckpoint, row.name) is None:
+            db.session.add(IngestCheckpoint(name=row.name, position=row.last_id, updated_at=row.updated_at))
+        db.session.delete(row)
+    db.session.commit()
+
+# Create tables
+with app.app_context():
+    try:
+        migrate_to_dictionary_schema()
+        if PARTITION_READINGS and db.engine.dialect.name == 'postgresql':
+            Device.__table__.create(db.engine, checkfirst=True)
+            with db.engine.begin() as conn:
+                create_partitioned_reading_table(conn)
+        db.create_all()
+        # create_all skips indexes and columns added to tables that already exist
+        for index in SensorReading.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+        if 'opened_by' not in {column['name'] for column in db.inspect(db.engine).get_columns('alert')}:
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(db.text('ALTER TABLE alert ADD COLUMN opened_by VARCHAR(80)'))
+            except Exception:
+                pass  # added by a concurrent worker
+        try:
+            move_legacy_checkpoints()
+        except Exception:
+            db.session.rollback()  # moved by a concurrent worker
+        # Monthly partitions must exist before the first write lands in DEFAULT
+        if readings_partitioned():
+            ensure_reading_partitions()
+            db.session.rollback()
+        app.logger.info(f"Database initialized successfully. Environment: {ENV}")
+        if ENV == 'development':
+            app.logger.info(f"SQLite Database at: {DATABASE_PATH}")
+    except Exception as e:
+        app.logger.error(f"Database initialization failed: {e}")
+
+# --- Reading Dictionary ---
+DecodedReading = namedtuple('DecodedReading', 'id device_id sensor_type value unit timestamp')
+
+class ReadingDictionary:
+    """Bidirectional in-process lookup for the device_key and sensor_type tables.
+    
+    Both tables are tiny and append-only, so they are loaded whole and only
+    reloaded when a key or id this process has not seen yet shows up.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._device_keys = {}   # device_id -> key
+        self._device_ids = {}    # key -> device_id
+        self._type_ids = {}      # (name, unit) -> id
+        self._types = {}         # id -> (name, unit)
+        self._ids_by_name = {}   # name -> [id, ...]
+    
+    def refresh(self):
+        with db.engine.connect() as conn:
+            devices = conn.execute(db.select(DeviceKey.id, DeviceKey.device_id)).all()
+            types = conn.execute(db.select(SensorType.id, SensorType.name, SensorType.unit)).all()
+        
+        ids_by_name = {}
+        for type_id, name, _ in types:
+            ids_by_name.setdefault(name, []).append(type_id)
+        with self._lock:
+            self._device_keys = {device_id: key for key, device_id in devices}
+            self._device_ids = {key: device_id for key, device_id in devices}
+            self._type_ids = {(name, unit): type_id for type_id, name, unit in types}
+            self._types = {type_id: (name, unit) for type_id, name, unit in types}
+            self._ids_by_name = ids_by_name
+    
+    def _insert_missing(self, device_ids, type_pairs):
+        """Add unknown entries in their own committed transaction.
+        
+        Runs before the caller's session writes anything, so a later rollback
+        of the readings never leaves this cache pointing at uncommitted keys.
+        """
+        with db.engine.begin() as conn:
+            if device_ids:
+                stmt, _, _ = upsert_insert(DeviceKey.__table__)
+                conn.execute(stmt.on_conflict_do_nothing(index_elements=['device_id']),
+                             [{'device_id': device_id} for device_id in device_ids])
+            if type_pairs:
+                stmt, _, _ = upsert_insert(SensorType.__table__)
+                conn.execute(stmt.on_conflict_do_nothing(index_elements=['name', 'unit']),
+                             [{'name': name, 'unit': unit} for name, unit in type_pairs])
+        self.refresh()
+    
+    def encode_rows(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Turn reading row dicts into insert-ready sensor_reading rows"""
+        missing_devices = {row['device_id'] for row in rows} - self._device_keys.keys()
+        missing_types = {(row['sensor_type'], row['unit']) for row in rows} - self._type_ids.keys()
+        if missing_devices or missing_types:
+            self.refresh()
+            missing_devices -= self._device_keys.keys()
+            missing_types -= self._type_ids.keys()
+            if missing_devices or missing_types:
+                self._insert_missing(missing_devices, missing_types)
+        return self._encode(rows)
+    
+    def encode_known(self, rows: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        """encode_rows without any database access; None when a key is not cached yet"""
+        try:
+            return self._encode(rows)
+        except KeyError:
+            return None
+    
+    def _encode(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        device_keys = self._device_keys
+        type_ids = self._type_ids
+        return [{
+            'device_key': device_keys[row['device_id']],
+            'sensor_type_id': type_ids[(row['sensor_type'], row['unit'])],
+            'value': row['value'],
+            'timestamp': row['timestamp']
+        } for row in rows]
+    
+    def device_id(self, key: int) -> str:
+        if key not in self._device_ids:
+            self.refresh()
+        return self._device_ids[key]
+    
+    def sensor_type(self, type_id: int) -> tuple:
+        """(name, unit) for a sensor_type id"""
+        if type_id not in self._types:
+            self.refresh()
+        return self._types[type_id]
+    
+    def decode(self, row) -> DecodedReading:
+        """Expand an (id, device_key, sensor_type_id, value, timestamp) row"""
+        name, unit = self.sensor_type(row[2])
+        return DecodedReading(row[0], self.device_id(row[1]), name, row[3], unit, row[4])
+    
+    def reading_filters(self, device_id: Optional[str] = None,
+                        sensor_type: Optional[str] = None) -> list:
+        """Index-friendly sensor_reading filters for the given device id and sensor type name"""
+        filters = []
+        if device_id:
+            if device_id not in self._device_keys:
+                self.refresh()
+            # -1 never matches, so unknown devices still yield an empty result
+            filters.append(SensorReading.device_key == self._device_keys.get(device_id, -1))
+        if sensor_type:
+            if sensor_type not in self._ids_by_name:
+                self.refresh()
+            filters.append(SensorReading.sensor_type_id.in_(self._ids_by_name.get(sensor_type, [-1])))
+        return filters
+
+reading_dictionary = ReadingDictionary()
+
+# --- Helper Functions ---
+def validate_sensor_data(data):
+    """Validate sensor data (fallback when msgspec is not installed).
+    
+    Returns (is_valid, error message, JSON path of the offending value) with the
+    same paths msgspec reports, e.g. '$.sensors[0].value'.
+    """
+    if not isinstance(data, dict):
+        return False, "Data must be a JSON object", '$'
+    
+    required_fields = ['device_id', 'sensors']
+    for field in required_fields:
+        if field not in data:
+            return False, f"Missing required field: {field}", f'$.{field}'
+    
+    if not isinstance(data['sensors'], list):
+        return False, "Sensors must be an array", '$.sensors'
+    
+    if len(data['sensors']) == 0:
+        return False, "At least one sensor reading required", '$.sensors'
+    
+    for i, sensor in enumerate(data['sensors']):
+        path = f'$.sensors[{i}]'
+        if not isinstance(sensor, dict):
+            return False, f"Sensor {i} must be an object", path
+        
+        required_sensor_fields = ['type', 'value', 'unit']
+        for field in required_sensor_fields:
+            if field not in sensor:
+                return False, f"Sensor {i} missing field: {field}", f'{path}.{field}'
+        
+        if not isinstance(sensor['value'], (int, float)) or isinstance(sensor['value'], bool):
+            return False, f"Sensor {i} value must be a number", f'{path}.value'
+        
+        # Same limits as the column sizes (and the msgspec structs)
+        if not isinstance(sensor['type'], str) or not sensor['type'] or len(sensor['type']) > 50:
+            return False, f"Sensor {i} type must be a non-empty string (max 50 chars)", f'{path}.type'
+        
+        if not isinstance(sensor['unit'], str) or len(sensor['unit']) > 10:
+            return False, f"Sensor {i} unit must be a string (max 10 chars)", f'{path}.unit'
+    
+    seq = data.get('seq')
+    if seq is not None and (not isinstance(seq, int) or isinstance(seq, bool) or seq < 0):
+        return False, "seq must be a non-negative integer", '$.seq'
+    
+    return True, None, None
+
+# --- Payload Decoding ---
+class PayloadError(ValueError):
+    """Rejected ingest payload; `field` is the JSON path of the offending value when known"""
+    
+    def __init__(self, message: str, field: Optional[str] = None):
+        super().__init__(message)
+        self.message = message
+        self.field = field
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {'error': self.message, 'field': self.field}
+
+if msgspec is not None:
+    class SensorPayload(msgspec.Struct):
+        """One sensor entry (extra keys such as `sensor` or `status` are ignored)"""
+        type: Annotated[str, msgspec.Meta(min_length=1, max_length=50)]
+        value: float
+        unit: Annotated[str, msgspec.Meta(max_length=10)]
+    
+    class FramePayload(msgspec.Struct):
+        """One device frame, decoded and type-checked in a single C pass"""
+        device_id: Annotated[str, msgspec.Meta(min_length=1, max_length=50)]
+        sensors: Annotated[List[SensorPayload], msgspec.Meta(min_length=1)]
+        timestamp: Any = None
+        seq: Optional[Annotated[int, msgspec.Meta(ge=0)]] = None
+        uptime_ms: Any = None
+    
+    frame_decoder = msgspec.json.Decoder(FramePayload)
+    msgpack_frame_decoder = msgspec.msgpack.Decoder(FramePayload)
+    json_decoder = msgspec.json.Decoder()
+else:
+    SensorPayload = namedtuple('SensorPayload', 'type value unit')
+    FramePayload = namedtuple('FramePayload', 'device_id sensors timestamp seq uptime_ms', defaults=(None, None))
+
+def msgspec_payload_error(e: Exception) -> PayloadError:
+    # "Expected `float`, got `str` - at `$.sensors[0].value`"; malformed input has no path
+    message, _, path = str(e).partition(' - at `')
+    if not isinstance(e, msgspec.ValidationError):
+        return PayloadError(message, path.rstrip('`') or None)
+    path = path.rstrip('`') or '$'
+    # Point at the missing key itself, like the fallback validator
+    missing = message.partition('Object missing required field `')[2]
+    if missing:
+        path = f"{path}.{missing.rstrip('`')}"
+    return PayloadError(message, path)
+
+def decode_json_body(body: bytes):
+    """Untyped JSON decode of a raw request body (PayloadError when malformed)"""
+    if not body:
+        raise PayloadError('No JSON data received')
+    try:
+        return json_decoder.decode(body) if msgspec is not None else json.loads(body)
+    except ValueError as e:
+        raise PayloadError(f'Invalid JSON: {e}')
+
+def coerce_frame(data) -> FramePayload:
+    """Typed frame from an already-parsed JSON value (PayloadError when invalid)"""
+    if msgspec is not None:
+        try:
+            return msgspec.convert(data, FramePayload)
+        except ValueError as e:
+            raise msgspec_payload_error(e)
+    
+    is_valid, error_msg, field = validate_sensor_data(data)
+    if not is_valid:
+        raise PayloadError(error_msg, field)
+    device_id = data['device_id']
+    if not isinstance(device_id, str) or not device_id or len(device_id) > 50:
+        raise PayloadError('device_id must be a non-empty string (max 50 chars)', '$.device_id')
+    return FramePayload(
+        device_id,
+        [SensorPayload(sensor['type'], float(sensor['value']), sensor['unit']) for sensor in data['sensors']],
+        data.get('timestamp'),
+        data.get('seq'),
+        data.get('uptime_ms')
+    )
+
+def decode_frame_body(body: bytes) -> FramePayload:
+    """Typed frame straight from a raw request body (PayloadError when invalid)"""
+    if msgspec is None or not body:
+        return coerce_frame(decode_json_body(body))
+    try:
+        return frame_decoder.decode(body)
+    except ValueError as e:
+        raise msgspec_payload_error(e)
+
+def decode_msgpack_frame(body: bytes) -> FramePayload:
+    """Typed frame from a MessagePack body with the same keys as the JSON frame"""
+    if not body:
+        raise PayloadError('No MessagePack data received')
+    try:
+        return msgpack_frame_decoder.decode(body)
+    except ValueError as e:
+        raise msgspec_payload_error(e)
+
+# Packed binary frame, little-endian (the ESP32's byte order):
+#   version u8 (= 1) | flags u8 (reserved, 0) | device MAC 6 bytes | seq u32 (0 = none) |
+#   timestamp u32 (epoch seconds, 0 = use the server's time) | count u8 |
+#   count x (sensor code u8, value f32)
+# The firmware's six sensors pack into 47 bytes against ~730 bytes of JSON.
+PACKED_FRAME_VERSION = 1
+PACKED_HEADER = struct.Struct('<BB6sIIB')
+PACKED_READING = struct.Struct('<Bf')
+PACKED_SENSOR_CODES = {
+    1: ('temperature', 'C'),
+    2: ('humidity', '%'),
+    3: ('pressure', 'hPa'),
+    4: ('altitude', 'm'),
+    5: ('air_quality', 'raw'),
+    6: ('light_level', 'raw'),
+}
+
+def decode_packed_frame(body: bytes) -> FramePayload:
+    """Typed frame from a packed binary record (PayloadError when malformed)"""
+    if len(body) < PACKED_HEADER.size:
+        raise PayloadError(f'Packed frame is {len(body)} bytes, header needs {PACKED_HEADER.size}')
+    version, _, mac, seq, timestamp, count = PACKED_HEADER.unpack_from(body)
+    if version != PACKED_FRAME_VERSION:
+        raise PayloadError(f'Unsupported packed frame version {version}', '$.version')
+    if count == 0:
+        raise PayloadError('Packed frame has no readings', '$.sensors')
+    expected = PACKED_HEADER.size + count * PACKED_READING.size
+    if len(body) != expected:
+        raise PayloadError(f'Packed frame with {count} readings must be {expected} bytes, got {len(body)}')
+    
+    fields = struct.unpack_from('<' + PACKED_READING.format[1:] * count, body, PACKED_HEADER.size)
+    sensors = []
+    for i in range(count):
+        code, value = fields[2 * i], fields[2 * i + 1]
+        sensor = PACKED_SENSOR_CODES.get(code)
+        if sensor is None:
+            raise PayloadError(f'Unknown sensor code {code}', f'$.sensors[{i}].code')
+        # Shortest decimal that round-trips the float32 (23.45, not 23.450000762939453)
+        sensors.append(SensorPayload(sensor[0], float('%.7g' % value), sensor[1]))
+    
+    return FramePayload(mac.hex(':').upper(), sensors, timestamp or None, seq or None)
+
+# Content types accepted by /api/sensors (+json types are treated as JSON)
+FRAME_DECODERS = {
+    'application/json': decode_frame_body,
+    'application/vnd.enviromon.frame': decode_packed_frame,
+}
+if msgspec is not None:
+    FRAME_DECODERS['application/msgpack'] = decode_msgpack_frame
+    FRAME_DECODERS['application/x-msgpack'] = decode_msgpack_frame
+
+def frame_decoder_for(mimetype: str):
+    """Decoder for a request mimetype, or None when the type is not accepted"""
+    if mimetype.endswith('+json'):
+        return decode_frame_body
+    return FRAME_DECODERS.get(mimetype)
+
+def frame_timestamp(frame: FramePayload, received_at: datetime.datetime) -> datetime.datetime:
+    """The frame's device timestamp, or `received_at` when absent or implausible.
+    
+    Device timestamps are trusted only from DEVICE_MAX_BACKFILL before receipt up
+    to DEVICE_CLOCK_SKEW after it. The firmware fills `timestamp` with millis()
+    uptime, which past ~11 days would otherwise pass for epoch seconds.
+    """
+    if is_uptime_counter(frame.timestamp, frame.uptime_ms):
+        return received_at
+    timestamp = parse_frame_timestamp(frame.timestamp)
+    if timestamp is None \
+            or timestamp > received_at + datetime.timedelta(seconds=DEVICE_CLOCK_SKEW) \
+            or timestamp < received_at - datetime.timedelta(seconds=DEVICE_MAX_BACKFILL):
+        return received_at
+    return timestamp
+
+def is_uptime_counter(timestamp, uptime_ms) -> bool:
+    """True when a numeric timestamp is the same millis() reading as the frame's uptime_ms"""
+    numeric = (int, float)
+    if not isinstance(timestamp, numeric) or not isinstance(uptime_ms, numeric) \
+            or isinstance(timestamp, bool) or isinstance(uptime_ms, bool):
+        return False
+    # Both are read from millis() a few statements apart in the firmware
+    return abs(timestamp - uptime_ms) <= 1000
+
+def build_frame_rows(frame: FramePayload, received_at: datetime.datetime):
+    """Range-check a typed frame and build its reading rows in one pass.
+    
+    Returns (rows, rejected) where rejected lists the readings dropped in 'drop'
+    mode; in 'reject' mode the first bad reading raises PayloadError instead.
+    Rows carry the frame's `seq` (or None) for deduplication.
+    """
+    rows = []
+    rejected = []
+    device_id = frame.device_id
+    seq = frame.seq
+    timestamp = frame_timestamp(frame, received_at)
+    ranges = SENSOR_RANGES if SENSOR_RANGE_MODE != 'off' else {}
+    
+    for i, sensor in enumerate(frame.sensors):
+        value = sensor.value
+        bounds = ranges.get(sensor.type)
+        if not math.isfinite(value):
+            error = PayloadError(f'{sensor.type} value is not a finite number', f'$.sensors[{i}].value')
+        elif bounds and not bounds[0] <= value <= bounds[1]:
+            error = PayloadError(f'{sensor.type} value {value} outside [{bounds[0]}, {bounds[1]}]',
+                                 f'$.sensors[{i}].value')
+        else:
+            rows.append({
+                'device_id': device_id,
+                'sensor_type': sensor.type,
+                'value': value,
+                'unit': sensor.unit,
+                'timestamp': timestamp,
+                'seq': seq
+            })
+            continue
+        
+        if SENSOR_RANGE_MODE == 'reject':
+            raise error
+        rejected.append(error.to_dict())
+    
+    return rows, rejected
+
+def validate_sensor_frames(frames):
+    """Validate a batch of frames in one pass.
+    
+    Returns (rows, frame_results) where rows are insert-ready dicts for every
+    accepted frame, oldest first so late frames are inserted in time order, and
+    frame_results holds one accept/reject entry per frame.
+    """
+    rows = []
+    frame_results = []
+    now = datetime.datetime.utcnow()
+    
+    for index, data in enumerate(frames):
+        try:
+            frame = coerce_frame(data)
+            frame_rows, rejected = build_frame_rows(frame, now)
+        except PayloadError as e:
+            frame_results.append({'index': index, 'accepted': False, **e.to_dict()})
+            continue
+        
+        if not frame_rows:
+            frame_results.append({'index': index, 'accepted': False,
+                                  'error': 'No reading passed validation', 'rejected_readings': rejected})
+            continue
+        
+        rows.extend(frame_rows)
+        result = {
+            'index': index,
+            'accepted': True,
+            'device_id': frame.device_id,
+            'readings': len(frame_rows)
+        }
+        if rejected:
+            result['rejected_readings'] = rejected
+        frame_results.append(result)
+    
+    rows.sort(key=itemgetter('timestamp'))
+    return rows, frame_results
+
+def register_devices(first_seen_by_device: Dict[str, datetime.datetime], session=None):
+    """Insert device rows for ids this process has not seen yet (existing rows are left alone).
+    
+    last_seen of known devices is not touched here: the presence tracker
+    writes it back in batches.
+    """
+    if not first_seen_by_device:
+        return
+    
+    session = session or db.session
+    stmt, _, _ = upsert_insert(Device.__table__)
+    registered = session.execute(
+        stmt.on_conflict_do_nothing(index_elements=['id']).returning(Device.__table__.c.id),
+        [{'id': device_id, 'first_seen': seen, 'last_seen': seen, 'is_active': True}
+         for device_id, seen in first_seen_by_device.items()]
+    ).scalars().all()
+    if registered:
+        app.logger.info(f"New devices registered: {registered}")
+        device_registry.invalidate()
+
+def get_device_status_info(device_id: str) -> Dict[str, Any]:
+    """Get device status info including latest readings - FIXED VERSION"""
+    device = device_registry.get_many([device_id]).get(device_id)
+    if not device:
+        return None
+    
+    last_seen = presence_tracker.last_seen(device_id)
+    if last_seen is None:
+        # Offline device registered by another worker since this one started
+        last_seen = db.session.query(Device.last_seen).filter(Device.id == device_id).scalar()
+    
+    # Latest reading for each sensor type (served from the latest-value cache)
+    latest_readings = latest_cache.get_latest(device_id)
+    utc_iso, iran, _ = format_iran_columns([reading['timestamp'] for reading in latest_readings])
+    online_after = presence_tracker.online_after()
+    
+    sensor_status = {}
+    for i, reading in enumerate(latest_readings):
+        sensor_status[reading['sensor_type']] = {
+            'value': reading['value'],
+            'unit': reading['unit'],
+            'timestamp': utc_iso[i],
+            'timestamp_iran': iran[i],
+            'timestamp_formatted': iran[i][:-5],
+            'is_online': reading['timestamp'] > online_after
+        }
+    
+    return {
+        'device_id': device_id,
+        'name': device['name'] or f'Device-{device_id[-8:]}',
+        'location': device['location'],
+        'is_online': last_seen is not None and last_seen > online_after,
+        'last_seen': last_seen.isoformat() if last_seen else None,
+        'last_seen_iran': format_iran_time(last_seen) if last_seen else None,
+        'sensors': sensor_status
+    }
+
+# --- Aggregation Helpers ---
+def choose_bucket_seconds(hours: int, points: int) -> int:
+    """Smallest standard bucket width that keeps the range within `points` buckets"""
+    target = (hours * 3600) / max(points, 1)
+    for width in AGGREGATE_BUCKETS:
+        if width >= target:
+            return width
+    return AGGREGATE_BUCKETS[-1]
+
+def bucket_expression(column, width: int):
+    """SQL expression mapping a timestamp column to its bucket number"""
+    if db.engine.dialect.name == 'postgresql':
+        return db.func.floor(db.extract('epoch', column) / width)
+    # SQLite stores naive UTC datetimes as text
+    return db.cast(db.func.strftime('%s', column), db.Integer) // width
+
+def choose_rollup_resolution(bucket_seconds: int) -> Optional[int]:
+    """Coarsest rollup resolution that evenly divides the requested bucket width"""
+    for resolution in sorted(ROLLUP_RESOLUTIONS, reverse=True):
+        if bucket_seconds % resolution == 0:
+            return resolution
+    return None
+
+RawGroup = namedtuple('RawGroup', 'device_id sensor_type bucket unit min max sum count')
+
+def aggregate_readings(start_time: datetime.datetime, bucket_seconds: int,
+                       device_id: Optional[str] = None,
+                       sensor_type: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Bucketed min/max/sum/count per device and sensor type.
+    
+    Uses the coarsest suitable rollup table for everything already rolled up
+    and only aggregates raw readings newer than the rollup watermark.
+    """
+    groups = {}
+    
+    def merge(row):
+        key = (row.device_id, row.sensor_type, int(row.bucket))
+        group = groups.get(key)
+        if group is None:
+            groups[key] = {
+                'device_id': row.device_id, 'sensor_type': row.sensor_type, 'bucket': int(row.bucket),
+                'unit': row.unit, 'min': row.min, 'max': row.max,
+                'sum': float(row.sum), 'count': int(row.count)
+            }
+        else:
+            group['unit'] = max(group['unit'], row.unit)
+            group['min'] = min(group['min'], row.min)
+            group['max'] = max(group['max'], row.max)
+            group['sum'] += float(row.sum)
+            group['count'] += int(row.count)
+    
+    raw_filters = [SensorReading.timestamp >= start_time]
+    raw_filters.extend(reading_dictionary.reading_filters(device_id, sensor_type))
+    
+    resolution = choose_rollup_resolution(bucket_seconds) if ROLLUP_ENABLED else None
+    if resolution:
+        watermark = get_rollup_watermark()
+        raw_filters.append(SensorReading.id > watermark)
+        
+        # Rollups hold whole buckets, so the first one may start up to one step before start_time
+        rollup_start = datetime.datetime.utcfromtimestamp(
+            int(start_time.replace(tzinfo=pytz.utc).timestamp()) // resolution * resolution)
+        rollup_filters = [SensorRollup.resolution == resolution, SensorRollup.bucket_start >= rollup_start]
+        if device_id:
+            rollup_filters.append(SensorRollup.device_id == device_id)
+        if sensor_type:
+            rollup_filters.append(SensorRollup.sensor_type == sensor_type)
+        
+        bucket = bucket_expression(SensorRollup.bucket_start, bucket_seconds).label('bucket')
+        for row in db.session.query(
+            SensorRollup.device_id,
+            SensorRollup.sensor_type,
+            bucket,
+            db.func.max(SensorRollup.unit).label('unit'),
+            db.func.min(SensorRollup.value_min).label('min'),
+            db.func.max(SensorRollup.value_max).label('max'),
+            db.func.sum(SensorRollup.value_sum).label('sum'),
+            db.func.sum(SensorRollup.reading_count).label('count')
+        ).filter(*rollup_filters)\
+         .group_by(SensorRollup.device_id, SensorRollup.sensor_type, bucket):
+            merge(row)
+    
+    bucket = bucket_expression(SensorReading.timestamp, bucket_seconds).label('bucket')
+    for row in db.session.query(
+        SensorReading.device_key,
+        SensorReading.sensor_type_id,
+        bucket,
+        db.func.min(SensorReading.value).label('min'),
+        db.func.max(SensorReading.value).label('max'),
+        db.func.sum(SensorReading.value).label('sum'),
+        db.func.count(SensorReading.id).label('count')
+    ).filter(*raw_filters)\
+     .group_by(SensorReading.device_key, SensorReading.sensor_type_id, bucket):
+        name, unit = reading_dictionary.sensor_type(row.sensor_type_id)
+        merge(RawGroup(reading_dictionary.device_id(row.device_key), name, row.bucket,
+                       unit, row.min, row.max, row.sum, row.count))
+    
+    return [groups[key] for key in sorted(groups)]
+
+def lttb_downsample(points: List[tuple], threshold: int) -> List[tuple]:
+    """Largest-Triangle-Three-Buckets downsampling of (x, y, ...) tuples sorted by x"""
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return points
+    
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_len = avg_end - avg_start
+        avg_x = sum(p[0] for p in points[avg_start:avg_end]) / avg_len
+        avg_y = sum(p[1] for p in points[avg_start:avg_end]) / avg_len
+        
+        ax, ay = points[a][0], points[a][1]
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1
+        
+        max_area = -1.0
+        next_a = range_start
+        for j in range(range_start, range_end):
+            area = abs((ax - avg_x) * (points[j][1] - ay) - (ax - points[j][0]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                next_a = j
+        
+        sampled.append(points[next_a])
+        a = next_a
+    
+    sampled.append(points[-1])
+    return sampled
+
+# --- Pagination Helpers ---
+def encode_cursor(timestamp: datetime.datetime, reading_id: int) -> str:
+    """Opaque keyset cursor for a (timestamp, id) position"""
+    raw = f"{timestamp.isoformat()}|{reading_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str):
+    """Decode a cursor into (timestamp, id); raises ValueError when malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        timestamp, reading_id = raw.split('|')
+        return datetime.datetime.fromisoformat(timestamp), int(reading_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def dashboard_data_query(limit: int, device_id: Optional[str], sensor_type: Optional[str],
+                         hours: int, cursor: Optional[str] = None, since: Optional[str] = None):
+    """Keyset-paginated select behind /api/dashboard/data (ValueError on a bad cursor)"""
+    start_time = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+    
+    # Plain columns - no ORM hydration
+    query = db.select(
+        SensorReading.id, SensorReading.device_key, SensorReading.sensor_type_id,
+        SensorReading.value, SensorReading.timestamp
+    ).where(SensorReading.timestamp >= start_time,
+            *reading_dictionary.reading_filters(device_id, sensor_type))
+    
+    if cursor:
+        cursor_ts, cursor_id = decode_cursor(cursor)
+        query = query.where(db.or_(
+            SensorReading.timestamp < cursor_ts,
+            db.and_(SensorReading.timestamp == cursor_ts, SensorReading.id < cursor_id)
+        ))
+    if since:
+        # Oldest new rows first so nothing is skipped; the payload reverses them
+        since_ts, since_id = decode_cursor(since)
+        query = query.where(db.or_(
+            SensorReading.timestamp > since_ts,
+            db.and_(SensorReading.timestamp == since_ts, SensorReading.id > since_id)
+        ))
+        return query.order_by(SensorReading.timestamp.asc(), SensorReading.id.asc()).limit(limit)
+    return query.order_by(SensorReading.timestamp.desc(), SensorReading.id.desc()).limit(limit)
+
+def dashboard_data_payload(rows, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON body for /api/dashboard/data from the rows of dashboard_data_query"""
+    readings = [reading_dictionary.decode(row) for row in rows]
+    since = parameters.get('since')
+    if since:
+        readings.reverse()  # newest-first like every other page
+    
+    has_more = len(readings) == parameters['limit']
+    next_cursor = None
+    if readings and has_more and not since:
+        next_cursor = encode_cursor(readings[-1].timestamp, readings[-1].id)
+    latest_cursor = encode_cursor(readings[0].timestamp, readings[0].id) if readings else since
+    
+    # Iran time formatted as a column
+    utc_iso, iran, persian = format_iran_columns([reading.timestamp for reading in readings])
+    results = [{
+        'id': reading.id,
+        'device_id': reading.device_id,
+        'sensor_type': reading.sensor_type,
+        'value': reading.value,
+        'unit': reading.unit,
+        'timestamp_utc': utc_iso[i],
+        'timestamp_iran': iran[i],
+        'timestamp_persian': persian[i]
+    } for i, reading in enumerate(readings)]
+    
+    return {
+        'data': results,
+        'count': len(results),
+        'next_cursor': next_cursor,
+        'latest_cursor': latest_cursor,
+        'has_more': has_more,
+        'parameters': parameters,
+        'timestamp_utc': datetime.datetime.utcnow().isoformat(),
+        'timestamp_iran': get_iran_time().strftime('%Y-%m-%d %H:%M:%S IRST')
+    }
+
+def latest_sensors_payload(device_id: Optional[str], limit: int) -> Dict[str, Any]:
+    """JSON body for /api/sensors/latest, served from the latest-value cache"""
+    # Latest reading for each sensor type, newest first
+    latest_readings = sorted(latest_cache.get_latest(device_id),
+                             key=lambda r: r['timestamp'], reverse=True)[:limit]
+    
+    utc_iso, iran, _ = format_iran_columns([reading['timestamp'] for reading in latest_readings])
+    online_after = presence_tracker.online_after()
+    results = [{
+        'device_id': reading['device_id'],
+        'sensor_type': reading['sensor_type'],
+        'value': reading['value'],
+        'unit': reading['unit'],
+        'timestamp': utc_iso[i],
+        'timestamp_iran': iran[i],
+        'is_online': reading['timestamp'] > online_after
+    } for i, reading in enumerate(latest_readings)]
+    
+    return {
+        'sensors': results,
+        'count': len(results),
+        'timestamp': datetime.datetime.utcnow().isoformat()
+    }
+
+# --- Export Helpers ---
+def dumps_json(obj) -> bytes:
+    """Encode to JSON bytes, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+class ChunkSink:
+    """Write-only file object that buffers bytes until the next drain()"""
+    
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+    
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self._position
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        self.closed = True
+    
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def export_arrow_schema():
+    """Arrow schema for exported readings - strings dictionary-encoded, timestamps typed"""
+    dictionary_string = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('id', pa.int64()),
+        ('device_id', dictionary_string),
+        ('sensor_type', dictionary_string),
+        ('value', pa.float64()),
+        ('unit', dictionary_string),
+        ('timestamp', pa.timestamp('us', tz='UTC')),
+    ])
+
+def generate_columnar_export(query, export_format: str):
+    """Yield an Arrow IPC stream or a Parquet file, one record batch per fetch"""
+    schema = export_arrow_schema()
+    sink = ChunkSink()
+    if export_format == 'parquet':
+        writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    
+    exported = 0
+    for batch in db.session.execute(query).partitions():
+        batch = [reading_dictionary.decode(row) for row in batch]
+        ids, device_ids, sensor_types, values, units, timestamps = zip(*batch)
+        writer.write_batch(pa.record_batch([
+            pa.array(ids, pa.int64()),
+            pa.array(device_ids, pa.string()).dictionary_encode(),
+            pa.array(sensor_types, pa.string()).dictionary_encode(),
+            pa.array(values, pa.float64()),
+            pa.array(units, pa.string()).dictionary_encode(),
+            pa.array(timestamps, pa.timestamp('us', tz='UTC')),  # naive values are UTC
+        ], schema=schema))
+        exported += len(ids)
+        yield sink.drain()
+    
+    writer.close()
+    yield sink.drain()
+    app.logger.info(f"Exported {exported} readings as {export_format}")
+
+def generate_ndjson_export(query):
+    """Yield one JSON object per line, a fetch batch at a time"""
+    exported = 0
+    for batch in db.session.execute(query).partitions():
+        batch = [reading_dictionary.decode(row) for row in batch]
+        lines = [dumps_json({
+            'id': row.id,
+            'device_id': row.device_id,
+            'sensor_type': row.sensor_type,
+            'value': row.value,
+            'unit': row.unit,
+            'timestamp_utc': row.timestamp.isoformat()
+        }) for row in batch]
+        lines.append(b'')
+        exported += len(batch)
+        yield b'\n'.join(lines)
+    app.logger.info(f"Exported {exported} readings as ndjson")
+
+# --- Rollup Maintenance ---
+ROLLUP_WATERMARK_NAME = 'sensor_reading'
+
+def get_rollup_watermark() -> int:
+    """Highest reading id already included in the rollup tables"""
+    last_id = db.session.query(RollupWatermark.last_id)\
+        .filter_by(name=ROLLUP_WATERMARK_NAME).scalar()
+    return last_id or 0
+
+def upsert_insert(table):
+    """Dialect INSERT supporting ON CONFLICT, plus its two-argument least/greatest"""
+    if DATABASE_BACKEND == 'postgresql':
+        return postgresql.insert(table), db.func.least, db.func.greatest
+    # SQLite's min()/max() are scalar when called with two arguments
+    return sqlite.insert(table), db.func.min, db.func.max
+
+def rollup_upsert_statement():
+    """INSERT ... ON CONFLICT that merges new aggregates into existing buckets"""
+    table = SensorRollup.__table__
+    stmt, least, greatest = upsert_insert(table)
+    
+    return stmt.on_conflict_do_update(
+        index_elements=['resolution', 'device_id', 'sensor_type', 'bucket_start'],
+        set_={
+            'reading_count': table.c.reading_count + stmt.excluded.reading_count,
+            'value_sum': table.c.value_sum + stmt.excluded.value_sum,
+            'value_min': least(table.c.value_min, stmt.excluded.value_min),
+            'value_max': greatest(table.c.value_max, stmt.excluded.value_max)
+        }
+    )
+
+_rollup_id_snapshots = deque()  # (monotonic time, max reading id seen then)
+
+def safe_rollup_max_id(max_id: Optional[int]) -> Optional[int]:
+    """Highest id every transaction below it has had ROLLUP_SAFETY_LAG seconds to commit.
+    
+    SQLite has a single writer, so its visible ids never have gaps that fill in later.
+    """
+    if DATABASE_BACKEND != 'postgresql' or ROLLUP_SAFETY_LAG <= 0 or max_id is None:
+        return max_id
+    now = time.monotonic()
+    if not _rollup_id_snapshots or _rollup_id_snapshots[-1][1] != max_id:
+        _rollup_id_snapshots.append((now, max_id))
+    safe = None
+    while _rollup_id_snapshots and now - _rollup_id_snapshots[0][0] >= ROLLUP_SAFETY_LAG:
+        safe = _rollup_id_snapshots.popleft()
+    if safe is not None:
+        # Keep the newest old-enough snapshot for the next batch
+        _rollup_id_snapshots.appendleft(safe)
+        return safe[1]
+    return None
+
+def process_rollup_batch() -> int:
+    """Fold the next batch of readings past the watermark into every rollup table.
+    
+    The watermark is advanced with a conditional UPDATE before aggregating, so
+    concurrent workers can never fold the same id range twice. Returns the
+    number of reading ids covered (0 when there is nothing to do).
+    """
+    watermark = db.session.get(RollupWatermark, ROLLUP_WATERMARK_NAME)
+    if watermark is None:
+        db.session.add(RollupWatermark(name=ROLLUP_WATERMARK_NAME, last_id=0))
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+        return process_rollup_batch()
+    
+    low = watermark.last_id
+    max_id = safe_rollup_max_id(db.session.query(db.func.max(SensorReading.id)).scalar())
+    if max_id is None or max_id <= low:
+        db.session.rollback()
+        return 0
+    high = min(low + ROLLUP_BATCH_SIZE, max_id)
+    
+    claimed = db.session.execute(
+        db.update(RollupWatermark)
+        .where(RollupWatermark.name == ROLLUP_WATERMARK_NAME, RollupWatermark.last_id == low)
+        .values(last_id=high, updated_at=datetime.datetime.utcnow())
+    )
+    if claimed.rowcount != 1:
+        db.session.rollback()
+        return 0
+    
+    upsert = rollup_upsert_statement()
+    for resolution in ROLLUP_RESOLUTIONS:
+        bucket = bucket_expression(SensorReading.timestamp, resolution).label('bucket')
+        # Rollups are keyed by sensor type name, so merge groups whose types differ only by unit
+        groups = {}
+        for row in db.session.query(
+            SensorReading.device_key,
+            SensorReading.sensor_type_id,
+            bucket,
+            db.func.count(SensorReading.id).label('count'),
+            db.func.sum(SensorReading.value).label('sum'),
+            db.func.min(SensorReading.value).label('min'),
+            db.func.max(SensorReading.value).label('max')
+        ).filter(SensorReading.id > low, SensorReading.id <= high)\
+         .group_by(SensorReading.device_key, SensorReading.sensor_type_id, bucket):
+            name, unit = reading_dictionary.sensor_type(row.sensor_type_id)
+            key = (reading_dictionary.device_id(row.device_key), name, int(row.bucket))
+            group = groups.get(key)
+            if group is None:
+                groups[key] = {
+                    'resolution': resolution,
+                    'device_id': key[0],
+                    'sensor_type': name,
+                    'bucket_start': datetime.datetime.utcfromtimestamp(key[2] * resolution),
+                    'unit': unit,
+                    'reading_count': row.count,
+                    'value_sum': float(row.sum),
+                    'value_min': row.min,
+                    'value_max': row.max
+                }
+            else:
+                group['unit'] = max(group['unit'], unit)
+                group['reading_count'] += row.count
+                group['value_sum'] += float(row.sum)
+                group['value_min'] = min(group['value_min'], row.min)
+                group['value_max'] = max(group['value_max'], row.max)
+        
+        if groups:
+            db.session.execute(upsert, list(groups.values()))
+    
+    db.session.commit()
+    return high - low
+
+# --- Ingest Deduplication ---
+class SequenceWindow:
+    """Recently stored frame sequence numbers per device (this process only).
+    
+    Per device it keeps the highest seq stored and a bitmask of the INGEST_SEQ_WINDOW
+    numbers below it, so a retried frame is recognised without a database round trip.
+    Older numbers, and frames stored by other workers, fall through to the
+    ingest_sequence unique key. Devices must keep `seq` increasing across reboots.
+    """
+    
+    def __init__(self, size: int):
+        self.size = size
+        self._mask = (1 << size) - 1
+        self._lock = threading.Lock()
+        self._devices = {}  # device_id -> [highest seq, bitmask]; bit i = highest - i stored
+    
+    def seen(self, device_id: str, seq: int) -> bool:
+        with self._lock:
+            state = self._devices.get(device_id)
+            if state is None:
+                return False
+            offset = state[0] - seq
+            return 0 <= offset < self.size and bool(state[1] >> offset & 1)
+    
+    def unseen(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Rows whose frame is not known to be stored already"""
+        return [row for row in rows
+                if row.get('seq') is None or not self.seen(row['device_id'], row['seq'])]
+    
+    def mark(self, rows: List[Dict[str, Any]]):
+        """Record the sequence numbers of committed rows"""
+        pairs = {(row['device_id'], row['seq']) for row in rows if row.get('seq') is not None}
+        with self._lock:
+            for device_id, seq in pairs:
+                state = self._devices.get(device_id)
+                if state is None:
+                    self._devices[device_id] = [seq, 1]
+                elif seq > state[0]:
+                    shift = seq - state[0]
+                    state[1] = (state[1] << shift | 1) & self._mask if shift < self.size else 1
+                    state[0] = seq
+                elif state[0] - seq < self.size:
+                    state[1] |= 1 << (state[0] - seq)
+
+sequence_window = SequenceWindow(INGEST_SEQ_WINDOW)
+
+def claim_sequences(rows: List[Dict[str, Any]], encoded_rows: List[Dict[str, Any]], session) -> Optional[List[int]]:
+    """Insert each frame's (device, seq) into ingest_sequence; indexes of the rows to store.
+    
+    Runs in the caller's transaction, so a frame already stored by any worker (or
+    before a restart) is skipped, and a rolled-back insert leaves its seq unclaimed.
+    Returns None when no row carries a seq.
+    """
+    pairs = {(encoded['device_key'], row['seq'])
+             for row, encoded in zip(rows, encoded_rows) if row.get('seq') is not None}
+    if not pairs:
+        return None
+    
+    table = IngestSequence.__table__
+    stmt, _, _ = upsert_insert(table)
+    received_at = datetime.datetime.utcnow()
+    claimed = set(session.execute(
+        stmt.on_conflict_do_nothing(index_elements=['device_key', 'seq'])
+        .returning(table.c.device_key, table.c.seq),
+        [{'device_key': device_key, 'seq': seq, 'received_at': received_at} for device_key, seq in pairs]
+    ).all())
+    
+    keep = []
+    stored = set()
+    for i, (row, encoded) in enumerate(zip(rows, encoded_rows)):
+        if row.get('seq') is None:
+            keep.append(i)
+            continue
+        key = (encoded['device_key'], row['seq'])
+        reading = key + (encoded['sensor_type_id'],)
+        # Skip claimed-elsewhere frames, and a frame repeated within this request
+        if key in claimed and reading not in stored:
+            stored.add(reading)
+            keep.append(i)
+    return keep
+
+def duplicate_frame_payload(frame: FramePayload) -> Dict[str, Any]:
+    """Response body acknowledging a frame whose seq was already stored"""
+    return {
+        'message': 'Duplicate frame ignored',
+        'duplicate': True,
+        'readings_saved': 0,
+        'device_id': frame.device_id,
+        'seq': frame.seq
+    }
+
+# --- Ingest Counters ---
+INGEST_COUNTERS_CHECKPOINT_NAME = 'ingest_counters'
+
+def increment_ingest_counters(rows: List[Dict[str, Any]], session=None):
+    """Add rows to the per-device total and Iran-day counters in the current transaction"""
+    if not rows:
+        return
+    
+    _, iran, _ = format_iran_columns([row['timestamp'] for row in rows])
+    counts = {}
+    for i, row in enumerate(rows):
+        for period in ('total', iran[i][:10]):
+            key = (row['device_id'], period)
+            current = counts.get(key)
+            if current is None:
+                counts[key] = [1, row['timestamp'], row['timestamp']]
+            else:
+                current[0] += 1
+                current[1] = min(current[1], row['timestamp'])
+                current[2] = max(current[2], row['timestamp'])
+    
+    merge_ingest_counters([{
+        'device_id': device_id, 'period': period, 'reading_count': count,
+        'first_at': first_at, 'last_at': last_at
+    } for (device_id, period), (count, first_at, last_at) in counts.items()], session)
+
+def merge_ingest_counters(counter_rows: List[Dict[str, Any]], session=None):
+    table = IngestCounter.__table__
+    stmt, least, greatest = upsert_insert(table)
+    (session or db.session).execute(stmt.on_conflict_do_update(
+        index_elements=['device_id', 'period'],
+        set_={
+            'reading_count': table.c.reading_count + stmt.excluded.reading_count,
+            'first_at': least(table.c.first_at, stmt.excluded.first_at),
+            'last_at': greatest(table.c.last_at, stmt.excluded.last_at)
+        }
+    ), counter_rows)
+
+def decrement_total_counters(deleted_by_device_key: Dict[int, int]):
+    """Take readings removed by retention off the per-device totals (current transaction)"""
+    if not deleted_by_device_key:
+        return
+    table = IngestCounter.__table__
+    _, _, greatest = upsert_insert(table)
+    db.session.execute(
+        table.update()
+        .where(table.c.device_id == db.bindparam('b_device_id'), table.c.period == 'total')
+        .values(reading_count=greatest(table.c.reading_count - db.bindparam('b_count'), 0)),
+        [{'b_device_id': reading_dictionary.device_id(device_key), 'b_count': count}
+         for device_key, count in deleted_by_device_key.items()]
+    )
+
+def backfill_ingest_counters():
+    """Build counters for readings stored before counters existed (runs once per database).
+    
+    Claiming a checkpoint row makes concurrent workers skip the backfill. Readings
+    are grouped into 30-minute buckets, which never straddle an Iran midnight;
+    legacy readings without a timestamp cannot be placed in a day and are skipped.
+    """
+    if db.session.get(IngestCheckpoint, INGEST_COUNTERS_CHECKPOINT_NAME) is not None:
+        return
+    
+    max_id = db.session.query(db.func.max(SensorReading.id)).scalar() or 0
+    db.session.add(IngestCheckpoint(name=INGEST_COUNTERS_CHECKPOINT_NAME, position=max_id))
+    try:
+        db.session.flush()
+    except Exception:
+        db.session.rollback()
+        return
+    
+    bucket = bucket_expression(SensorReading.timestamp, 1800).label('bucket')
+    counts = {}
+    for row in db.session.query(
+        SensorReading.device_key, bucket,
+        db.func.count(SensorReading.id).label('count'),
+        db.func.min(SensorReading.timestamp).label('first_at'),
+        db.func.max(SensorReading.timestamp).label('last_at')
+    ).filter(SensorReading.id <= max_id, SensorReading.timestamp.isnot(None))\
+     .group_by(SensorReading.device_key, bucket):
+        bucket_start = datetime.datetime.utcfromtimestamp(int(row.bucket) * 1800)
+        day = format_iran_time(bucket_start)[:10]
+        device_id = reading_dictionary.device_id(row.device_key)
+        for period in ('total', day):
+            current = counts.setdefault((device_id, period), [0, row.first_at, row.last_at])
+            current[0] += row.count
+            current[1] = min(current[1], row.first_at)
+            current[2] = max(current[2], row.last_at)
+    
+    if counts:
+        merge_ingest_counters([{
+            'device_id': device_id, 'period': period, 'reading_count': count,
+            'first_at': first_at, 'last_at': last_at
+        } for (device_id, period), (count, first_at, last_at) in counts.items()])
+    db.session.commit()
+    app.logger.info(f"Ingest counters backfilled for {max_id} readings")
+
+with app.app_context():
+    try:
+        backfill_ingest_counters()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Ingest counter backfill failed: {e}")
+
+def store_readings(rows: List[Dict[str, Any]], session=None, encoded_rows=None) -> List[Dict[str, Any]]:
+    """Claim sequence numbers, upsert devices, bulk insert rows and bump counters (caller commits).
+    
+    `session` defaults to the Flask-SQLAlchemy session; the ASGI app passes the
+    sync facade of its async session. Pre-encoded rows skip the dictionary lookup.
+    Returns the rows actually stored (duplicate frames are left out).
+    """
+    session = session or db.session
+    if encoded_rows is None:
+        encoded_rows = reading_dictionary.encode_rows(rows)
+    keep = claim_sequences(rows, encoded_rows, session)
+    if keep is not None:
+        rows = [rows[i] for i in keep]
+        encoded_rows = [encoded_rows[i] for i in keep]
+        if not rows:
+            return rows
+    
+    # Known devices cost no query here; last_seen is recorded by the presence tracker after commit
+    first_seen_by_device = {}
+    for row in rows:
+        if not presence_tracker.is_known(row['device_id']):
+            seen = first_seen_by_device.get(row['device_id'])
+            if seen is None or row['timestamp'] < seen:
+                first_seen_by_device[row['device_id']] = row['timestamp']
+    
+    register_devices(first_seen_by_device, session)
+    session.execute(SensorReading.__table__.insert(), encoded_rows)
+    increment_ingest_counters(rows, session)
+    return rows
+
+# --- Retention ---
+def apply_retention() -> Dict[str, int]:
+    """Drop raw readings older than RETENTION_DAYS once the rollups cover them,
+    plus expired minute rollups, ingest sequence numbers, per-day counters and resolved
+    alerts. Per-device total counters are reduced by the readings dropped.
+    
+    Partitioned PostgreSQL tables lose whole monthly partitions (O(1) DROP);
+    otherwise rows are deleted in bounded id batches through the timestamp index.
+    """
+    result = {'partitions_dropped': 0, 'rows_deleted': 0, 'rollups_deleted': 0, 'sequences_deleted': 0,
+              'alerts_deleted': 0, 'counters_deleted': 0}
+    now = datetime.datetime.utcnow()
+    
+    if RETENTION_DAYS > 0:
+        cutoff = now - datetime.timedelta(days=RETENTION_DAYS)
+        # Never drop readings the rollup tables have not absorbed yet
+        covered_id = get_rollup_watermark() if ROLLUP_ENABLED else None
+        
+        if readings_partitioned():
+            for name, _, upper in monthly_reading_partitions():
+                if upper > cutoff:
+                    break
+                max_id = db.session.execute(db.text(f'SELECT max(id) FROM {name}')).scalar()
+                if covered_id is not None and max_id is not None and max_id > covered_id:
+                    app.logger.info(f"Retention: keeping {name} until rollups catch up")
+                    break
+                decrement_total_counters(dict(db.session.execute(
+                    db.text(f'SELECT device_key, count(*) FROM {name} GROUP BY device_key')).all()))
+                db.session.execute(db.text(f'DROP TABLE {name}'))
+                db.session.commit()
+                result['partitions_dropped'] += 1
+                app.logger.info(f"Retention: dropped partition {name}")
+        else:
+            while True:
+                expired = db.select(SensorReading.id)\
+                    .where(SensorReading.timestamp < cutoff)\
+                    .limit(RETENTION_DELETE_BATCH)
+                if covered_id is not None:
+                    expired = expired.where(SensorReading.id <= covered_id)
+                deleted_keys = db.session.execute(
+                    db.delete(SensorReading).where(SensorReading.id.in_(expired.scalar_subquery()))
+                    .returning(SensorReading.device_key)
+                    .execution_options(synchronize_session=False)
+                ).scalars().all()
+                deleted_by_device_key = {}
+                for device_key in deleted_keys:
+                    deleted_by_device_key[device_key] = deleted_by_device_key.get(device_key, 0) + 1
+                decrement_total_counters(deleted_by_device_key)
+                db.session.commit()
+                deleted = len(deleted_keys)
+                result['rows_deleted'] += deleted
+                if deleted < RETENTION_DELETE_BATCH:
+                    break
+    
+    if INGEST_COUNTER_RETENTION_DAYS > 0:
+        day_cutoff = format_iran_time(now - datetime.timedelta(days=INGEST_COUNTER_RETENTION_DAYS))[:10]
+        result['counters_deleted'] = db.session.execute(
+            db.delete(IngestCounter).where(IngestCounter.period != 'total', IngestCounter.period < day_cutoff)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+    
+    if INGEST_SEQ_RETENTION_DAYS > 0:
+        seq_cutoff = now - datetime.timedelta(days=INGEST_SEQ_RETENTION_DAYS)
+        result['sequences_deleted'] = db.session.execute(
+            db.delete(IngestSequence).where(IngestSequence.received_at < seq_cutoff)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+    
+    if ALERT_RETENTION_DAYS > 0:
+        alert_cutoff = now - datetime.timedelta(days=ALERT_RETENTION_DAYS)
+        result['alerts_deleted'] = db.session.execute(
+            db.delete(Alert).where(Alert.resolved_at < alert_cutoff)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+    
+    if RETENTION_MINUTE_ROLLUP_DAYS > 0:
+        rollup_cutoff = now - datetime.timedelta(days=RETENTION_MINUTE_ROLLUP_DAYS)
+        result['rollups_deleted'] = db.session.execute(
+            db.delete(SensorRollup).where(SensorRollup.resolution == 60,
+                                          SensorRollup.bucket_start < rollup_cutoff)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+    
+    return result
+
+def maintain_storage():
+    """Create upcoming partitions and apply the retention policy"""
+    if readings_partitioned():
+        ensure_reading_partitions()
+    result = apply_retention()
+    if any(result.values()):
+        app.logger.info(f"Storage maintenance: {result}")
+
+class MaintenanceWorker:
+    """Background thread that keeps rollups caught up and runs storage maintenance"""
+    
+    def __init__(self, interval: float):
+        self._interval = interval
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.runs = 0
+        self.last_run_ms = 0.0
+        self._last_maintenance = None
+    
+    def start(self):
+        """Start the worker thread (lazily, so it is created after a gunicorn fork)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='maintenance-worker', daemon=True)
+                self._thread.start()
+    
+    def shutdown(self):
+        self._stop.set()
+    
+    def run_once(self) -> int:
+        """Process every pending batch; returns the number of reading ids covered"""
+        started = time.perf_counter()
+        covered = 0
+        with app.app_context():
+            if ROLLUP_ENABLED:
+                try:
+                    while True:
+                        batch = process_rollup_batch()
+                        if not batch:
+                            break
+                        covered += batch
+                except Exception as e:
+                    app.logger.error(f"Rollup run failed: {e}")
+                    db.session.rollback()
+            
+            if self._last_maintenance is None or \
+                    time.monotonic() - self._last_maintenance >= RETENTION_INTERVAL:
+                self._last_maintenance = time.monotonic()
+                try:
+                    maintain_storage()
+                except Exception as e:
+                    app.logger.error(f"Storage maintenance failed: {e}")
+                    db.session.rollback()
+        self.runs += 1
+        self.last_run_ms = (time.perf_counter() - started) * 1000
+        return covered
+    
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self._interval)
+
+maintenance_worker = MaintenanceWorker(ROLLUP_INTERVAL)
+atexit.register(maintenance_worker.shutdown)
+
+# --- Latest Value Cache ---
+class LatestValueCache:
+    """Latest reading per (device_id, sensor_type), updated on every ingest.
+    
+    Entries live in a process-local dict. When a shared path is configured the
+    entries are also written to a small SQLite file and reads are served from
+    it, so every gunicorn worker sees the same latest values.
+    """
+    
+    _TS_FORMAT = '%Y-%m-%d %H:%M:%S.%f'  # fixed width, so text comparison orders correctly
+    
+    def __init__(self, shared_path: Optional[str] = None):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._shared_path = shared_path
+        self._local = threading.local()
+    
+    def _shared(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._shared_path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS latest_value ('
+                'device_id TEXT NOT NULL, sensor_type TEXT NOT NULL, value REAL NOT NULL, '
+                'unit TEXT NOT NULL, timestamp TEXT NOT NULL, '
+                'PRIMARY KEY (device_id, sensor_type)) WITHOUT ROWID'
+            )
+            self._local.conn = conn
+        return conn
+    
+    def update(self, rows: List[Dict[str, Any]]):
+        """Record inserted rows, keeping only the newest value per key"""
+        changed = {}
+        with self._lock:
+            for row in rows:
+                key = (row['device_id'], row['sensor_type'])
+                current = self._entries.get(key)
+                if current is None or row['timestamp'] >= current[2]:
+                    entry = (row['value'], row['unit'], row['timestamp'])
+                    self._entries[key] = entry
+                    changed[key] = entry
+        
+        if self._shared_path and changed:
+            try:
+                conn = self._shared()
+                conn.executemany(
+                    'INSERT INTO latest_value VALUES (?, ?, ?, ?, ?) '
+                    'ON CONFLICT (device_id, sensor_type) DO UPDATE SET '
+                    'value = excluded.value, unit = excluded.unit, timestamp = excluded.timestamp '
+                    'WHERE excluded.timestamp >= latest_value.timestamp',
+                    [(key[0], key[1], value, unit, ts.strftime(self._TS_FORMAT))
+                     for key, (value, unit, ts) in changed.items()]
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                app.logger.error(f"Shared latest-value cache update failed: {e}")
+    
+    def get_latest(self, device_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Latest reading per sensor type, optionally for one device"""
+        if self._shared_path:
+            try:
+                conn = self._shared()
+                if device_id:
+                    cursor = conn.execute('SELECT * FROM latest_value WHERE device_id = ?', (device_id,))
+                else:
+                    cursor = conn.execute('SELECT * FROM latest_value')
+                return [{
+                    'device_id': row[0],
+                    'sensor_type': row[1],
+                    'value': row[2],
+                    'unit': row[3],
+                    'timestamp': datetime.datetime.strptime(row[4], self._TS_FORMAT)
+                } for row in cursor]
+            except sqlite3.Error as e:
+                app.logger.error(f"Shared latest-value cache read failed, using local cache: {e}")
+        
+        with self._lock:
+            items = list(self._entries.items())
+        return [{
+            'device_id': key[0],
+            'sensor_type': key[1],
+            'value': value,
+            'unit': unit,
+            'timestamp': ts
+        } for key, (value, unit, ts) in items if device_id is None or key[0] == device_id]
+    
+    def warm(self):
+        """Load the latest reading of every (device, sensor type) from the database"""
+        newest = db.session.query(
+            SensorReading.device_key,
+            SensorReading.sensor_type_id,
+            db.func.max(SensorReading.timestamp).label('timestamp')
+        ).group_by(SensorReading.device_key, SensorReading.sensor_type_id).subquery()
+        
+        rows = db.session.query(
+            SensorReading.id, SensorReading.device_key, SensorReading.sensor_type_id,
+            SensorReading.value, SensorReading.timestamp
+        ).join(newest, db.and_(
+            SensorReading.device_key == newest.c.device_key,
+            SensorReading.sensor_type_id == newest.c.sensor_type_id,
+            SensorReading.timestamp == newest.c.timestamp
+        )).all()
+        
+        self.update([reading_dictionary.decode(row)._asdict() for row in rows])
+        app.logger.info(f"Latest-value cache warmed with {len(rows)} entries")
+
+latest_cache = LatestValueCache(LATEST_CACHE_PATH)
+
+with app.app_context():
+    try:
+        latest_cache.warm()
+    except Exception as e:
+        app.logger.error(f"Latest-value cache warm-up failed: {e}")
+
+# --- Device Registry Cache ---
+class DeviceRegistry:
+    """Rarely-changing device metadata (name, location, first_seen) kept in memory.
+    
+    The whole registry is reloaded in one query when it is older than the TTL
+    or when an unknown device id is requested. Ids still unknown after a reload
+    are remembered as missing until the next reload, and unknown ids trigger at
+    most one reload per `miss_ttl`, so polling a bogus id never hits the database.
+    """
+    
+    def __init__(self, ttl: int, miss_ttl: int):
+        self._ttl = ttl
+        self._miss_ttl = miss_ttl
+        self._missing = set()
+        self._devices = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+    
+    def refresh(self):
+        rows = db.session.query(Device.id, Device.name, Device.location, Device.first_seen).all()
+        with self._lock:
+            self._devices = {row.id: row._asdict() for row in rows}
+            self._missing = set()
+            self._loaded_at = time.monotonic()
+    
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = 0.0
+    
+    def get_many(self, device_ids) -> Dict[str, Dict[str, Any]]:
+        age = time.monotonic() - self._loaded_at
+        devices, missing = self._devices, self._missing
+        unknown = [device_id for device_id in device_ids if device_id not in devices and device_id not in missing]
+        if age > self._ttl or (unknown and age > self._miss_ttl):
+            self.refresh()
+            devices = self._devices
+            unknown = [device_id for device_id in unknown if device_id not in devices]
+        if unknown:
+            with self._lock:
+                # Bounded by the reload: every refresh starts a fresh set
+                self._missing.update(unknown)
+        return {device_id: devices[device_id] for device_id in device_ids if device_id in devices}
+
+device_registry = DeviceRegistry(DEVICE_REGISTRY_TTL, DEVICE_REGISTRY_MISS_TTL)
+
+# --- Device Presence ---
+class PresenceTracker:
+    """Last-seen time and online/offline state of every device, kept in memory.
+    
+    Ingest records last_seen here after commit instead of updating the device
+    row on every request. A background thread writes the changes back in one
+    batched UPDATE every PRESENCE_FLUSH_INTERVAL and then reads back the devices
+    other workers saw. Offline deadlines (last_seen + DEVICE_OFFLINE_AFTER) sit
+    in a min-heap with one entry per online device, so flipping devices offline
+    never scans them all; a device that kept reporting is re-armed when its
+    stale deadline comes up. Transitions go to listeners and a short history.
+    """
+    
+    def __init__(self, offline_after: float, flush_interval: float, history: int):
+        self._offline_after = datetime.timedelta(seconds=offline_after)
+        self._flush_interval = flush_interval
+        self._last_seen = {}
+        self._online = set()
+        self._deadlines = []
+        self._dirty = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self.transitions = deque(maxlen=history)
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.flush_errors = 0
+        self.last_flush_ms = 0.0
+    
+    def online_after(self) -> datetime.datetime:
+        """Readings or last_seen newer than this (UTC) count as online"""
+        return datetime.datetime.utcnow() - self._offline_after
+    
+    def is_known(self, device_id: str) -> bool:
+        return device_id in self._last_seen
+    
+    def last_seen(self, device_id: str, stored: Optional[datetime.datetime] = None) -> Optional[datetime.datetime]:
+        """Newest of this process's last_seen and a value read from the database"""
+        seen = self._last_seen.get(device_id)
+        if seen is None or (stored is not None and stored > seen):
+            return stored
+        return seen
+    
+    def devices(self) -> List[tuple]:
+        """(device_id, last_seen) of every tracked device, sorted by id"""
+        with self._lock:
+            return sorted(self._last_seen.items())
+    
+    def online_count(self) -> int:
+        self.expire()
+        return len(self._online)
+    
+    def add_listener(self, callback):
+        """Call callback(device_id, status, at) on every online/offline transition"""
+        self._listeners.append(callback)
+    
+    def seen(self, last_seen_by_device: Dict[str, datetime.datetime], dirty: bool = True):
+        """Record new last_seen times; `dirty` ones are written back on the next flush"""
+        now = datetime.datetime.utcnow()
+        transitions = []
+        with self._lock:
+            for device_id, seen in last_seen_by_device.items():
+                current = self._last_seen.get(device_id)
+                if current is not None and seen <= current:
+                    continue
+                self._last_seen[device_id] = seen
+                if dirty:
+                    self._dirty[device_id] = seen
+                deadline = seen + self._offline_after
+                if device_id not in self._online and deadline > now:
+                    self._online.add(device_id)
+                    heapq.heappush(self._deadlines, (deadline, device_id))
+                    transitions.append((device_id, 'online', seen))
+        self._notify(transitions)
+    
+    def record(self, rows: List[Dict[str, Any]]):
+        """Post-commit hook: the newest reading timestamp per device is its last_seen"""
+        last_seen_by_device = {}
+        for row in rows:
+            seen = last_seen_by_device.get(row['device_id'])
+            if seen is None or row['timestamp'] > seen:
+                last_seen_by_device[row['device_id']] = row['timestamp']
+        self.seen(last_seen_by_device)
+    
+    def expire(self):
+        """Flip devices whose offline deadline has passed"""
+        now = datetime.datetime.utcnow()
+        transitions = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                deadline, device_id = heapq.heappop(self._deadlines)
+                rearmed = self._last_seen[device_id] + self._offline_after
+                if rearmed > now:
+                    heapq.heappush(self._deadlines, (rearmed, device_id))
+                    continue
+                self._online.discard(device_id)
+                transitions.append((device_id, 'offline', deadline))
+        self._notify(transitions)
+    
+    def _notify(self, transitions: List[tuple]):
+        for device_id, status, at in transitions:
+            self.transitions.append({'device_id': device_id, 'status': status, 'at': at})
+            app.logger.info(f"Device {device_id} is now {status}")
+            for callback in self._listeners:
+                try:
+                    callback(device_id, status, at)
+                except Exception as e:
+                    app.logger.error(f"Presence listener failed: {e}")
+    
+    def warm(self):
+        """Load last_seen of every registered device"""
+        rows = db.session.query(Device.id, Device.last_seen).all()
+        now = datetime.datetime.utcnow()
+        with self._lock:
+            for device_id, seen in rows:
+                if seen is None:
+                    continue
+                self._last_seen[device_id] = seen
+                if seen + self._offline_after > now:
+                    self._online.add(device_id)
+                    heapq.heappush(self._deadlines, (seen + self._offline_after, device_id))
+        app.logger.info(f"Presence tracker warmed with {len(rows)} devices ({len(self._online)} online)")
+    
+    def flush(self):
+        """Write dirty last_seen values back, then merge what other workers wrote"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        started = time.perf_counter()
+        
+        with app.app_context():
+            try:
+                if dirty:
+                    device_table = Device.__table__
+                    # Never move last_seen backwards (another worker may have written a newer one)
+                    db.session.execute(
+                        device_table.update()
+                        .where(device_table.c.id == db.bindparam('b_id'),
+                               db.or_(device_table.c.last_seen.is_(None),
+                                      device_table.c.last_seen < db.bindparam('b_last_seen')))
+                        .values(last_seen=db.bindparam('b_last_seen'), is_active=True),
+                        [{'b_id': device_id, 'b_last_seen': seen} for device_id, seen in dirty.items()]
+                    )
+                    db.session.commit()
+                
+                recent = db.session.query(Device.id, Device.last_seen)\
+                    .filter(Device.last_seen > self.online_after()).all()
+                db.session.rollback()
+                self.seen({device_id: seen for device_id, seen in recent}, dirty=False)
+            except Exception as e:
+                db.session.rollback()
+                self.flush_errors += 1
+                app.logger.error(f"Presence flush of {len(dirty)} devices failed: {e}")
+                with self._lock:
+                    for device_id, seen in dirty.items():
+                        if seen > self._dirty.get(device_id, datetime.datetime.min):
+                            self._dirty[device_id] = seen
+                return
+        
+        self.flushes += 1
+        self.rows_flushed += len(dirty)
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+    
+    def start(self):
+        """Start the presence thread (lazily, so it is created after a gunicorn fork)"""
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='presence-tracker', daemon=True)
+                self._thread.start()
+    
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self._dirty:
+            self.flush()
+    
+    def _run(self):
+        next_flush = time.monotonic() + self._flush_interval
+        while not self._stop.is_set():
+            # Sleep until the next flush or the earliest offline deadline, whichever is first
+            timeout = next_flush - time.monotonic()
+            with self._lock:
+                earliest = self._deadlines[0][0] if self._deadlines else None
+            if earliest is not None:
+                timeout = min(timeout, (earliest - datetime.datetime.utcnow()).total_seconds())
+            if self._stop.wait(max(timeout, 0.05)):
+                break
+            self.expire()
+            if time.monotonic() >= next_flush:
+                self.flush()
+                next_flush = time.monotonic() + self._flush_interval
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'devices_tracked': len(self._last_seen),
+            'online': len(self._online),
+            'pending_writes': len(self._dirty),
+            'flushes': self.flushes,
+            'rows_flushed': self.rows_flushed,
+            'flush_errors': self.flush_errors,
+            'last_flush_ms': round(self.last_flush_ms, 2)
+        }
+
+presence_tracker = PresenceTracker(DEVICE_OFFLINE_AFTER, PRESENCE_FLUSH_INTERVAL, PRESENCE_HISTORY)
+atexit.register(presence_tracker.shutdown)
+
+with app.app_context():
+    try:
+        presence_tracker.warm()
+    except Exception as e:
+        app.logger.error(f"Presence tracker warm-up failed: {e}")
+
+# --- Alert Engine ---
+class AlertEngine:
+    """Incremental rules evaluation over committed readings.
+    
+    Each (device_id, sensor_type) series gets a slot in a set of flat arrays
+    (rate baseline value and time, EWMA mean and variance, warm-up count,
+    active-alert flags), so evaluating a reading is a handful of float operations and never
+    touches the database. Only state transitions (an alert opening or clearing)
+    are queued for a background writer.
+    
+    State is per process: with several gunicorn workers each one evaluates the
+    readings it ingested (rates and EWMAs stay valid on the thinned series).
+    Alert rows are shared, so each records the worker that opened it: only that
+    worker resolves or downgrades it, others may only escalate, and alerts of a
+    worker that has exited are taken over by the next one to touch the series.
+    Transitions that fail to write on a connectivity error are retried.
+    """
+    WARNING = 1
+    CRITICAL = 2
+    RATE = 4
+    ANOMALY = 8
+    SEVERITY_RANK = {'warning': 1, 'critical': 2}
+    RETRY_INTERVAL = 5.0   # seconds between attempts to write transitions that failed
+    RETRY_MAX = 10000      # failed transitions kept for retry (oldest dropped first)
+    _EPOCH = datetime.datetime(1970, 1, 1)
+    
+    def __init__(self, enabled: bool, rules: Dict[str, Dict[str, Any]], alpha: float,
+                 zscore: float, warmup: int, cooldown: float, rate_min_interval: float):
+        self.enabled = enabled
+        self.rules = rules
+        self._compiled = {sensor_type: self._compile(rule) for sensor_type, rule in rules.items()}
+        self._alpha = alpha
+        self._zscore = zscore
+        self._warmup = warmup
+        self._cooldown = datetime.timedelta(seconds=cooldown)
+        self._rate_min_interval = rate_min_interval
+        self._slots = {}
+        self._last_value = array('d')
+        self._last_ts = array('d')
+        self._mean = array('d')
+        self._var = array('d')
+        self._count = array('I')
+        self._flags = array('B')
+        self._lock = threading.Lock()
+        self._pending = queue.SimpleQueue()
+        self._retry = deque()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self.readings_evaluated = 0
+        self.alerts_opened = 0
+        self.alerts_resolved = 0
+        self.write_errors = 0
+    
+    @staticmethod
+    def _compile(rule: Dict[str, Any]) -> tuple:
+        """(warn_low, warn_high, crit_low, crit_high, max_rate, min_std) with open bounds as infinities"""
+        def bounds(name):
+            low, high = rule.get(name) or (None, None)
+            return (-math.inf if low is None else float(low), math.inf if high is None else float(high))
+        max_rate = rule.get('max_rate')
+        return (*bounds('warning'), *bounds('critical'),
+                None if max_rate is None else float(max_rate), float(rule.get('min_std', 1e-6)))
+    
+    def _slot(self, key: tuple) -> int:
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = len(self._flags)
+            for column in (self._last_value, self._last_ts, self._mean, self._var):
+                column.append(0.0)
+            self._count.append(0)
+            self._flags.append(0)
+        return slot
+    
+    def evaluate(self, rows: List[Dict[str, Any]]):
+        """Update series state with committed rows and queue alert transitions"""
+        if not self.enabled or not rows:
+            return
+        alpha = self._alpha
+        epoch = self._EPOCH
+        transitions = []
+        
+        with self._lock:
+            for row in rows:
+                slot = self._slot((row['device_id'], row['sensor_type']))
+                value = row['value']
+                ts = (row['timestamp'] - epoch).total_seconds()
+                rule = self._compiled.get(row['sensor_type'])
+                flags = self._flags[slot]
+                new_flags = 0
+                rate = z = None
+                
+                if rule is not None:
+                    if value < rule[2] or value > rule[3]:
+                        new_flags = self.CRITICAL
+                    elif value < rule[0] or value > rule[1]:
+                        new_flags = self.WARNING
+                
+                count = self._count[slot]
+                if count and ts <= self._last_ts[slot]:
+                    # Late reading (buffered or replayed): thresholds only, the series moves forward in time
+                    new_flags |= flags & (self.RATE | self.ANOMALY)
+                else:
+                    if count:
+                        elapsed = ts - self._last_ts[slot]
+                        if elapsed < self._rate_min_interval:
+                            # Too close to the baseline for a meaningful rate: keep the previous verdict
+                            new_flags |= flags & self.RATE
+                        elif rule is not None and rule[4] is not None:
+                            rate = (value - self._last_value[slot]) * 60 / elapsed
+                            if abs(rate) > rule[4]:
+                                new_flags |= self.RATE
+                        mean = self._mean[slot]
+                        var = self._var[slot]
+                        diff = value - mean
+                        # Without a rule there is no min_std to floor a flat signal's deviation
+                        if rule is not None and count >= self._warmup:
+                            z = diff / max(math.sqrt(var), rule[5])
+                            if abs(z) > self._zscore:
+                                new_flags |= self.ANOMALY
+                        increment = alpha * diff
+                        self._mean[slot] = mean + increment
+                        self._var[slot] = (1 - alpha) * (var + diff * increment)
+                        if count < self._warmup:
+                            self._count[slot] = count + 1
+                        if elapsed >= self._rate_min_interval:
+                            self._last_value[slot] = value
+                            self._last_ts[slot] = ts
+                    else:
+                        self._mean[slot] = value
+                        self._count[slot] = 1
+                        self._last_value[slot] = value
+                        self._last_ts[slot] = ts
+                
+                if new_flags != flags:
+                    self._flags[slot] = new_flags
+                    transitions.append((row, flags, new_flags, rule, rate, z))
+            self.readings_evaluated += len(rows)
+        
+        if transitions:
+            for transition in transitions:
+                self._queue_transition(*transition)
+            self._wake.set()
+    
+    def _queue_transition(self, row, flags, new_flags, rule, rate, z):
+        level, new_level = flags & 3, new_flags & 3
+        if level != new_level:
+            if new_level:
+                severity = 'critical' if new_level == self.CRITICAL else 'warning'
+                low, high = (rule[2], rule[3]) if new_level == self.CRITICAL else (rule[0], rule[1])
+                limit = low if row['value'] < low else high
+                direction = 'below' if row['value'] < low else 'above'
+                self._pending.put(('open', row, 'threshold', severity, limit,
+                                   f"{row['sensor_type']} {row['value']:g} {row['unit']} {direction} {severity} limit {limit:g}"))
+            else:
+                self._pending.put(('resolve', row, 'threshold'))
+        
+        if (flags ^ new_flags) & self.RATE:
+            if new_flags & self.RATE:
+                self._pending.put(('open', row, 'rate_of_change', 'warning', round(rate, 3),
+                                   f"{row['sensor_type']} changing {rate:+.3g} {row['unit']}/min (limit {rule[4]:g})"))
+            else:
+                self._pending.put(('resolve', row, 'rate_of_change'))
+        
+        if (flags ^ new_flags) & self.ANOMALY:
+            if new_flags & self.ANOMALY:
+                self._pending.put(('open', row, 'anomaly', 'warning', round(z, 2),
+                                   f"{row['sensor_type']} {row['value']:g} {row['unit']} is {z:+.1f} sigma from its moving average"))
+            else:
+                self._pending.put(('resolve', row, 'anomaly'))
+    
+    def start(self):
+        """Start the alert writer thread (lazily, so it is created after a gunicorn fork)"""
+        if not self.enabled:
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='alert-writer', daemon=True)
+                self._thread.start()
+    
+    def shutdown(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+    
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.RETRY_INTERVAL if self._retry else None)
+            self._wake.clear()
+            self.flush()
+    
+    def flush(self) -> int:
+        """Write queued transitions to the alert table; returns the number written"""
+        transitions = list(self._retry)
+        self._retry.clear()
+        while True:
+            try:
+                transitions.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        if not transitions:
+            return 0
+        
+        with app.app_context():
+            try:
+                for transition in transitions:
+                    self._write(*transition)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Writing {len(transitions)} alert transitions failed: {e}")
+                if isinstance(e, TRANSIENT_DB_ERRORS):
+                    # Kept in order ahead of anything queued meanwhile
+                    dropped = max(len(transitions) - self.RETRY_MAX, 0)
+                    self._retry.extend(transitions[dropped:])
+                    self.write_errors += dropped
+                else:
+                    self.write_errors += len(transitions)
+                return 0
+        return len(transitions)
+    
+    def _may_change(self, alert: Alert) -> bool:
+        """True when this worker opened the alert, or the worker that did has exited"""
+        return alert.opened_by == process_owner() or not owner_alive(alert.opened_by)
+    
+    def _write(self, action, row, kind, severity=None, detail=None, message=None):
+        series = (Alert.device_id == row['device_id'], Alert.sensor_type == row['sensor_type'], Alert.kind == kind)
+        current = Alert.query.filter(*series, Alert.resolved_at.is_(None)).first()
+        
+        if action == 'resolve':
+            # Another worker may still see the condition on its share of the readings
+            if current is not None and self._may_change(current):
+                current.resolved_at = row['timestamp']
+                self.alerts_resolved += 1
+            return
+        
+        if current is not None:
+            if current.severity == severity:
+                if not owner_alive(current.opened_by):
+                    current.opened_by = process_owner()
+                return  # already open
+            if not self._may_change(current) \
+                    and self.SEVERITY_RANK[severity] < self.SEVERITY_RANK[current.severity]:
+                return  # the worker that escalated it still sees the worse condition
+            current.resolved_at = row['timestamp']
+        
+        # A series flapping around a limit reopens its last alert instead of adding rows
+        recent = Alert.query.filter(*series, Alert.severity == severity,
+                                    Alert.resolved_at >= row['timestamp'] - self._cooldown)\
+            .order_by(Alert.resolved_at.desc()).first()
+        if recent is not None:
+            recent.resolved_at = None
+            recent.value = row['value']
+            recent.detail = detail
+            recent.message = message
+            recent.opened_by = process_owner()
+            return
+        
+        db.session.add(Alert(
+            device_id=row['device_id'],
+            sensor_type=row['sensor_type'],
+            kind=kind,
+            severity=severity,
+            value=row['value'],
+            detail=detail,
+            message=message[:200],
+            triggered_at=row['timestamp'],
+            opened_by=process_owner()
+        ))
+        self.alerts_opened += 1
+        app.logger.warning(f"Alert on {row['device_id']}: {message}")
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'series_tracked': len(self._flags),
+            'readings_evaluated': self.readings_evaluated,
+            'alerts_opened': self.alerts_opened,
+            'alerts_resolved': self.alerts_resolved,
+            'pending_writes': self._pending.qsize() + len(self._retry),
+            'write_errors': self.write_errors
+        }
+
+def process_owner() -> str:
+    """host:pid of this process, as recorded on the alerts it opens"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+def owner_alive(owner: Optional[str]) -> bool:
+    """Whether the process named by process_owner() still runs (other hosts are assumed alive)"""
+    if not owner:
+        return False
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname():
+        return True
+    return process_alive(int(pid))
+
+def alert_to_dict(alert: Alert) -> Dict[str, Any]:
+    return {
+        'id': alert.id,
+        'device_id': alert.device_id,
+        'sensor_type': alert.sensor_type,
+        'kind': alert.kind,
+        'severity': alert.severity,
+        'value': alert.value,
+        'detail': alert.detail,
+        'message': alert.message,
+        'active': alert.resolved_at is None,
+        'triggered_at': alert.triggered_at.isoformat(),
+        'triggered_at_iran': format_iran_time(alert.triggered_at),
+        'resolved_at': alert.resolved_at.isoformat() if alert.resolved_at else None
+    }
+
+alert_engine = AlertEngine(ALERTS_ENABLED, ALERT_RULES, ALERT_EWMA_ALPHA, ALERT_ZSCORE,
+                           ALERT_WARMUP, ALERT_COOLDOWN, ALERT_RATE_MIN_INTERVAL)
+atexit.register(alert_engine.shutdown)
+
+# --- Offline Ingest Spool ---
+# Failures that say the database is unreachable or overloaded, not that the data is bad
+TRANSIENT_DB_ERRORS = (exc.OperationalError, exc.InterfaceError, exc.DisconnectionError, exc.TimeoutError)
+
+class IngestSpool:
+    """Durable append-only log for readings the database could not take.
+    
+    Each process appends length-prefixed, CRC-checked records to its own segment
+    (<time>-<pid>.log, renamed to .sealed at INGEST_SPOOL_SEGMENT_BYTES). fsyncs are
+    grouped: one fsync covers every record written before it. The replayer (one
+    process at a time, via replay.lock) maps segments and bulk-loads them through
+    store_readings, committing each segment's offset in the same transaction, so a
+    crash never replays a record twice.
+    
+    Only connectivity errors are spooled. A replay batch the database rejects for
+    any other reason is bisected with rolled-back trial inserts, and the records
+    that fail on their own are moved to dead-letter.jsonl so they cannot wedge replay.
+    """
+    RECORD_HEADER = struct.Struct('<II')  # payload length, crc32
+    
+    def __init__(self, directory: str, segment_bytes: int, fsync: bool,
+                 replay_interval: float, replay_batch: int):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.replay_interval = replay_interval
+        self.replay_batch = replay_batch
+        self._lock = threading.Lock()       # appends and segment rolls
+        self._sync_lock = threading.Lock()  # group fsync
+        self._fd = None
+        self._path = None
+        self._size = 0
+        self._written = 0
+        self._synced = 0
+        self._failed_at = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self.rows_spooled = 0
+        self.rows_replayed = 0
+        self.rows_dead_lettered = 0
+        self.replay_errors = 0
+        self.last_replay_error = None
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+    
+    def bypass_database(self) -> bool:
+        """True for one replay interval after a failed commit"""
+        return (self.enabled and self._failed_at is not None
+                and time.monotonic() - self._failed_at < self.replay_interval)
+    
+    def spool_failed(self, rows: List[Dict[str, Any]], error: Exception) -> bool:
+        """Spool rows whose commit failed because the database is unreachable, and
+        skip the database for a while. Other errors are left to the caller."""
+        if not self.enabled or not isinstance(error, TRANSIENT_DB_ERRORS):
+            return False
+        self._failed_at = time.monotonic()
+        return self.append(rows)
+    
+    @staticmethod
+    def _record_row(row: Dict[str, Any]) -> list:
+        return [row['device_id'], row['sensor_type'], row['value'], row['unit'],
+                row['timestamp'].isoformat(), row.get('seq')]
+    
+    def append(self, rows: List[Dict[str, Any]]) -> bool:
+        """Durably append rows; False when the spool is disabled or the write failed"""
+        if not self.enabled or not rows:
+            return False
+        payload = dumps_json([self._record_row(row) for row in rows])
+        record = self.RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        
+        try:
+            with self._lock:
+                if self._fd is None:
+                    self._open_segment()
+                os.write(self._fd, record)
+                self._size += len(record)
+                self._written += 1
+                ticket = self._written
+                self.rows_spooled += len(rows)
+                if self._size >= self.segment_bytes:
+                    self._seal()
+            if self.fsync:
+                self._sync(ticket)
+        except OSError as e:
+            app.logger.error(f"Ingest spool write of {len(rows)} readings failed: {e}")
+            return False
+        
+        app.logger.warning(f"Spooled {len(rows)} readings to {self.directory}")
+        return True
+    
+    def _open_segment(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._path = os.path.join(self.directory, f'{time.time_ns():016x}-{os.getpid()}.log')
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._size = 0
+        # Make the new directory entry durable too
+        dir_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    
+    def _sync(self, ticket: int):
+        """fsync unless a concurrent fsync already covered record `ticket`"""
+        with self._sync_lock:
+            if self._synced >= ticket or self._fd is None:
+                return
+            target = self._written
+            os.fsync(self._fd)
+            self._synced = target
+    
+    def _seal(self):
+        """Close the active segment for good (caller holds self._lock)"""
+        with self._sync_lock:
+            os.fsync(self._fd)
+            self._synced = self._written
+            os.close(self._fd)
+            self._fd = None
+        os.rename(self._path, self._path[:-len('.log')] + '.sealed')
+    
+    def start(self):
+        """Start the replayer thread (lazily, so it is created after a gunicorn fork)"""
+        if not self.enabled:
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='ingest-spool-replayer', daemon=True)
+                self._thread.start()
+    
+    def shutdown(self):
+        self._stop.set()
+        with self._lock:
+            if self._fd is not None:
+                self._seal()
+    
+    def _run(self):
+        while not self._stop.wait(self.replay_interval):
+            self.replay()
+    
+    def _segments(self) -> List[tuple]:
+        """(name, path, sealed) for every segment, oldest first"""
+        segments = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.sealed'):
+                segments.append((name, path, True))
+            elif name.endswith('.log'):
+                pid = int(name[:-len('.log')].rsplit('-', 1)[1])
+                # A segment whose writer has exited will not grow any more
+                segments.append((name, path, not process_alive(pid)))
+        return segments
+    
+    def replay(self) -> int:
+        """Load spooled readings into the database; returns the number stored"""
+        if not self.enabled or not os.path.isdir(self.directory):
+            return 0
+        
+        lock_fd = os.open(os.path.join(self.directory, 'replay.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return 0  # another process is replaying
+            
+            replayed = 0
+            with app.app_context():
+                try:
+                    for name, path, sealed in self._segments():
+                        replayed += self._replay_segment(name, path, sealed)
+                except Exception as e:
+                    db.session.rollback()
+                    if isinstance(e, TRANSIENT_DB_ERRORS):
+                        self._failed_at = time.monotonic()
+                    self.replay_errors += 1
+                    self.last_replay_error = str(e)
+                    app.logger.error(f"Ingest spool replay failed: {e}")
+            if replayed:
+                app.logger.info(f"Ingest spool: replayed {replayed} readings")
+            return replayed
+        finally:
+            os.close(lock_fd)
+    
+    def _replay_segment(self, name: str, path: str, sealed: bool) -> int:
+        checkpoint_name = 'spool:' + name.rsplit('.', 1)[0]
+        checkpoint = db.session.get(IngestCheckpoint, checkpoint_name)
+        offset = checkpoint.position if checkpoint is not None else 0
+        size = os.path.getsize(path)
+        replayed = 0
+        
+        if offset < size:
+            with open(path, 'rb') as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                while offset < size:
+                    rows, end, rejected = self._read_records(view, offset, size)
+                    if end == offset:
+                        break  # record still being written, or a torn tail
+                    rows.sort(key=itemgetter('timestamp'))
+                    try:
+                        stored_rows = store_readings(rows)
+                        db.session.flush()
+                    except TRANSIENT_DB_ERRORS:
+                        raise
+                    except Exception as e:
+                        db.session.rollback()
+                        rows, poison = self._isolate_poison(rows, e)
+                        rejected.extend(poison)
+                        stored_rows = store_readings(rows) if rows else []
+                    if rejected:
+                        # Written before the checkpoint commits: a crash may repeat a
+                        # dead-letter entry but never loses one
+                        self._dead_letter(name, rejected)
+                    if checkpoint is None:
+                        checkpoint = IngestCheckpoint(name=checkpoint_name, position=end)
+                        db.session.add(checkpoint)
+                    checkpoint.position = end
+                    checkpoint.updated_at = datetime.datetime.utcnow()
+                    db.session.commit()
+                    on_readings_committed(stored_rows)
+                    replayed += len(stored_rows)
+                    self.rows_replayed += len(stored_rows)
+                    offset = end
+        
+        if sealed:
+            if offset < size:
+                app.logger.warning(f"Ingest spool: dropping {size - offset} unreadable bytes at the end of {name}")
+            os.remove(path)
+            if checkpoint is not None:
+                db.session.delete(checkpoint)
+                db.session.commit()
+        return replayed
+    
+    def _read_records(self, view, offset: int, size: int):
+        """Rows of the complete records from `offset`, up to about replay_batch rows.
+        
+        Returns (rows, end offset, [(record, error)] for records that do not decode).
+        """
+        header = self.RECORD_HEADER
+        rows = []
+        rejected = []
+        while offset + header.size <= size and len(rows) < self.replay_batch:
+            length, crc = header.unpack_from(view, offset)
+            start = offset + header.size
+            if start + length > size:
+                break
+            payload = view[start:start + length]
+            if zlib.crc32(payload) != crc:
+                break
+            offset = start + length
+            try:
+                rows.extend([{
+                    'device_id': device_id,
+                    'sensor_type': sensor_type,
+                    'value': value,
+                    'unit': unit,
+                    'timestamp': datetime.datetime.fromisoformat(timestamp),
+                    'seq': seq
+                } for device_id, sensor_type, value, unit, timestamp, seq in json.loads(payload)])
+            except (ValueError, TypeError) as e:
+                rejected.append((payload.decode('utf-8', 'replace'), str(e)))
+        return rows, offset, rejected
+    
+    def _trial_store(self, rows: List[Dict[str, Any]]) -> Optional[Exception]:
+        """Insert rows and roll back; returns the error they raise, if any"""
+        try:
+            store_readings(rows)
+            db.session.flush()
+        except TRANSIENT_DB_ERRORS:
+            raise
+        except Exception as e:
+            return e
+        finally:
+            db.session.rollback()
+        return None
+    
+    def _isolate_poison(self, rows: List[Dict[str, Any]], error: Exception):
+        """Bisect a batch that failed with `error` into (good rows, [(row, error)])"""
+        if len(rows) == 1:
+            return [], [(rows[0], str(error))]
+        good, poison = [], []
+        middle = len(rows) // 2
+        for half in (rows[:middle], rows[middle:]):
+            half_error = self._trial_store(half)
+            if half_error is None:
+                good.extend(half)
+            else:
+                half_good, half_poison = self._isolate_poison(half, half_error)
+                good.extend(half_good)
+                poison.extend(half_poison)
+        return good, poison
+    
+    def _dead_letter(self, segment: str, rejected: List[tuple]):
+        """Append rejected records to dead-letter.jsonl (one JSON object per line)"""
+        lines = b''.join(dumps_json({
+            'segment': segment,
+            'error': error,
+            'record': self._record_row(record) if isinstance(record, dict) else record,
+            'rejected_at': datetime.datetime.utcnow().isoformat()
+        }) + b'\n' for record, error in rejected)
+        with open(os.path.join(self.directory, 'dead-letter.jsonl'), 'ab') as handle:
+            handle.write(lines)
+            handle.flush()
+            if self.fsync:
+                os.fsync(handle.fileno())
+        self.rows_dead_lettered += len(rejected)
+        app.logger.error(f"Ingest spool: moved {len(rejected)} rejected records from {segment} "
+                         f"to dead-letter.jsonl (first error: {rejected[0][1]})")
+    
+    def stats(self) -> Dict[str, Any]:
+        pending_bytes = 0
+        segments = 0
+        if self.enabled and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith(('.log', '.sealed')):
+                    segments += 1
+                    pending_bytes += os.path.getsize(os.path.join(self.directory, name))
+        return {
+            'enabled': self.enabled,
+            'bypassing_database': self.bypass_database(),
+            'segments': segments,
+            'segment_bytes': pending_bytes,
+            'rows_spooled': self.rows_spooled,
+            'rows_replayed': self.rows_replayed,
+            'rows_dead_lettered': self.rows_dead_lettered,
+            'replay_errors': self.replay_errors,
+            'last_replay_error': self.last_replay_error
+        }
 
-def is_device_online(last_seen: datetime.datetime, threshold_minutes: int = 5) -> bool:
-    """Determine if device is online/offline"""
-    if not last_seen:
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
         return False
-    
-    now = datetime.datetime.utcnow()
-    threshold = datetime.timedelta(minutes=threshold_minutes)
-    return (now - last_seen) < threshold
+    except PermissionError:
+        pass  # exists, owned by someone else
+    return True
 
-# --- Database Models ---
-class Device(db.Model):
-    """Device registration table"""
-    id = db.Column(db.String(50), primary_key=True)  # MAC Address
-    name = db.Column(db.String(100), nullable=True)
-    location = db.Column(db.String(200), nullable=True)
-    first_seen = db.Column(db.DateTime, default=datetime.datetime.utcnow)
-    last_seen = db.Column(db.DateTime, default=datetime.datetime.utcnow)
-    is_active = db.Column(db.Boolean, default=True)
+def spooled_frame_payload(frame: FramePayload, rows: List[Dict[str, Any]], rejected: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Response body for a frame written to the spool instead of the database"""
+    return {
+        'message': 'Database unavailable, data spooled for replay',
+        'readings_spooled': len(rows),
+        'rejected_readings': rejected,
+        'device_id': frame.device_id,
+        'timestamp_utc': datetime.datetime.utcnow().isoformat(),
+        'timestamp_iran': get_iran_time().strftime('%Y-%m-%d %H:%M:%S IRST')
+    }
+
+ingest_spool = IngestSpool(INGEST_SPOOL_DIR, INGEST_SPOOL_SEGMENT_BYTES, INGEST_SPOOL_FSYNC,
+                           INGEST_SPOOL_REPLAY_INTERVAL, INGEST_SPOOL_REPLAY_BATCH)
+atexit.register(ingest_spool.shutdown)
+
+# --- Write-Behind Ingest Buffer ---
+class IngestBuffer:
+    """Bounded in-process queue of readings flushed by a background writer.
+    
+    Requests enqueue validated rows and return immediately; the writer thread
+    group-commits them once INGEST_FLUSH_SIZE readings have accumulated or
+    INGEST_FLUSH_INTERVAL seconds have passed, whichever comes first. A batch
+    rejected by the database is retried one frame at a time, so a bad frame
+    only costs its own readings.
+    """
+    
+    def __init__(self, maxsize: int, flush_size: int, flush_interval: float):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._flush_size = flush_size
+        self._flush_interval = flush_interval
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.frames_enqueued = 0
+        self.frames_rejected = 0
+        self.rows_flushed = 0
+        self.rows_failed = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+    
+    def start(self):
+        """Start the writer thread (lazily, so it is created after a gunicorn fork)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+                self._thread.start()
+    
+    def submit(self, rows: List[Dict[str, Any]]) -> bool:
+        """Queue one frame's rows; returns False when the buffer is full"""
+        self.start()
+        try:
+            self._queue.put_nowait(rows)
+        except queue.Full:
+            self.frames_rejected += 1
+            return False
+        self.frames_enqueued += 1
+        return True
+    
+    def shutdown(self, timeout: float = 30.0):
+        """Stop accepting work and drain everything still queued"""
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+    
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            frames = []
+            row_count = 0
+            deadline = time.monotonic() + self._flush_interval
+            while row_count < self._flush_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    frame = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                frames.append(frame)
+                row_count += len(frame)
+            if frames:
+                self._flush(frames)
+    
+    def _flush(self, frames: List[List[Dict[str, Any]]]):
+        started = time.perf_counter()
+        rows = [row for frame in frames for row in frame]
+        
+        # Database recently failed: go straight to the spool
+        if ingest_spool.bypass_database() and ingest_spool.append(rows):
+            return
+        
+        with app.app_context():
+            try:
+                stored_rows = self._commit(rows)
+            except Exception as e:
+                app.logger.error(f"Ingest buffer flush of {len(rows)} readings failed: {e}")
+                db.session.rollback()
+                if ingest_spool.spool_failed(rows, e):
+                    stored_rows = []
+                elif len(frames) > 1:
+                    stored_rows = self._commit_frames(frames)
+                else:
+                    stored_rows = []
+                    self.rows_failed += len(rows)
+            if stored_rows:
+                try:
+                    on_readings_committed(stored_rows)
+                except Exception as e:
+                    app.logger.error(f"Post-commit hooks for {len(stored_rows)} buffered readings failed: {e}")
+        
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.flushes += 1
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+    
+    def _commit(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Frames from many requests: insert late ones in time order
+        rows.sort(key=itemgetter('timestamp'))
+        with metrics.time_ingest_commit('buffered'):
+            stored_rows = store_readings(rows)
+            db.session.commit()
+        self.rows_flushed += len(stored_rows)
+        return stored_rows
+    
+    def _commit_frames(self, frames: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Commit a rejected batch frame by frame, dropping only the frames that fail again"""
+        stored_rows = []
+        for frame in frames:
+            if ingest_spool.bypass_database() and ingest_spool.append(frame):
+                continue
+            try:
+                stored_rows.extend(self._commit(frame))
+            except Exception as e:
+                app.logger.error(f"Ingest buffer frame from {frame[0]['device_id']} rejected: {e}")
+                db.session.rollback()
+                if not ingest_spool.spool_failed(frame, e):
+                    self.rows_failed += len(frame)
+        return stored_rows
     
-    readings = db.relationship('SensorReading', backref='device', lazy=True, cascade='all, delete-orphan')
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'mode': INGEST_MODE,
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self._queue.maxsize,
+            'writer_alive': self._thread is not None and self._thread.is_alive(),
+            'frames_enqueued': self.frames_enqueued,
+            'frames_rejected': self.frames_rejected,
+            'rows_flushed': self.rows_flushed,
+            'rows_failed': self.rows_failed,
+            'flushes': self.flushes,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'max_flush_ms': round(self.max_flush_ms, 2),
+            'avg_flush_ms': round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0
+        }
 
-class SensorReading(db.Model):
-    """Sensor readings storage table"""
-    id = db.Column(db.Integer, primary_key=True)
-    device_id = db.Column(db.String(50), db.ForeignKey('device.id'), nullable=False)
-    sensor_type = db.Column(db.String(50), nullable=False)
-    value = db.Column(db.Float, nullable=False)
-    unit = db.Column(db.String(10), nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+ingest_buffer = IngestBuffer(INGEST_QUEUE_MAX, INGEST_FLUSH_SIZE, INGEST_FLUSH_INTERVAL)
+atexit.register(ingest_buffer.shutdown)
+
+# --- Live Event Broker ---
+class StreamSubscription:
+    """One live-stream client: its filters and a bounded queue of pending events.
     
-    # Add index for better performance
-    __table_args__ = (
-        db.Index('idx_device_sensor_time', 'device_id', 'sensor_type', 'timestamp'),
-    )
+    `wakeup`, when set, is called after every queued event (the ASGI stream uses
+    it to wake its coroutine instead of blocking a thread on the queue).
+    """
+    
+    def __init__(self, device_id: Optional[str], sensor_types: Optional[set]):
+        self.device_id = device_id
+        self.sensor_types = sensor_types
+        self.queue = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self.wakeup = None
+        self.dropped = 0
+    
+    def matches(self, event: Dict[str, Any]) -> bool:
+        if self.device_id and event['device_id'] != self.device_id:
+            return False
+        return not self.sensor_types or event['sensor_type'] in self.sensor_types
+    
+    def offer(self, kind: str, payload) -> bool:
+        """Queue one SSE event without blocking; False (and counted) when the client is behind"""
+        try:
+            self.queue.put_nowait((kind, payload))
+        except queue.Full:
+            self.dropped += len(payload) if isinstance(payload, list) else 1
+            return False
+        if self.wakeup is not None:
+            self.wakeup()
+        return True
 
-# Create tables
-with app.app_context():
-    try:
-        db.create_all()
-        app.logger.info(f"Database initialized successfully. Environment: {ENV}")
-        if ENV == 'development':
-            app.logger.info(f"SQLite Database at: {DATABASE_PATH}")
-    except Exception as e:
-        app.logger.error(f"Database initialization failed: {e}")
+def sse_message(kind: str, payload) -> str:
+    """One Server-Sent Events message"""
+    return f"event: {kind}\ndata: {dumps_json(payload).decode('utf-8')}\n\n"
 
-# --- Helper Functions ---
-def validate_sensor_data(data):
-    """Validate sensor data"""
-    if not isinstance(data, dict):
-        return False, "Data must be a JSON object"
+class EventBroker:
+    """In-process pub/sub for committed readings.
     
-    required_fields = ['device_id', 'sensors']
-    for field in required_fields:
-        if field not in data:
-            return False, f"Missing required field: {field}"
+    Events are delivered to local subscribers directly. When a socket directory
+    is configured every worker also binds a Unix datagram socket there, and a
+    sender thread forwards each batch to all peers in datagrams of at most
+    STREAM_DATAGRAM_BYTES, so a client connected to any worker sees readings
+    ingested by every worker. Ingest never waits on a peer: a peer that stays
+    full for STREAM_SEND_TIMEOUT misses the datagram (counted in events_dropped).
+    """
     
-    if not isinstance(data['sensors'], list):
-        return False, "Sensors must be an array"
+    def __init__(self, socket_dir: Optional[str] = None):
+        self._subscribers = set()
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._socket_dir = socket_dir
+        self._socket = None
+        self._socket_path = None
+        self._listener = None
+        self._outbox = queue.Queue(maxsize=1000)
+        self._sender = None
+        self.events_published = 0
+        self.events_dropped = 0
     
-    if len(data['sensors']) == 0:
-        return False, "At least one sensor reading required"
+    def start(self):
+        """Bind this worker's socket so it receives peer events before it publishes anything"""
+        if self._socket_dir:
+            self._ensure_socket()
     
-    for i, sensor in enumerate(data['sensors']):
-        if not isinstance(sensor, dict):
-            return False, f"Sensor {i} must be an object"
+    def _ensure_socket(self):
+        """Bind this process's socket (after fork, so each gunicorn worker gets its own)"""
+        with self._lock:
+            if self._socket is not None and self._socket_path.endswith(f'-{os.getpid()}.sock'):
+                return
+            os.makedirs(self._socket_dir, exist_ok=True)
+            self._socket_path = os.path.join(self._socket_dir, f'stream-{os.getpid()}.sock')
+            if os.path.exists(self._socket_path):
+                os.unlink(self._socket_path)
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._socket.bind(self._socket_path)
+            self._listener = threading.Thread(target=self._listen, args=(self._socket,),
+                                              name='stream-listener', daemon=True)
+            self._listener.start()
+            self._sender = threading.Thread(target=self._send, args=(self._socket,),
+                                            name='stream-sender', daemon=True)
+            self._sender.start()
+    
+    def _listen(self, sock: socket.socket):
+        while True:
+            try:
+                payload = sock.recv(STREAM_DATAGRAM_BYTES)
+            except OSError:
+                return
+            try:
+                self._deliver(json.loads(payload))
+            except ValueError as e:
+                app.logger.warning(f"Dropping malformed stream datagram: {e}")
+    
+    def subscribe(self, device_id: Optional[str] = None,
+                  sensor_types: Optional[set] = None) -> StreamSubscription:
+        if self._socket_dir:
+            self._ensure_socket()
+        subscription = StreamSubscription(device_id, sensor_types)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+    
+    def add_listener(self, callback):
+        """Call callback(events) for every delivered batch, in every worker"""
+        self._listeners.append(callback)
+    
+    def unsubscribe(self, subscription: StreamSubscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+    
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+    
+    def publish(self, rows: List[Dict[str, Any]]):
+        """Publish committed rows to local subscribers and peer workers"""
+        if not rows:
+            return
+        utc_iso, iran, _ = format_iran_columns([row['timestamp'] for row in rows])
+        events = [{
+            'device_id': row['device_id'],
+            'sensor_type': row['sensor_type'],
+            'value': row['value'],
+            'unit': row['unit'],
+            'timestamp_utc': utc_iso[i],
+            'timestamp_iran': iran[i]
+        } for i, row in enumerate(rows)]
+        self.events_published += len(events)
+        self._deliver(events)
         
-        required_sensor_fields = ['type', 'value', 'unit']
-        for field in required_sensor_fields:
-            if field not in sensor:
-                return False, f"Sensor {i} missing field: {field}"
+        if not self._socket_dir:
+            return
         
-        if not isinstance(sensor['value'], (int, float)):
-            return False, f"Sensor {i} value must be a number"
+        self._ensure_socket()
+        try:
+            self._outbox.put_nowait(events)
+        except queue.Full:
+            self.events_dropped += len(events)
     
-    return True, None
+    def _send(self, sock: socket.socket):
+        """Forward queued batches to every peer socket"""
+        while True:
+            events = self._outbox.get()
+            own_path = self._socket_path
+            peer_paths = [path for path in glob.glob(os.path.join(self._socket_dir, 'stream-*.sock'))
+                          if path != own_path]
+            if not peer_paths:
+                continue
+            payloads = self._datagrams(events)
+            for peer_path in peer_paths:
+                for count, payload in payloads:
+                    if not self._send_datagram(sock, payload, peer_path):
+                        self.events_dropped += count
+    
+    def _send_datagram(self, sock: socket.socket, payload: bytes, peer_path: str) -> bool:
+        deadline = time.monotonic() + STREAM_SEND_TIMEOUT
+        delay = 0.001
+        while True:
+            try:
+                sock.sendto(payload, socket.MSG_DONTWAIT, peer_path)
+                return True
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Socket left behind by a worker that has exited
+                try:
+                    os.unlink(peer_path)
+                except OSError:
+                    pass
+                return False
+            except BlockingIOError:
+                # Peer's queue is full: back off briefly, then give up on it
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(delay)
+                delay = min(delay * 2, 0.05)
+            except OSError as e:
+                app.logger.warning(f"Stream fan-out to {peer_path} failed: {e}")
+                return False
+    
+    def _datagrams(self, events: List[Dict[str, Any]]) -> List[tuple]:
+        """(event count, payload) chunks that each fit in one datagram"""
+        payload = dumps_json(events)
+        if len(payload) <= STREAM_DATAGRAM_BYTES:
+            return [(len(events), payload)]
+        if len(events) == 1:
+            app.logger.warning(f"Stream event of {len(payload)} bytes is too large to fan out")
+            return []
+        middle = len(events) // 2
+        return self._datagrams(events[:middle]) + self._datagrams(events[middle:])
+    
+    def _deliver(self, events: List[Dict[str, Any]]):
+        for callback in self._listeners:
+            try:
+                callback(events)
+            except Exception as e:
+                app.logger.error(f"Event listener failed: {e}")
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            matched = [event for event in events if subscription.matches(event)]
+            if matched:
+                # Slow client - drop rather than block ingest
+                subscription.offer('readings', matched)
+    
+    def publish_presence(self, device_id: str, status: str, at: datetime.datetime):
+        """Presence listener: send an online/offline transition to local subscribers.
+        
+        Not fanned out - every worker's tracker merges the others' last_seen and
+        reports the same transitions to its own clients.
+        """
+        event = {'device_id': device_id, 'status': status, 'at': at.isoformat(), 'at_iran': format_iran_time(at)}
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if not subscription.device_id or subscription.device_id == device_id:
+                subscription.offer('presence', event)
 
-def register_or_update_device(device_id):
-    """Register or update device"""
-    device = Device.query.get(device_id)
+event_broker = EventBroker(STREAM_SOCKET_DIR)
+presence_tracker.add_listener(event_broker.publish_presence)
+
+# --- Response Cache ---
+class CachedResponse:
+    """One cached response body with its ETag"""
     
-    if not device:
-        device = Device(id=device_id)
-        db.session.add(device)
-        app.logger.info(f"New device registered: {device_id}")
+    # Top-level fields stamped with the time the body was built, not part of the data
+    VOLATILE_FIELDS = ('timestamp', 'timestamp_utc', 'timestamp_iran')
     
-    device.last_seen = datetime.datetime.utcnow()
-    device.is_active = True
+    def __init__(self, body: bytes, mimetype: str, generation: int):
+        self.body = body
+        self.mimetype = mimetype
+        self.generation = generation
+        self.etag = self.content_etag(body, mimetype)
+        self.created = time.monotonic()
+        self.last_modified = datetime.datetime.now(pytz.utc)
     
-    return device
+    @classmethod
+    def content_etag(cls, body: bytes, mimetype: str) -> str:
+        """Hash of the body without its build-time stamps, so unchanged data keeps its ETag
+        across cache entries and workers"""
+        if mimetype == 'application/json':
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                payload = None
+            if isinstance(payload, dict):
+                for field in cls.VOLATILE_FIELDS:
+                    payload.pop(field, None)
+                body = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        return hashlib.blake2b(body, digest_size=16).hexdigest()
 
-def get_device_status_info(device_id: str) -> Dict[str, Any]:
-    """Get device status info including latest readings - FIXED VERSION"""
-    device = Device.query.get(device_id)
-    if not device:
-        return None
+class ResponseCache:
+    """LRU cache of read endpoint responses keyed on path plus query args.
     
-    # Latest reading for each sensor type
-    latest_readings = db.session.query(SensorReading)\
-        .filter_by(device_id=device_id)\
-        .order_by(SensorReading.timestamp.desc())\
-        .limit(10).all()
+    Entries are valid for at most `ttl` seconds (time-derived fields such as
+    is_online change without new data) and only while the ingest generation
+    they were built at is still current.
+    """
     
-    # Group by sensor type
-    sensor_status = {}
-    for reading in latest_readings:
-        if reading.sensor_type not in sensor_status:
-            # Fixed timestamp formatting
-            iran_time = utc_to_iran_time(reading.timestamp)
-            
-            sensor_status[reading.sensor_type] = {
-                'value': reading.value,
-                'unit': reading.unit,
-                'timestamp': reading.timestamp.isoformat(),
-                'timestamp_iran': format_iran_time(reading.timestamp),
-                'timestamp_formatted': iran_time.strftime('%Y-%m-%d %H:%M:%S'),
-                'is_online': is_device_online(reading.timestamp)
-            }
+    def __init__(self, ttl: float, max_entries: int):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
     
-    return {
-        'device_id': device.id,
-        'name': device.name or f'Device-{device.id[-8:]}',
-        'location': device.location,
-        'is_online': is_device_online(device.last_seen),
-        'last_seen': device.last_seen.isoformat(),
-        'last_seen_iran': format_iran_time(device.last_seen),
-        'sensors': sensor_status
-    }
+    @property
+    def enabled(self) -> bool:
+        return self._ttl > 0 and self._max_entries > 0
+    
+    def bump_generation(self, *args):
+        """Invalidate every entry - called whenever new readings are committed"""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+    
+    def get(self, key) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.generation != self.generation \
+                    or time.monotonic() - entry.created > self._ttl:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+    
+    def put(self, key, entry: CachedResponse):
+        with self._lock:
+            if entry.generation != self.generation:
+                return  # new readings arrived while it was being built
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+response_cache = ResponseCache(RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX)
+event_broker.add_listener(response_cache.bump_generation)
+
+def cached_response(view):
+    """Serve a GET endpoint from the response cache with ETag / 304 support"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not response_cache.enabled:
+            return view(*args, **kwargs)
+        
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+        entry = response_cache.get(key)
+        
+        if entry is None:
+            generation = response_cache.generation
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            entry = CachedResponse(response.get_data(), response.mimetype, generation)
+            response_cache.put(key, entry)
+        
+        response = Response(entry.body, mimetype=entry.mimetype)
+        # Weak: equal ETags mean the same data, not byte-identical bodies
+        response.set_etag(entry.etag, weak=True)
+        response.last_modified = entry.last_modified
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    
+    return wrapper
+
+def on_readings_committed(rows: List[Dict[str, Any]]):
+    """Post-commit hook shared by every ingest path"""
+    metrics.observe_ingest(len(rows))
+    sequence_window.mark(rows)
+    presence_tracker.record(rows)
+    latest_cache.update(rows)
+    alert_engine.evaluate(rows)
+    event_broker.publish(rows)
 
 # --- API Endpoints ---
+@app.before_request
+def start_background_workers():
+    """Start per-process background workers (at worker start, else on the first request)"""
+    if ROLLUP_ENABLED or RETENTION_DAYS > 0 or PARTITION_READINGS or INGEST_SEQ_RETENTION_DAYS > 0 \
+            or ALERT_RETENTION_DAYS > 0:
+        maintenance_worker.start()
+    ingest_spool.start()
+    alert_engine.start()
+    presence_tracker.start()
+    event_broker.start()
+
+def endpoint_label() -> str:
+    """Route pattern of the current request, used as the metrics label"""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+@app.before_request
+def start_request_metrics():
+    g.request_metrics = metrics.start_request(endpoint_label())
+
+@app.after_request
+def record_request_metrics(response):
+    # Streamed bodies (exports, SSE) are timed up to the first byte only
+    metrics.finish_request(g.pop('request_metrics', None), endpoint_label(), request.method, response.status_code)
+    return response
+
 @app.route('/', methods=['GET'])
 def home():
     """Home page"""
@@ -241,11 +3881,21 @@ def home():
         'endpoints': {
             'health': '/api/health',
             'sensors': '/api/sensors (POST)',
+            'sensors_batch': '/api/sensors/batch (POST)',
+            'ingest_stats': '/api/ingest/stats',
+            'storage_stats': '/api/storage/stats',
+            'metrics': '/metrics (Prometheus)',
+            'stream': '/api/stream (SSE)',
             'dashboard': '/api/dashboard/data',
+            'dashboard_aggregate': '/api/dashboard/aggregate',
             'devices': '/api/devices',
             'device_status': '/api/devices/{device_id}/status',
+            'device_presence': '/api/devices/presence',
+            'alerts': '/api/alerts',
+            'alert_rules': '/api/alerts/rules',
             'stats': '/api/stats',
             'export_csv': '/api/dashboard/export-csv',
+            'export': '/api/dashboard/export?format=csv|ndjson|arrow|parquet',
             'test_connection': '/api/test-connection',
             'reset_limits': '/api/reset-limits (DEV only)'
         }
@@ -332,68 +3982,82 @@ def receive_sensor_data():
     app.logger.info(f"Incoming request from: {request.remote_addr}")
     
     try:
-        # Check Content-Type
-        if not request.is_json:
-            app.logger.warning("Content-Type is not application/json")
-            return jsonify({'error': 'Content-Type must be application/json'}), 400
-        
-        data = request.get_json()
-        app.logger.info(f"Received data: {data}")
+        # Check Content-Type (JSON, MessagePack or the packed binary frame)
+        decode_frame = frame_decoder_for(request.mimetype)
+        if decode_frame is None:
+            app.logger.warning(f"Unsupported Content-Type: {request.mimetype}")
+            return jsonify({'error': f'Content-Type must be one of: {", ".join(FRAME_DECODERS)}'}), 400
         
-        if not data:
-            app.logger.warning("No JSON data received")
-            return jsonify({'error': 'No JSON data received'}), 400
+        # Decode, type-check and range-check straight from the raw body
+        received_at = datetime.datetime.utcnow()
+        try:
+            frame = decode_frame(request.get_data(cache=False))
+            saved_rows, rejected = build_frame_rows(frame, received_at)
+        except PayloadError as e:
+            app.logger.warning(f"Invalid data: {e.message} ({e.field})")
+            return jsonify(e.to_dict()), 400
         
-        # Validate data
-        is_valid, error_msg = validate_sensor_data(data)
-        if not is_valid:
-            app.logger.warning(f"Invalid data: {error_msg}")
-            return jsonify({'error': error_msg}), 400
+        if not saved_rows:
+            app.logger.warning(f"No valid readings from {frame.device_id}")
+            return jsonify({'error': 'No reading passed validation', 'rejected_readings': rejected}), 400
         
-        # Register or update device
-        device = register_or_update_device(data['device_id'])
+        # Retry of a frame this worker already stored: acknowledge without touching the database
+        if frame.seq is not None and sequence_window.seen(frame.device_id, frame.seq):
+            app.logger.info(f"Duplicate frame {frame.seq} from {frame.device_id} ignored")
+            return jsonify(duplicate_frame_payload(frame)), 200
         
-        # Save sensor readings
-        readings_saved = 0
-        failed_readings = 0
+        # Buffered mode: queue the readings for the background writer and return
+        if INGEST_MODE == 'buffered':
+            if not ingest_buffer.submit(saved_rows):
+                app.logger.warning("Ingest buffer full, rejecting request")
+                response = jsonify({'error': 'Ingest queue is full, retry later'})
+                response.headers['Retry-After'] = str(max(int(INGEST_FLUSH_INTERVAL), 1))
+                return response, 503
+            
+            return jsonify({
+                'message': 'Data queued successfully',
+                'readings_queued': len(saved_rows),
+                'rejected_readings': rejected,
+                'device_id': frame.device_id,
+                'timestamp_utc': datetime.datetime.utcnow().isoformat(),
+                'timestamp_iran': get_iran_time().strftime('%Y-%m-%d %H:%M:%S IRST')
+            }), 202
         
-        for sensor in data['sensors']:
-            try:
-                reading = SensorReading(
-                    device_id=device.id,
-                    sensor_type=sensor['type'],
-                    value=float(sensor['value']),
-                    unit=sensor['unit']
-                )
-                db.session.add(reading)
-                readings_saved += 1
-                app.logger.debug(f"Saved: {sensor['type']} = {sensor['value']} {sensor['unit']}")
-                
-            except (ValueError, KeyError) as e:
-                app.logger.error(f"Error processing sensor {sensor}: {e}")
-                failed_readings += 1
-                continue
+        # Database recently failed: spool straight away rather than wait on it again
+        if ingest_spool.bypass_database() and ingest_spool.append(saved_rows):
+            return jsonify(spooled_frame_payload(frame, saved_rows, rejected)), 202
         
-        # Commit changes
+        # Register the device, claim the frame's seq, insert and commit in one transaction
         try:
-            db.session.commit()
+            with metrics.time_ingest_commit('sync'):
+                stored_rows = store_readings(saved_rows)
+                db.session.commit()
+            on_readings_committed(stored_rows)
             app.logger.info("Database commit successful")
         except Exception as e:
             app.logger.error(f"Database commit failed: {e}")
             db.session.rollback()
+            if ingest_spool.spool_failed(saved_rows, e):
+                return jsonify(spooled_frame_payload(frame, saved_rows, rejected)), 202
             return jsonify({'error': 'Failed to save data to database'}), 500
+        saved_rows = stored_rows
+        
+        if not saved_rows:
+            app.logger.info(f"Duplicate frame {frame.seq} from {frame.device_id} ignored")
+            return jsonify(duplicate_frame_payload(frame)), 200
         
         iran_time = get_iran_time()
         response_data = {
             'message': 'Data received successfully',
-            'readings_saved': readings_saved,
-            'failed_readings': failed_readings,
-            'device_id': device.id,
+            'readings_saved': len(saved_rows),
+            'failed_readings': len(rejected),
+            'rejected_readings': rejected,
+            'device_id': frame.device_id,
             'timestamp_utc': datetime.datetime.utcnow().isoformat(),
             'timestamp_iran': iran_time.strftime('%Y-%m-%d %H:%M:%S IRST')
         }
         
-        app.logger.info(f"Success: {readings_saved} readings saved")
+        app.logger.info(f"Success: {len(saved_rows)} readings saved")
         return jsonify(response_data), 201
         
     except Exception as e:
@@ -401,8 +4065,146 @@ def receive_sensor_data():
         db.session.rollback()
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
+@app.route('/api/sensors/batch', methods=['POST'])
+@limiter.limit("100 per minute")
+def receive_sensor_batch():
+    """Receive many frames from one or more devices in a single request"""
+    app.logger.info(f"Incoming batch request from: {request.remote_addr}")
+    
+    try:
+        if not request.is_json:
+            return jsonify({'error': 'Content-Type must be application/json'}), 400
+        
+        try:
+            data = decode_json_body(request.get_data(cache=False))
+        except PayloadError as e:
+            return jsonify(e.to_dict()), 400
+        frames = data.get('frames') if isinstance(data, dict) else data
+        
+        if not isinstance(frames, list) or len(frames) == 0:
+            return jsonify({'error': 'Body must be a non-empty array of frames (or {"frames": [...]})'}), 400
+        
+        if len(frames) > MAX_BATCH_FRAMES:
+            return jsonify({'error': f'Too many frames in batch (max {MAX_BATCH_FRAMES})'}), 413
+        
+        rows, frame_results = validate_sensor_frames(frames)
+        
+        # Frames this worker already stored are acknowledged without a database write
+        new_rows = sequence_window.unseen(rows)
+        stored_rows = []
+        spooled_rows = []
+        if new_rows and ingest_spool.bypass_database() and ingest_spool.append(new_rows):
+            spooled_rows = new_rows
+        elif new_rows:
+            try:
+                with metrics.time_ingest_commit('batch'):
+                    stored_rows = store_readings(new_rows)
+                    db.session.commit()
+                on_readings_committed(stored_rows)
+            except Exception as e:
+                app.logger.error(f"Batch commit failed: {e}")
+                db.session.rollback()
+                if not ingest_spool.spool_failed(new_rows, e):
+                    return jsonify({'error': 'Failed to save data to database'}), 500
+                spooled_rows = new_rows
+        
+        frames_accepted = sum(1 for r in frame_results if r['accepted'])
+        frames_rejected = len(frame_results) - frames_accepted
+        
+        app.logger.info(f"Batch: {frames_accepted} frames accepted, {frames_rejected} rejected, "
+                        f"{len(stored_rows)} readings saved, {len(spooled_rows)} spooled")
+        
+        return jsonify({
+            'message': 'Batch processed',
+            'frames_received': len(frames),
+            'frames_accepted': frames_accepted,
+            'frames_rejected': frames_rejected,
+            'readings_saved': len(stored_rows),
+            'readings_spooled': len(spooled_rows),
+            'duplicate_readings': len(rows) - len(stored_rows) - len(spooled_rows),
+            'devices': len({row['device_id'] for row in stored_rows or spooled_rows}),
+            'rejected': [r for r in frame_results if not r['accepted']],
+            'timestamp_utc': datetime.datetime.utcnow().isoformat(),
+            'timestamp_iran': get_iran_time().strftime('%Y-%m-%d %H:%M:%S IRST')
+        }), (202 if spooled_rows else 201) if rows else 400
+        
+    except Exception as e:
+        app.logger.error(f"Unexpected error in batch ingest: {str(e)}")
+        db.session.rollback()
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+@app.route('/api/ingest/stats', methods=['GET'])
+def get_ingest_stats():
+    """Ingest buffer counters (queue depth, flush latency) and offline spool state"""
+    return jsonify({**ingest_buffer.stats(), 'spool': ingest_spool.stats()}), 200
+
+@app.route('/api/storage/stats', methods=['GET'])
+def get_storage_stats():
+    """Storage profile, SQLite pragmas in effect and connection pool saturation"""
+    try:
+        pragmas = None
+        if db.engine.dialect.name == 'sqlite':
+            pragmas = sqlite_pragma_values(db.engine)
+        return jsonify({
+            'profile': STORAGE_PROFILE,
+            'dialect': db.engine.dialect.name,
+            'read_replica': bool(DATABASE_READ_URL),
+            'sqlite_pragmas': pragmas,
+            'pools': pool_monitor.stats()
+        }), 200
+    except Exception as e:
+        app.logger.error(f"Error in storage stats: {e}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+@app.route('/metrics', methods=['GET'])
+@limiter.exempt
+def get_metrics():
+    """Prometheus text exposition (all workers when PROMETHEUS_MULTIPROC_DIR is set)"""
+    if not metrics.enabled:
+        if prometheus_client is None:
+            return jsonify({'error': 'Metrics require prometheus_client to be installed'}), 501
+        return jsonify({'error': 'Metrics are disabled (METRICS_ENABLED=false)'}), 404
+    try:
+        return Response(metrics.render(), content_type=prometheus_client.CONTENT_TYPE_LATEST)
+    except Exception as e:
+        app.logger.error(f"Error rendering metrics: {e}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+@app.route('/api/stream', methods=['GET'])
+def stream_readings():
+    """Server-Sent Events stream of new readings (filter by device_id / sensor_type)
+    and device online/offline transitions (filter by device_id)"""
+    device_id = request.args.get('device_id')
+    sensor_type = request.args.get('sensor_type')
+    sensor_types = set(sensor_type.split(',')) if sensor_type else None
+    
+    subscription = event_broker.subscribe(device_id, sensor_types)
+    app.logger.info(f"Stream opened from {request.remote_addr} "
+                    f"({event_broker.subscriber_count} subscribers)")
+    
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    kind, payload = subscription.queue.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield sse_message(kind, payload)
+        finally:
+            event_broker.unsubscribe(subscription)
+            app.logger.info(f"Stream closed ({subscription.dropped} events dropped)")
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/api/dashboard/data', methods=['GET'])
 @limiter.limit("200 per minute")  # افزایش یافته
+@cached_response
+@read_replica
 def get_dashboard_data():
     """Get dashboard data"""
     try:
@@ -414,155 +4216,308 @@ def get_dashboard_data():
         sensor_type = request.args.get('sensor_type')
         hours = int(request.args.get('hours', 24))
         
-        # Calculate start time
-        start_time = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+        # Keyset pagination on (timestamp, id): `cursor` walks back to older rows,
+        # `since` returns only rows newer than a previously seen position
+        cursor = request.args.get('cursor')
+        since = request.args.get('since')
+        try:
+            query = dashboard_data_query(limit, device_id, sensor_type, hours, cursor, since)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Build query
-        query = SensorReading.query.filter(SensorReading.timestamp >= start_time)
+        readings = db.session.execute(query).all()
+        app.logger.info(f"Found {len(readings)} readings")
         
-        if device_id:
-            query = query.filter(SensorReading.device_id == device_id)
+        return jsonify(dashboard_data_payload(readings, {
+            'limit': limit,
+            'device_id': device_id,
+            'sensor_type': sensor_type,
+            'hours': hours,
+            'cursor': cursor,
+            'since': since
+        })), 200
         
-        if sensor_type:
-            query = query.filter(SensorReading.sensor_type == sensor_type)
+    except Exception as e:
+        app.logger.error(f"Error in dashboard data: {e}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+@app.route('/api/dashboard/aggregate', methods=['GET'])
+@limiter.limit("200 per minute")
+@read_replica
+def get_dashboard_aggregate():
+    """Time-bucketed min/max/mean/count (or LTTB points) for historical charts"""
+    try:
+        device_id = request.args.get('device_id')
+        sensor_type = request.args.get('sensor_type')
+        hours = int(request.args.get('hours', 24))
+        # LTTB keeps the first and last point plus one per bucket: it needs at least 3
+        points = max(min(int(request.args.get('points', AGGREGATE_DEFAULT_POINTS)), AGGREGATE_MAX_POINTS), 3)
+        method = request.args.get('method', 'bucket')
         
-        # Execute query
-        readings = query.order_by(SensorReading.timestamp.desc()).limit(limit).all()
-        app.logger.info(f"Found {len(readings)} readings")
+        if method not in ('bucket', 'lttb'):
+            return jsonify({'error': "method must be 'bucket' or 'lttb'"}), 400
+        
+        start_time = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+        filters = [SensorReading.timestamp >= start_time]
         
-        # Convert to JSON with Iran time
         results = []
-        for reading in readings:
-            iran_time = utc_to_iran_time(reading.timestamp)
-            results.append({
-                'id': reading.id,
-                'device_id': reading.device_id,
-                'sensor_type': reading.sensor_type,
-                'value': reading.value,
-                'unit': reading.unit,
-                'timestamp_utc': reading.timestamp.isoformat(),
-                'timestamp_iran': iran_time.strftime('%Y-%m-%d %H:%M:%S IRST'),
-                'timestamp_persian': iran_time.strftime('%Y/%m/%d %H:%M:%S')
-            })
+        bucket_seconds = None
+        
+        if method == 'lttb':
+            # Stream raw columns one series at a time and keep the visually significant points
+            filters.extend(reading_dictionary.reading_filters(device_id, sensor_type))
+            rows = db.session.execute(
+                db.select(
+                    SensorReading.device_key, SensorReading.sensor_type_id,
+                    SensorReading.timestamp, SensorReading.value
+                ).where(*filters)
+                 .order_by(SensorReading.device_key, SensorReading.sensor_type_id, SensorReading.timestamp)
+                 .execution_options(yield_per=5000)
+            )
+            
+            def add_series(key, series_points):
+                series_device = reading_dictionary.device_id(key[0])
+                series_type, unit = reading_dictionary.sensor_type(key[1])
+                for _, value, timestamp in lttb_downsample(series_points, points):
+                    iran_time = utc_to_iran_time(timestamp)
+                    results.append({
+                        'device_id': series_device,
+                        'sensor_type': series_type,
+                        'unit': unit,
+                        'value': value,
+                        'min': value,
+                        'max': value,
+                        'mean': value,
+                        'count': 1,
+                        'timestamp_utc': timestamp.isoformat(),
+                        'timestamp_iran': iran_time.strftime('%Y-%m-%d %H:%M:%S IRST')
+                    })
+            
+            current_key = None
+            series_points = []
+            for row in rows:
+                key = (row.device_key, row.sensor_type_id)
+                if key != current_key:
+                    if series_points:
+                        add_series(current_key, series_points)
+                    current_key = key
+                    series_points = []
+                series_points.append((row.timestamp.replace(tzinfo=pytz.utc).timestamp(), row.value, row.timestamp))
+                if len(series_points) > LTTB_MAX_SOURCE_POINTS:
+                    # Too many raw points to hold: answer from the bucket aggregates instead
+                    rows.close()
+                    app.logger.info(f"LTTB over {hours}h exceeds {LTTB_MAX_SOURCE_POINTS} points, using buckets")
+                    method = 'bucket'
+                    results = []
+                    series_points = []
+                    break
+            if series_points:
+                add_series(current_key, series_points)
         
+        if method == 'bucket':
+            bucket_seconds = choose_bucket_seconds(hours, points)
+            
+            for group in aggregate_readings(start_time, bucket_seconds, device_id, sensor_type):
+                bucket_start = datetime.datetime.utcfromtimestamp(group['bucket'] * bucket_seconds)
+                iran_time = utc_to_iran_time(bucket_start)
+                mean = round(group['sum'] / group['count'], 4)
+                results.append({
+                    'device_id': group['device_id'],
+                    'sensor_type': group['sensor_type'],
+                    'unit': group['unit'],
+                    'value': mean,
+                    'min': group['min'],
+                    'max': group['max'],
+                    'mean': mean,
+                    'count': group['count'],
+                    'timestamp_utc': bucket_start.isoformat(),
+                    'timestamp_iran': iran_time.strftime('%Y-%m-%d %H:%M:%S IRST')
+                })
         return jsonify({
             'data': results,
             'count': len(results),
+            'method': method,
+            'bucket_seconds': bucket_seconds,
             'parameters': {
-                'limit': limit,
                 'device_id': device_id,
                 'sensor_type': sensor_type,
-                'hours': hours
+                'hours': hours,
+                'points': points,
+                'method': request.args.get('method', 'bucket')
             },
             'timestamp_utc': datetime.datetime.utcnow().isoformat(),
             'timestamp_iran': get_iran_time().strftime('%Y-%m-%d %H:%M:%S IRST')
         }), 200
         
     except Exception as e:
-        app.logger.error(f"Error in dashboard data: {e}")
+        app.logger.error(f"Error in dashboard aggregate: {e}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 @app.route('/api/dashboard/export-csv', methods=['GET'])
+@app.route('/api/dashboard/export', methods=['GET'])
 @limiter.limit("20 per minute")  # افزایش یافته
+@read_replica
 def export_csv():
-    """Download data as CSV"""
+    """Download data as CSV (or NDJSON / Arrow IPC / Parquet via ?format=)"""
     try:
-        app.logger.info(f"CSV export requested from: {request.remote_addr}")
+        app.logger.info(f"Export requested from: {request.remote_addr}")
         
         # Query parameters
         device_id = request.args.get('device_id')
         sensor_type = request.args.get('sensor_type')
         hours = int(request.args.get('hours', 24))
+        export_format = request.args.get('format', 'csv').lower()
         
-        # Calculate start time
-        start_time = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
         
-        # Build query
-        query = SensorReading.query.filter(SensorReading.timestamp >= start_time)
-        
-        if device_id:
-            query = query.filter(SensorReading.device_id == device_id)
+        if export_format in ('arrow', 'parquet') and pa is None:
+            return jsonify({'error': f'{export_format} export requires pyarrow to be installed'}), 501
         
-        if sensor_type:
-            query = query.filter(SensorReading.sensor_type == sensor_type)
+        # Calculate start time
+        start_time = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
         
-        # Execute query
-        readings = query.order_by(SensorReading.timestamp.asc()).all()
-        app.logger.info(f"Exporting {len(readings)} readings to CSV")
+        use_gzip = request.args.get('gzip', 'false').lower() == 'true'
         
-        # Create CSV in memory
-        output = io.StringIO()
-        writer = csv.writer(output)
+        # Build query over plain columns - no ORM objects are hydrated
+        query = db.select(
+            SensorReading.id, SensorReading.device_key, SensorReading.sensor_type_id,
+            SensorReading.value, SensorReading.timestamp
+        ).where(SensorReading.timestamp >= start_time,
+                *reading_dictionary.reading_filters(device_id, sensor_type))
         
-        # Write headers
-        writer.writerow([
-            'ID', 'Device ID', 'Sensor Type', 'Value', 'Unit',
-            'UTC Time', 'Iran Time', 'Persian Date'
-        ])
+        # yield_per streams through a server-side cursor where the driver supports it
+        query = query.order_by(SensorReading.timestamp.asc())\
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
         
-        # Write data
-        for reading in readings:
-            iran_time = utc_to_iran_time(reading.timestamp)
+        def generate_csv():
+            output = io.StringIO()
+            writer = csv.writer(output)
+            
+            # Write headers
             writer.writerow([
-                reading.id,
-                reading.device_id,
-                reading.sensor_type,
-                reading.value,
-                reading.unit,
-                reading.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-                iran_time.strftime('%Y-%m-%d %H:%M:%S IRST'),
-                iran_time.strftime('%Y/%m/%d %H:%M:%S')
+                'ID', 'Device ID', 'Sensor Type', 'Value', 'Unit',
+                'UTC Time', 'Iran Time', 'Persian Date'
             ])
+            yield output.getvalue()
+            
+            exported = 0
+            try:
+                for batch in db.session.execute(query).partitions():
+                    batch = [reading_dictionary.decode(row) for row in batch]
+                    output.seek(0)
+                    output.truncate()
+                    
+                    _, iran, persian = format_iran_columns([reading.timestamp for reading in batch])
+                    rows = [(
+                        reading.id,
+                        reading.device_id,
+                        reading.sensor_type,
+                        reading.value,
+                        reading.unit,
+                        reading.timestamp.isoformat(' ', 'seconds'),
+                        iran[i],
+                        persian[i]
+                    ) for i, reading in enumerate(batch)]
+                    writer.writerows(rows)
+                    exported += len(rows)
+                    yield output.getvalue()
+            except Exception as e:
+                # Headers are already sent - all we can do is log and end the stream
+                app.logger.error(f"CSV export aborted after {exported} rows: {e}")
+                db.session.rollback()
+                return
+            
+            app.logger.info(f"Exported {exported} readings to CSV")
+        
+        def generate_gzip(chunks):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+            for chunk in chunks:
+                data = compressor.compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+                if data:
+                    yield data
+            yield compressor.flush()
         
-        # Set response
-        output.seek(0)
+        if export_format == 'csv':
+            body = generate_csv()
+        elif export_format == 'ndjson':
+            body = generate_ndjson_export(query)
+        else:
+            # Arrow IPC and Parquet carry their own compression
+            body = generate_columnar_export(query, export_format)
+            use_gzip = False
         
         # Filename with Iran date
+        content_type, extension = EXPORT_FORMATS[export_format]
         iran_now = get_iran_time()
-        filename = f"sensor_data_{iran_now.strftime('%Y%m%d_%H%M%S')}.csv"
+        filename = f"sensor_data_{iran_now.strftime('%Y%m%d_%H%M%S')}.{extension}"
+        
+        headers = {
+            'Content-Disposition': f'attachment; filename={filename}',
+            'Content-Type': content_type
+        }
+        if use_gzip:
+            body = generate_gzip(body)
+            headers['Content-Encoding'] = 'gzip'
+            headers['Vary'] = 'Accept-Encoding'
         
         return Response(
-            output.getvalue(),
-            mimetype='text/csv',
-            headers={
-                'Content-Disposition': f'attachment; filename={filename}',
-                'Content-Type': 'text/csv; charset=utf-8'
-            }
+            stream_with_context(body),
+            mimetype=content_type.split(';')[0],
+            headers=headers
         )
         
     except Exception as e:
-        app.logger.error(f"Error in CSV export: {e}")
+        app.logger.error(f"Error in export: {e}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 @app.route('/api/devices', methods=['GET'])
 @limiter.limit("200 per minute")  # افزایش یافته
+@cached_response
+@read_replica
 def get_devices():
     """List active devices"""
     try:
-        # Devices active in last 24 hours
+        # Devices active in last 24 hours; reading figures come from the ingest counters
+        # and the latest-value cache, so no reading rows are scanned
         last_24h = datetime.datetime.utcnow() - datetime.timedelta(hours=24)
-        devices = Device.query.filter(Device.last_seen >= last_24h).all()
+        rows = db.session.query(Device.id, Device.last_seen, Device.is_active)\
+            .filter(Device.last_seen >= last_24h).all()
+        device_ids = [row.id for row in rows]
+        
+        today = get_iran_time().strftime('%Y-%m-%d')
+        counters = {(counter.device_id, counter.period): counter for counter in IngestCounter.query.filter(
+            IngestCounter.device_id.in_(device_ids), IngestCounter.period.in_(['total', today]))} if device_ids else {}
+        latest_counts = {}
+        for entry in latest_cache.get_latest():
+            latest_counts[entry['device_id']] = latest_counts.get(entry['device_id'], 0) + 1
+        
+        registry = device_registry.get_many(device_ids)
+        online_after = presence_tracker.online_after()
         
         results = []
-        for device in devices:
-            # Latest readings for each device
-            latest_readings = SensorReading.query.filter_by(device_id=device.id)\
-                            .order_by(SensorReading.timestamp.desc()).limit(5).all()
+        for row in rows:
+            info = registry.get(row.id, {})
+            total = counters.get((row.id, 'total'))
+            today_counter = counters.get((row.id, today))
             
-            # Determine online/offline status
-            is_online = is_device_online(device.last_seen)
+            # Determine online/offline status (this worker may hold a newer last_seen than the row)
+            last_seen = presence_tracker.last_seen(row.id, row.last_seen)
+            is_online = last_seen > online_after
             
             results.append({
-                'id': device.id,
-                'name': device.name or f'Device-{device.id[-8:]}',
-                'location': device.location,
-                'first_seen': device.first_seen.isoformat(),
-                'last_seen': device.last_seen.isoformat(),
-                'last_seen_iran': format_iran_time(device.last_seen),
-                'is_active': device.is_active,
+                'id': row.id,
+                'name': info.get('name') or f'Device-{row.id[-8:]}',
+                'location': info.get('location'),
+                'first_seen': info['first_seen'].isoformat() if info.get('first_seen') else None,
+                'last_seen': last_seen.isoformat(),
+                'last_seen_iran': format_iran_time(last_seen),
+                'is_active': row.is_active,
                 'is_online': is_online,
                 'status': 'Online' if is_online else 'Offline',
-                'latest_readings_count': len(latest_readings)
+                'latest_readings_count': latest_counts.get(row.id, 0),
+                'readings_today': today_counter.reading_count if today_counter else 0,
+                'latest_reading_at': total.last_at.isoformat() if total else None
             })
         
         return jsonify({
@@ -576,8 +4531,43 @@ def get_devices():
         app.logger.error(f"Error in get_devices: {e}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
+@app.route('/api/devices/presence', methods=['GET'])
+@limiter.limit("200 per minute")
+def get_device_presence():
+    """Online/offline state of every device and recent transitions (from memory)"""
+    try:
+        presence_tracker.expire()
+        online_after = presence_tracker.online_after()
+        devices = presence_tracker.devices()
+        limit = min(int(request.args.get('transitions', 50)), PRESENCE_HISTORY)
+        transitions = list(presence_tracker.transitions)[-limit:] if limit > 0 else []
+        
+        return jsonify({
+            'devices': [{
+                'id': device_id,
+                'is_online': last_seen > online_after,
+                'last_seen': last_seen.isoformat()
+            } for device_id, last_seen in devices],
+            'online_devices': sum(1 for _, last_seen in devices if last_seen > online_after),
+            'offline_after_seconds': DEVICE_OFFLINE_AFTER,
+            'transitions': [{
+                'device_id': t['device_id'],
+                'status': t['status'],
+                'at': t['at'].isoformat(),
+                'at_iran': format_iran_time(t['at'])
+            } for t in reversed(transitions)],
+            'tracker': presence_tracker.stats()
+        }), 200
+        
+    except ValueError:
+        return jsonify({'error': 'transitions must be an integer'}), 400
+    except Exception as e:
+        app.logger.error(f"Error in get_device_presence: {e}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
 @app.route('/api/devices/<device_id>/status', methods=['GET'])
 @limiter.limit("200 per minute")  # افزایش یافته
+@read_replica
 def get_device_status(device_id: str):
     """Get detailed device status"""
     try:
@@ -591,42 +4581,117 @@ def get_device_status(device_id: str):
         app.logger.error(f"Error in get_device_status: {e}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
+@app.route('/api/alerts', methods=['GET'])
+@limiter.limit("200 per minute")
+@read_replica
+def get_alerts():
+    """Alerts raised by the rules engine, newest first"""
+    try:
+        device_id = request.args.get('device_id')
+        sensor_type = request.args.get('sensor_type')
+        status = request.args.get('status', 'all')
+        hours = int(request.args.get('hours', 24))
+        limit = min(int(request.args.get('limit', 100)), 1000)
+        
+        if status not in ('active', 'resolved', 'all'):
+            return jsonify({'error': 'status must be one of: active, resolved, all'}), 400
+        
+        query = Alert.query
+        if device_id:
+            query = query.filter(Alert.device_id == device_id)
+        if sensor_type:
+            query = query.filter(Alert.sensor_type == sensor_type)
+        if status == 'active':
+            # Open alerts are listed whatever their age
+            query = query.filter(Alert.resolved_at.is_(None))
+        else:
+            query = query.filter(Alert.triggered_at >= datetime.datetime.utcnow() - datetime.timedelta(hours=hours))
+            if status == 'resolved':
+                query = query.filter(Alert.resolved_at.isnot(None))
+        
+        alerts = query.order_by(Alert.triggered_at.desc(), Alert.id.desc()).limit(limit).all()
+        return jsonify({
+            'alerts': [alert_to_dict(alert) for alert in alerts],
+            'count': len(alerts),
+            'active_count': sum(1 for alert in alerts if alert.resolved_at is None),
+            'parameters': {
+                'device_id': device_id,
+                'sensor_type': sensor_type,
+                'status': status,
+                'hours': hours,
+                'limit': limit
+            }
+        }), 200
+        
+    except ValueError:
+        return jsonify({'error': 'hours and limit must be integers'}), 400
+    except Exception as e:
+        app.logger.error(f"Error in get_alerts: {e}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+@app.route('/api/alerts/rules', methods=['GET'])
+def get_alert_rules():
+    """Alert rules in effect and this worker's engine counters"""
+    return jsonify({
+        'rules': alert_engine.rules,
+        'anomaly': {
+            'ewma_alpha': ALERT_EWMA_ALPHA,
+            'zscore': ALERT_ZSCORE,
+            'warmup_readings': ALERT_WARMUP
+        },
+        'rate_min_interval_seconds': ALERT_RATE_MIN_INTERVAL,
+        'cooldown_seconds': ALERT_COOLDOWN,
+        'engine': alert_engine.stats()
+    }), 200
+
 @app.route('/api/stats', methods=['GET'])
 @limiter.limit("200 per minute")  # افزایش یافته
+@cached_response
+@read_replica
 def get_statistics():
     """System statistics - Enhanced"""
     try:
         # Total devices
         total_devices = Device.query.count()
         
-        # Online devices (last 5 minutes)
-        last_5min = datetime.datetime.utcnow() - datetime.timedelta(minutes=5)
-        online_devices = Device.query.filter(Device.last_seen >= last_5min).count()
+        # Online devices (from the presence tracker)
+        online_devices = presence_tracker.online_count()
         
-        # Total readings
-        total_readings = SensorReading.query.count()
-        
-        # Today's readings (Iran time)
+        # Reading counts from the maintained counters (no COUNT(*) scans)
         iran_now = get_iran_time()
-        today_start_iran = iran_now.replace(hour=0, minute=0, second=0, microsecond=0)
-        today_start_utc = today_start_iran.astimezone(pytz.utc).replace(tzinfo=None)
+        today = iran_now.strftime('%Y-%m-%d')
+        
+        counters = IngestCounter.query.filter(IngestCounter.period.in_(['total', today])).all()
+        total_readings = sum(c.reading_count for c in counters if c.period == 'total')
+        today_readings = sum(c.reading_count for c in counters if c.period == today)
         
-        today_readings = SensorReading.query.filter(
-            SensorReading.timestamp >= today_start_utc).count()
+        # Per-device ingest rate since its first reading today, over at least a minute
+        # so a device that has only just started does not report a burst as its rate
+        now = datetime.datetime.utcnow()
+        ingest_rates = {}
+        for counter in counters:
+            if counter.period != today:
+                continue
+            active_minutes = max((now - counter.first_at).total_seconds() / 60, 1.0)
+            ingest_rates[counter.device_id] = {
+                'today_readings': counter.reading_count,
+                'readings_per_minute': round(counter.reading_count / active_minutes, 2),
+                'last_reading': counter.last_at.isoformat()
+            }
         
-        # Latest activity
-        latest_reading = SensorReading.query.order_by(
-            SensorReading.timestamp.desc()).first()
+        # Latest activity (from the latest-value cache)
+        latest_readings = latest_cache.get_latest()
+        latest_reading = max(latest_readings, key=lambda r: r['timestamp']) if latest_readings else None
         
         latest_activity = None
         if latest_reading:
             latest_activity = {
-                'device_id': latest_reading.device_id,
-                'sensor_type': latest_reading.sensor_type,
-                'value': latest_reading.value,
-                'unit': latest_reading.unit,
-                'timestamp': latest_reading.timestamp.isoformat(),
-                'timestamp_iran': format_iran_time(latest_reading.timestamp)
+                'device_id': latest_reading['device_id'],
+                'sensor_type': latest_reading['sensor_type'],
+                'value': latest_reading['value'],
+                'unit': latest_reading['unit'],
+                'timestamp': latest_reading['timestamp'].isoformat(),
+                'timestamp_iran': format_iran_time(latest_reading['timestamp'])
             }
         
         # Calculate uptime percentage
@@ -638,6 +4703,7 @@ def get_statistics():
             'offline_devices': total_devices - online_devices,
             'total_readings': total_readings,
             'today_readings': today_readings,
+            'ingest_rates': ingest_rates,
             'latest_activity': latest_activity,
             'uptime_percentage': round(uptime_percentage, 1),
             'system_health': 'healthy' if online_devices > 0 else 'warning',
@@ -651,37 +4717,14 @@ def get_statistics():
 
 @app.route('/api/sensors/latest', methods=['GET'])
 @limiter.limit("200 per minute")  # افزایش یافته
+@cached_response
 def get_latest_sensor_data():
     """Get latest sensor data for all sensors"""
     try:
         device_id = request.args.get('device_id')
         limit = min(int(request.args.get('limit', 20)), 100)
         
-        query = db.session.query(SensorReading)
-        
-        if device_id:
-            query = query.filter(SensorReading.device_id == device_id)
-        
-        # Latest reading for each sensor type
-        latest_readings = query.order_by(SensorReading.timestamp.desc()).limit(limit).all()
-        
-        results = []
-        for reading in latest_readings:
-            results.append({
-                'device_id': reading.device_id,
-                'sensor_type': reading.sensor_type,
-                'value': reading.value,
-                'unit': reading.unit,
-                'timestamp': reading.timestamp.isoformat(),
-                'timestamp_iran': format_iran_time(reading.timestamp),
-                'is_online': is_device_online(reading.timestamp)
-            })
-        
-        return jsonify({
-            'sensors': results,
-            'count': len(results),
-            'timestamp': datetime.datetime.utcnow().isoformat()
-        }), 200
+        return jsonify(latest_sensors_payload(device_id, limit)), 200
         
     except Exception as e:
         app.logger.error(f"Error in get_latest_sensor_data: {e}")
@@ -698,12 +4741,17 @@ def not_found(error):
 
 @app.errorhandler(429)
 def ratelimit_handler(e):
-    return jsonify({
+    metrics.observe_rate_limited(endpoint_label())
+    return jsonify(rate_limit_payload(e.retry_after if hasattr(e, 'retry_after') else 60)), 429
+
+def rate_limit_payload(retry_after) -> Dict[str, Any]:
+    """429 body, shared with the native ASGI routes"""
+    return {
         'error': 'Rate limit exceeded', 
         'message': 'Too many requests. Please slow down.',
         'new_limits': '50/min, 1000/hour, 5000/day',
-        'retry_after': str(e.retry_after) if hasattr(e, 'retry_after') else '60'
-    }), 429
+        'retry_after': str(retry_after)
+    }
 
 @app.errorhandler(500)
 def internal_error(error):
@@ -0,0 +1,444 @@
+# asgi.py - Async (ASGI) entry point for high-concurrency device connections
+#
+# Serves the ingest endpoints, the polled dashboard reads and the live stream natively on asyncio,
+# with an async driver (asyncpg / aiosqlite) and a bounded connection pool. Every
+# other route is delegated to the Flask app, so both entry points share the same
+# validation, models, caches and live stream.
+#
+#   pip install -r requirements-asgi.txt
+#   uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 4
+import asyncio
+import contextlib
+import datetime
+import os
+import queue
+import re
+import time
+
+from a2wsgi import WSGIMiddleware
+from limits import parse as parse_limit
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import http_date, parse_etags
+
+from app import (
+    app as flask_app, CORS_ORIGINS, INGEST_MODE, INGEST_FLUSH_INTERVAL, MAX_BATCH_FRAMES,
+    PayloadError, decode_json_body, FRAME_DECODERS, frame_decoder_for, build_frame_rows, validate_sensor_frames,
+    store_readings, on_readings_committed, reading_dictionary, ingest_buffer,
+    sequence_window, duplicate_frame_payload, ingest_spool, spooled_frame_payload,
+    dashboard_data_query, dashboard_data_payload, latest_sensors_payload,
+    response_cache, CachedResponse, start_background_workers, get_iran_time,
+    STORAGE_SETTINGS, DATABASE_READ_URL, configure_storage_engine, metrics,
+    event_broker, sse_message, STREAM_KEEPALIVE, limiter, rate_limit_payload
+)
+
+# Async pool sizing (defaults from the storage profile): requests beyond
+# pool_size + max_overflow wait for a connection
+ASYNC_POOL_SIZE = int(os.getenv('ASYNC_POOL_SIZE', STORAGE_SETTINGS['pool_size']))
+ASYNC_MAX_OVERFLOW = int(os.getenv('ASYNC_MAX_OVERFLOW', STORAGE_SETTINGS['max_overflow']))
+ASYNC_POOL_TIMEOUT = float(os.getenv('ASYNC_POOL_TIMEOUT', STORAGE_SETTINGS['pool_timeout']))  # seconds
+WSGI_THREADS = int(os.getenv('WSGI_THREADS', 10))  # threads for the delegated Flask routes
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+def async_database_url(sync_url: str, override_env: str):
+    """URL from `override_env`, or the sync database URL switched to its async driver"""
+    override = os.getenv(override_env)
+    if override:
+        return make_url(override), {}
+
+    url = make_url(sync_url)
+    connect_args = {}
+    # asyncpg takes `ssl` instead of libpq's sslmode
+    sslmode = url.query.get('sslmode')
+    if sslmode:
+        url = url.difference_update_query(['sslmode'])
+        if sslmode != 'disable':
+            connect_args['ssl'] = sslmode
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()]), connect_args
+
+def create_pooled_engine(name: str, url, connect_args):
+    async_engine = create_async_engine(
+        url,
+        connect_args=connect_args,
+        pool_size=ASYNC_POOL_SIZE,
+        max_overflow=ASYNC_MAX_OVERFLOW,
+        pool_timeout=ASYNC_POOL_TIMEOUT,
+        pool_pre_ping=url.get_backend_name() != 'sqlite',
+        pool_recycle=STORAGE_SETTINGS['pool_recycle']
+    )
+    # Same SQLite pragmas and pool metrics as the Flask engines
+    configure_storage_engine(name, async_engine.sync_engine)
+    return async_engine
+
+database_url, connect_args = async_database_url(
+    flask_app.config['SQLALCHEMY_DATABASE_URI'], 'ASYNC_DATABASE_URL')
+engine = create_pooled_engine('async', database_url, connect_args)
+async_session = async_sessionmaker(engine, expire_on_commit=False)
+
+# Dashboard reads go to the replica when DATABASE_READ_URL is set
+read_engine = engine
+if DATABASE_READ_URL:
+    read_engine = create_pooled_engine(
+        'async_replica', *async_database_url(DATABASE_READ_URL, 'ASYNC_DATABASE_READ_URL'))
+async_read_session = async_sessionmaker(read_engine, expire_on_commit=False)
+
+# SQLite allows one writer at a time; queueing writers here beats spinning on its busy timeout
+sqlite_write_lock = asyncio.Lock() if database_url.get_backend_name() == 'sqlite' else None
+
+# --- Helpers ---
+def json_response(payload, status: int = 200) -> Response:
+    """Encode with the Flask app's JSON provider so both entry points emit the same bytes"""
+    started = time.perf_counter()
+    body = flask_app.json.dumps(payload)
+    metrics.observe_serialization(time.perf_counter() - started)
+    return Response(body, status_code=status, media_type='application/json')
+
+def instrumented(endpoint):
+    """Request metrics for the native routes (Flask's hooks cover the delegated ones)"""
+    async def wrapper(request):
+        # Native routes have no path parameters, so the path is the route label
+        label = request.url.path
+        state = metrics.start_request(label)
+        status = 500
+        try:
+            response = await endpoint(request)
+            status = response.status_code
+            return response
+        finally:
+            metrics.finish_request(state, label, request.method, status)
+
+    return wrapper
+
+def rate_limited(limit: str):
+    """The Flask route's Flask-Limiter limit, applied to its native twin with the same
+    storage and strategy (counted per client address, like get_remote_address)"""
+    item = parse_limit(limit)
+
+    def decorator(endpoint):
+        async def wrapper(request):
+            if limiter.enabled:
+                identifiers = ('asgi', request.url.path, request.client.host if request.client else '127.0.0.1')
+                if not limiter.limiter.hit(item, *identifiers):
+                    reset_at, _ = limiter.limiter.get_window_stats(item, *identifiers)
+                    retry_after = max(int(reset_at - time.time()), 1)
+                    metrics.observe_rate_limited(request.url.path)
+                    response = json_response(rate_limit_payload(retry_after), 429)
+                    response.headers['Retry-After'] = str(retry_after)
+                    return response
+            return await endpoint(request)
+
+        return wrapper
+
+    return decorator
+
+def cached(endpoint):
+    """Async twin of app.cached_response, sharing the same response cache"""
+    async def wrapper(request):
+        if not response_cache.enabled:
+            return await endpoint(request)
+
+        key = (request.url.path, tuple(sorted(request.query_params.multi_items())))
+        entry = response_cache.get(key)
+
+        if entry is None:
+            generation = response_cache.generation
+            response = await endpoint(request)
+            if response.status_code != 200:
+                return response
+            entry = CachedResponse(response.body, response.media_type, generation)
+            response_cache.put(key, entry)
+
+        headers = {
+            'ETag': f'W/"{entry.etag}"',
+            'Last-Modified': http_date(entry.last_modified),
+            'Cache-Control': 'no-cache'
+        }
+        if parse_etags(request.headers.get('if-none-match')).contains_weak(entry.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(entry.body, media_type=entry.mimetype, headers=headers)
+
+    return wrapper
+
+def call_in_app_context(func, *args):
+    """Run sync app code (dictionary refreshes, session queries, cache files) in a worker thread"""
+    with flask_app.app_context():
+        return func(*args)
+
+async def save_rows(rows):
+    """Insert rows (plus seq claims, new-device registration and counter upserts) in one async transaction.
+
+    Returns the rows actually stored (duplicate frames are left out).
+    """
+    encoded_rows = reading_dictionary.encode_known(rows)
+    if encoded_rows is None:
+        # New device or sensor type: the dictionary insert uses the sync engine, so keep it off the loop
+        encoded_rows = await asyncio.to_thread(call_in_app_context, reading_dictionary.encode_rows, rows)
+
+    async with contextlib.AsyncExitStack() as stack:
+        if sqlite_write_lock is not None:
+            await stack.enter_async_context(sqlite_write_lock)
+        session = await stack.enter_async_context(async_session())
+        with metrics.time_ingest_commit('async'):
+            stored_rows = await session.run_sync(
+                lambda sync_session: store_readings(rows, sync_session, encoded_rows))
+            await session.commit()
+
+    # Post-commit hooks write the shared latest-value cache file
+    await asyncio.to_thread(on_readings_committed, stored_rows)
+    return stored_rows
+
+def request_mimetype(request) -> str:
+    return request.headers.get('content-type', '').split(';', 1)[0].strip().lower()
+
+def iran_now_label() -> str:
+    return get_iran_time().strftime('%Y-%m-%d %H:%M:%S IRST')
+
+# --- API Endpoints ---
+@instrumented
+@rate_limited('100 per minute')
+async def receive_sensor_data(request):
+    """Receive sensor data from ESP32"""
+    try:
+        decode_frame = frame_decoder_for(request_mimetype(request))
+        if decode_frame is None:
+            return json_response({'error': f'Content-Type must be one of: {", ".join(FRAME_DECODERS)}'}, 400)
+
+        try:
+            frame = decode_frame(await request.body())
+            rows, rejected = build_frame_rows(frame, datetime.datetime.utcnow())
+        except PayloadError as e:
+            flask_app.logger.warning(f"Invalid data: {e.message} ({e.field})")
+            return json_response(e.to_dict(), 400)
+
+        if not rows:
+            return json_response({'error': 'No reading passed validation', 'rejected_readings': rejected}, 400)
+
+        if frame.seq is not None and sequence_window.seen(frame.device_id, frame.seq):
+            return json_response(duplicate_frame_payload(frame), 200)
+
+        if INGEST_MODE == 'buffered':
+            if not ingest_buffer.submit(rows):
+                response = json_response({'error': 'Ingest queue is full, retry later'}, 503)
+                response.headers['Retry-After'] = str(max(int(INGEST_FLUSH_INTERVAL), 1))
+                return response
+            return json_response({
+                'message': 'Data queued successfully',
+                'readings_queued': len(rows),
+                'rejected_readings': rejected,
+                'device_id': frame.device_id,
+                'timestamp_utc': datetime.datetime.utcnow().isoformat(),
+                'timestamp_iran': iran_now_label()
+            }, 202)
+
+        # Spool writes fsync, so they run off the event loop
+        if ingest_spool.bypass_database() and await asyncio.to_thread(ingest_spool.append, rows):
+            return json_response(spooled_frame_payload(frame, rows, rejected), 202)
+
+        try:
+            stored_rows = await save_rows(rows)
+        except Exception as e:
+            flask_app.logger.error(f"Database commit failed: {e}")
+            if await asyncio.to_thread(ingest_spool.spool_failed, rows, e):
+                return json_response(spooled_frame_payload(frame, rows, rejected), 202)
+            return json_response({'error': 'Failed to save data to database'}, 500)
+
+        if not stored_rows:
+            return json_response(duplicate_frame_payload(frame), 200)
+
+        return json_response({
+            'message': 'Data received successfully',
+            'readings_saved': len(stored_rows),
+            'failed_readings': len(rejected),
+            'rejected_readings': rejected,
+            'device_id': frame.device_id,
+            'timestamp_utc': datetime.datetime.utcnow().isoformat(),
+            'timestamp_iran': iran_now_label()
+        }, 201)
+
+    except Exception as e:
+        flask_app.logger.error(f"Unexpected error: {str(e)}")
+        return json_response({'error': f'Internal server error: {str(e)}'}, 500)
+
+@instrumented
+@rate_limited('100 per minute')
+async def receive_sensor_batch(request):
+    """Receive many frames from one or more devices in a single request"""
+    try:
+        if 'application/json' not in request.headers.get('content-type', ''):
+            return json_response({'error': 'Content-Type must be application/json'}, 400)
+
+        try:
+            data = decode_json_body(await request.body())
+        except PayloadError as e:
+            return json_response(e.to_dict(), 400)
+        frames = data.get('frames') if isinstance(data, dict) else data
+
+        if not isinstance(frames, list) or len(frames) == 0:
+            return json_response({'error': 'Body must be a non-empty array of frames (or {"frames": [...]})'}, 400)
+
+        if len(frames) > MAX_BATCH_FRAMES:
+            return json_response({'error': f'Too many frames in batch (max {MAX_BATCH_FRAMES})'}, 413)
+
+        rows, frame_results = validate_sensor_frames(frames)
+
+        new_rows = sequence_window.unseen(rows)
+        stored_rows = []
+        spooled_rows = []
+        if new_rows and ingest_spool.bypass_database() and await asyncio.to_thread(ingest_spool.append, new_rows):
+            spooled_rows = new_rows
+        elif new_rows:
+            try:
+                stored_rows = await save_rows(new_rows)
+            except Exception as e:
+                flask_app.logger.error(f"Batch commit failed: {e}")
+                if not await asyncio.to_thread(ingest_spool.spool_failed, new_rows, e):
+                    return json_response({'error': 'Failed to save data to database'}, 500)
+                spooled_rows = new_rows
+
+        frames_accepted = sum(1 for r in frame_results if r['accepted'])
+        return json_response({
+            'message': 'Batch processed',
+            'frames_received': len(frames),
+            'frames_accepted': frames_accepted,
+            'frames_rejected': len(frame_results) - frames_accepted,
+            'readings_saved': len(stored_rows),
+            'readings_spooled': len(spooled_rows),
+            'duplicate_readings': len(rows) - len(stored_rows) - len(spooled_rows),
+            'devices': len({row['device_id'] for row in stored_rows or spooled_rows}),
+            'rejected': [r for r in frame_results if not r['accepted']],
+            'timestamp_utc': datetime.datetime.utcnow().isoformat(),
+            'timestamp_iran': iran_now_label()
+        }, (202 if spooled_rows else 201) if rows else 400)
+
+    except Exception as e:
+        flask_app.logger.error(f"Unexpected error in batch ingest: {str(e)}")
+        return json_response({'error': f'Internal server error: {str(e)}'}, 500)
+
+@instrumented
+@rate_limited('200 per minute')
+@cached
+async def get_dashboard_data(request):
+    """Get dashboard data"""
+    try:
+        args = request.query_params
+        limit = min(int(args.get('limit', 100)), 1000)
+        device_id = args.get('device_id')
+        sensor_type = args.get('sensor_type')
+        hours = int(args.get('hours', 24))
+        cursor = args.get('cursor')
+        since = args.get('since')
+
+        # Building the query and decoding rows may reload the reading dictionary
+        try:
+            query = await asyncio.to_thread(
+                call_in_app_context, dashboard_data_query, limit, device_id, sensor_type, hours, cursor, since)
+        except ValueError as e:
+            return json_response({'error': str(e)}, 400)
+
+        async with async_read_session() as session:
+            rows = (await session.execute(query)).all()
+
+        return json_response(await asyncio.to_thread(call_in_app_context, dashboard_data_payload, rows, {
+            'limit': limit,
+            'device_id': device_id,
+            'sensor_type': sensor_type,
+            'hours': hours,
+            'cursor': cursor,
+            'since': since
+        }))
+
+    except Exception as e:
+        flask_app.logger.error(f"Error in dashboard data: {e}")
+        return json_response({'error': f'Internal server error: {str(e)}'}, 500)
+
+@instrumented
+@rate_limited('200 per minute')
+@cached
+async def get_latest_sensor_data(request):
+    """Get latest sensor data for all sensors"""
+    try:
+        limit = min(int(request.query_params.get('limit', 20)), 100)
+        return json_response(await asyncio.to_thread(
+            call_in_app_context, latest_sensors_payload, request.query_params.get('device_id'), limit))
+    except Exception as e:
+        flask_app.logger.error(f"Error in get_latest_sensor_data: {e}")
+        return json_response({'error': f'Internal server error: {str(e)}'}, 500)
+
+async def stream_readings(request):
+    """Server-Sent Events stream of new readings and presence transitions (same as Flask's
+    /api/stream), served on the event loop so an open tab holds no thread"""
+    device_id = request.query_params.get('device_id')
+    sensor_type = request.query_params.get('sensor_type')
+    sensor_types = set(sensor_type.split(',')) if sensor_type else None
+
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    subscription = event_broker.subscribe(device_id, sensor_types)
+    # Events are queued by ingest and broker threads; wake the coroutine from there
+    subscription.wakeup = lambda: loop.call_soon_threadsafe(ready.set)
+    flask_app.logger.info(f"Stream opened from {request.client.host if request.client else None} "
+                          f"({event_broker.subscriber_count} subscribers)")
+
+    async def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    kind, payload = subscription.queue.get_nowait()
+                except queue.Empty:
+                    ready.clear()
+                    if not subscription.queue.empty():
+                        continue
+                    try:
+                        await asyncio.wait_for(ready.wait(), STREAM_KEEPALIVE)
+                    except asyncio.TimeoutError:
+                        yield ': keepalive\n\n'
+                    continue
+                yield sse_message(kind, payload)
+        finally:
+            event_broker.unsubscribe(subscription)
+            flask_app.logger.info(f"Stream closed ({subscription.dropped} events dropped)")
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# --- Application ---
+# Same origins as Flask-CORS; this middleware also answers for the delegated Flask routes
+cors_middleware = Middleware(
+    CORSMiddleware,
+    allow_origins=[origin for origin in CORS_ORIGINS if '*' not in origin],
+    allow_origin_regex='|'.join(
+        re.escape(origin).replace(r'\*', r'[^.]+') for origin in CORS_ORIGINS if '*' in origin),
+    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_headers=["Content-Type", "Authorization"]
+)
+
+@contextlib.asynccontextmanager
+async def lifespan(_):
+    start_background_workers()
+    yield
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
+
+app = Starlette(
+    routes=[
+        Route('/api/sensors', receive_sensor_data, methods=['POST']),
+        Route('/api/sensors/batch', receive_sensor_batch, methods=['POST']),
+        Route('/api/dashboard/data', get_dashboard_data, methods=['GET']),
+        Route('/api/sensors/latest', get_latest_sensor_data, methods=['GET']),
+        Route('/api/stream', stream_readings, methods=['GET']),
+        # Everything else (exports, stats, devices, ...) is served by Flask
+        Mount('/', WSGIMiddleware(flask_app, workers=WSGI_THREADS)),
+    ],
+    middleware=[cors_middleware],
+    lifespan=lifespan
+)
@@ -0,0 +1,59 @@
+# gunicorn.conf.py - picked up automatically when gunicorn is started from backend/
+#
+#   gunicorn app:app
+#
+# Workers write their Prometheus samples to PROMETHEUS_MULTIPROC_DIR, so whichever
+# worker answers a /metrics scrape reports the totals of all of them. Likewise the
+# latest-value cache defaults to a shared SQLite file, so /api/sensors/latest and
+# device status agree whichever worker answers, and live events (SSE, response cache
+# invalidation) fan out through a shared socket directory.
+import os
+import shutil
+import tempfile
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', 4))
+# Each open /api/stream tab holds a thread for as long as it stays connected, so
+# workers are threaded: with sync workers a few tabs would block ingest entirely.
+# gthread workers heartbeat from their main loop, so long-lived streams are not
+# killed by the timeout; the SSE keepalive (STREAM_KEEPALIVE) stays well below it.
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 16))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+os.environ.setdefault('STREAM_KEEPALIVE', str(min(15, timeout // 2)))
+
+# Must be in the environment before the workers import prometheus_client
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'enviromon-metrics'))
+if workers > 1:
+    os.environ.setdefault('LATEST_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'enviromon-latest.db'))
+    os.environ.setdefault('STREAM_SOCKET_DIR', os.path.join(tempfile.gettempdir(), 'enviromon-stream'))
+
+def on_starting(server):
+    """Start every run with an empty metrics directory and latest-value cache"""
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+    stream_dir = os.environ.get('STREAM_SOCKET_DIR')
+    if stream_dir:
+        shutil.rmtree(stream_dir, ignore_errors=True)
+    # Each worker warms the cache from the database when it imports the app
+    latest_cache_path = os.environ.get('LATEST_CACHE_PATH')
+    if latest_cache_path:
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(latest_cache_path + suffix)
+            except FileNotFoundError:
+                pass
+
+def post_worker_init(worker):
+    """Start background threads and bind the event socket before the first request"""
+    from app import start_background_workers
+    start_background_workers()
+
+def child_exit(server, worker):
+    """Drop the live-gauge files of a worker that exited"""
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app.py configures itself at import time: give it a scratch SQLite database
+# (created in the working directory) and keep background threads out of the way
+WORK_DIR = tempfile.mkdtemp(prefix='enviromon-tests-')
+os.chdir(WORK_DIR)
+os.environ.setdefault('FLASK_ENV', 'development')
+os.environ.setdefault('RATELIMIT_ENABLED', 'false')
+os.environ.setdefault('ROLLUP_ENABLED', 'false')
+os.environ.setdefault('INGEST_SEQ_RETENTION_DAYS', '0')
+os.environ.setdefault('ALERT_RETENTION_DAYS', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as enviromon  # noqa: E402
+
+
+@pytest.fixture
+def app_module():
+    """The backend module with empty reading, rollup, alert, watermark and checkpoint tables"""
+    with enviromon.app.app_context():
+        for model in (enviromon.SensorReading, enviromon.IngestSequence, enviromon.IngestCounter,
+                      enviromon.Alert, enviromon.RollupWatermark, enviromon.IngestCheckpoint,
+                      enviromon.SensorRollup):
+            enviromon.db.session.query(model).delete()
+        enviromon.db.session.commit()
+    enviromon.response_cache.bump_generation()
+    yield enviromon
@@ -0,0 +1,104 @@
+import datetime
+import os
+import socket
+import subprocess
+import sys
+
+from sqlalchemy import exc
+
+RULES = {'temperature': {'warning': [15, 30], 'critical': [5, 40]}}
+
+
+def make_engine(app_module):
+    return app_module.AlertEngine(True, RULES, 0.05, 4.0, 30, 300, 10)
+
+
+def evaluate(engine, *values, device_id='ALERT:1', start=0):
+    """Feed one temperature reading per minute and write the resulting transitions"""
+    engine.evaluate([{
+        'device_id': device_id, 'sensor_type': 'temperature', 'value': float(value), 'unit': 'C',
+        'timestamp': datetime.datetime(2026, 1, 1) + datetime.timedelta(minutes=start + i)
+    } for i, value in enumerate(values)])
+    return engine.flush()
+
+
+def alerts(app_module):
+    with app_module.app.app_context():
+        return [(alert.severity, alert.resolved_at is None)
+                for alert in app_module.Alert.query.order_by(app_module.Alert.id)]
+
+
+def open_foreign_alert(app_module, owner):
+    with app_module.app.app_context():
+        app_module.db.session.add(app_module.Alert(
+            device_id='ALERT:1', sensor_type='temperature', kind='threshold', severity='warning',
+            value=35.0, detail=30.0, message='temperature 35 C above warning limit 30',
+            triggered_at=datetime.datetime(2026, 1, 1), opened_by=owner))
+        app_module.db.session.commit()
+
+
+def test_alert_opens_escalates_and_resolves(app_module):
+    engine = make_engine(app_module)
+
+    evaluate(engine, 20, 21)
+    assert alerts(app_module) == []
+
+    evaluate(engine, 35, start=2)
+    assert alerts(app_module) == [('warning', True)]
+
+    evaluate(engine, 45, start=3)
+    assert alerts(app_module) == [('warning', False), ('critical', True)]
+
+    evaluate(engine, 20, start=4)
+    assert alerts(app_module) == [('warning', False), ('critical', False)]
+    assert engine.alerts_opened == 2
+
+
+def test_alert_opened_by_a_live_worker_is_left_to_it(app_module):
+    open_foreign_alert(app_module, f'{socket.gethostname()}:{os.getppid()}')
+    engine = make_engine(app_module)
+
+    evaluate(engine, 35, 20)
+    assert alerts(app_module) == [('warning', True)]
+
+
+def test_alert_of_an_exited_worker_is_taken_over(app_module):
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    open_foreign_alert(app_module, f'{socket.gethostname()}:{exited.pid}')
+    engine = make_engine(app_module)
+
+    evaluate(engine, 35)
+    with app_module.app.app_context():
+        assert app_module.Alert.query.one().opened_by == app_module.process_owner()
+
+    evaluate(engine, 20, start=1)
+    assert alerts(app_module) == [('warning', False)]
+
+
+def test_transitions_are_retried_after_a_connectivity_error(app_module, monkeypatch):
+    engine = make_engine(app_module)
+    write = engine._write
+
+    def unreachable(*args, **kwargs):
+        raise exc.OperationalError('SELECT', {}, Exception('connection refused'))
+
+    monkeypatch.setattr(engine, '_write', unreachable)
+    assert evaluate(engine, 35) == 0
+    assert engine.stats()['pending_writes'] == 1
+    assert engine.write_errors == 0
+
+    monkeypatch.setattr(engine, '_write', write)
+    assert evaluate(engine, 20, start=1) == 2
+    assert alerts(app_module) == [('warning', False)]
+    assert engine.stats()['pending_writes'] == 0
+
+
+def test_unruled_sensor_raises_no_anomaly_on_a_flat_signal(app_module):
+    engine = make_engine(app_module)
+    engine.evaluate([{
+        'device_id': 'ALERT:2', 'sensor_type': 'altitude', 'value': value, 'unit': 'm',
+        'timestamp': datetime.datetime(2026, 1, 1) + datetime.timedelta(minutes=i)
+    } for i, value in enumerate([1200.0] * 40 + [1200.1])])
+    engine.flush()
+    assert alerts(app_module) == []
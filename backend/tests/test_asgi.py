@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('starlette')
+pytest.importorskip('aiosqlite')
+pytest.importorskip('a2wsgi')
+from starlette.testclient import TestClient  # noqa: E402
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FRAME = {'device_id': 'ASGI:1', 'sensors': [{'type': 'temperature', 'value': 21.5, 'unit': 'C'}]}
+
+# Limits are configured at import, so this runs in a process with them enabled
+RATE_LIMIT_SCRIPT = '''
+from starlette.testclient import TestClient
+import asgi
+frame = %r
+with TestClient(asgi.app) as client:
+    codes = [client.post('/api/sensors', json=frame).status_code for _ in range(101)]
+    response = client.post('/api/sensors', json=frame)
+    print(codes.count(201), codes[-1], response.json()['retry_after'], response.headers['Retry-After'])
+''' % FRAME
+
+
+@pytest.fixture
+def asgi_client(app_module):
+    import asgi
+    with TestClient(asgi.app) as client:
+        yield client
+
+
+def test_native_routes_store_and_serve_readings(asgi_client):
+    assert asgi_client.post('/api/sensors', json=FRAME).status_code == 201
+    latest = asgi_client.get('/api/sensors/latest?device_id=ASGI:1')
+    assert latest.status_code == 200
+    assert [sensor['value'] for sensor in latest.json()['sensors']] == [21.5]
+    assert asgi_client.get('/api/dashboard/data?device_id=ASGI:1').json()['count'] == 1
+
+
+def test_native_ingest_route_applies_the_flask_rate_limit(tmp_path):
+    env = dict(os.environ, FLASK_ENV='development', RATELIMIT_ENABLED='true', ROLLUP_ENABLED='false',
+               INGEST_MODE='sync', PYTHONPATH=BACKEND_DIR)
+    result = subprocess.run([sys.executable, '-c', RATE_LIMIT_SCRIPT], cwd=tmp_path, env=env, check=True,
+                            capture_output=True, text=True, timeout=120)
+    accepted, last_code, body_retry_after, retry_after = result.stdout.split()[-4:]
+    assert (accepted, last_code) == ('100', '429')
+    assert body_retry_after == retry_after and int(retry_after) > 0
@@ -0,0 +1,44 @@
+def frame(device_id, *values, **extra):
+    return {'device_id': device_id,
+            'sensors': [{'type': 'temperature', 'value': value, 'unit': 'C'} for value in values], **extra}
+
+
+def stored_values(app_module):
+    with app_module.app.app_context():
+        return sorted(value for (value,) in app_module.db.session.query(app_module.SensorReading.value))
+
+
+def test_batch_stores_good_frames_and_reports_bad_ones(app_module):
+    response = app_module.app.test_client().post('/api/sensors/batch', json=[
+        frame('BATCH:1', 20.0, 21.0),
+        {'device_id': 'BATCH:2'},
+        frame('BATCH:3', 22.0),
+    ])
+    assert response.status_code == 201
+    body = response.json
+    assert (body['frames_received'], body['frames_accepted'], body['frames_rejected']) == (3, 2, 1)
+    assert body['readings_saved'] == 3 and body['devices'] == 2
+    rejected, = body['rejected']
+    assert rejected['index'] == 1 and rejected['field'] == '$.sensors'
+    assert stored_values(app_module) == [20.0, 21.0, 22.0]
+
+
+def test_frames_wrapper_is_accepted(app_module):
+    response = app_module.app.test_client().post('/api/sensors/batch', json={'frames': [frame('BATCH:4', 19.5)]})
+    assert response.status_code == 201
+    assert stored_values(app_module) == [19.5]
+
+
+def test_batch_without_any_valid_frame_is_a_client_error(app_module):
+    client = app_module.app.test_client()
+    assert client.post('/api/sensors/batch', json=[{'device_id': 'BATCH:5'}]).status_code == 400
+    assert client.post('/api/sensors/batch', json=[]).status_code == 400
+    assert client.post('/api/sensors/batch', data='[]', content_type='text/plain').status_code == 400
+    assert stored_values(app_module) == []
+
+
+def test_oversized_batch_is_refused(app_module):
+    frames = [frame('BATCH:6', 20.0)] * (app_module.MAX_BATCH_FRAMES + 1)
+    response = app_module.app.test_client().post('/api/sensors/batch', json=frames)
+    assert response.status_code == 413
+    assert stored_values(app_module) == []
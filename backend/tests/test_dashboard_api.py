@@ -0,0 +1,129 @@
+import datetime
+
+import pytest
+
+
+def store(app_module, count, device_id='DASH:1'):
+    now = datetime.datetime.utcnow()
+    with app_module.app.app_context():
+        app_module.store_readings([{
+            'device_id': device_id, 'sensor_type': 'temperature', 'value': float(i % 7), 'unit': 'C',
+            'timestamp': now - datetime.timedelta(minutes=count - i), 'seq': None
+        } for i in range(count)])
+        app_module.db.session.commit()
+
+
+@pytest.mark.parametrize('points', [0, 1, 2])
+def test_lttb_returns_at_least_first_middle_and_last_point(app_module, points):
+    store(app_module, 50)
+    response = app_module.app.test_client().get(
+        f'/api/dashboard/aggregate?method=lttb&hours=2&device_id=DASH:1&points={points}')
+    assert response.status_code == 200
+    assert response.json['parameters']['points'] == 3
+    assert response.json['count'] == 3
+
+
+def post_reading(client, device_id='DASH:2', value=21.5):
+    response = client.post('/api/sensors', json={
+        'device_id': device_id, 'sensors': [{'type': 'temperature', 'value': value, 'unit': 'C'}]})
+    assert response.status_code == 201
+
+
+@pytest.mark.parametrize('path', ['/api/stats', '/api/devices', '/api/sensors/latest', '/api/dashboard/data?limit=5'])
+def test_unchanged_read_is_answered_with_304(app_module, path):
+    client = app_module.app.test_client()
+    post_reading(client)
+
+    first = client.get(path)
+    assert first.status_code == 200 and first.headers['ETag'].startswith('W/')
+    assert first.headers['Cache-Control'] == 'no-cache'
+
+    again = client.get(path, headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304 and again.data == b''
+
+
+def test_new_readings_change_the_etag(app_module):
+    client = app_module.app.test_client()
+    post_reading(client)
+    etag = client.get('/api/sensors/latest?device_id=DASH:2').headers['ETag']
+
+    post_reading(client, value=22.5)
+    response = client.get('/api/sensors/latest?device_id=DASH:2', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.json['sensors'][0]['value'] == 22.5
+
+
+def test_query_arguments_are_cached_separately(app_module):
+    client = app_module.app.test_client()
+    post_reading(client, 'DASH:3')
+    post_reading(client, 'DASH:4')
+
+    assert client.get('/api/dashboard/data?device_id=DASH:3').json['data'][0]['device_id'] == 'DASH:3'
+    assert client.get('/api/dashboard/data?device_id=DASH:4').json['data'][0]['device_id'] == 'DASH:4'
+
+
+def test_cursor_pages_walk_every_reading_once(app_module):
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    with app_module.app.app_context():
+        # Pairs share a timestamp, so pages must break ties on id
+        app_module.store_readings([{
+            'device_id': 'PAGE:1', 'sensor_type': 'temperature', 'value': float(i), 'unit': 'C',
+            'timestamp': now - datetime.timedelta(minutes=i // 2), 'seq': None
+        } for i in range(7)])
+        app_module.db.session.commit()
+    client = app_module.app.test_client()
+
+    values = []
+    cursor = ''
+    while True:
+        page = client.get(f'/api/dashboard/data?device_id=PAGE:1&limit=3&cursor={cursor}').json
+        values.extend(reading['value'] for reading in page['data'])
+        if not page['has_more']:
+            break
+        cursor = page['next_cursor']
+    assert sorted(values) == [float(i) for i in range(7)]
+    assert values[:2] in ([0.0, 1.0], [1.0, 0.0]) and values[-1] == 6.0
+
+    latest = client.get('/api/dashboard/data?device_id=PAGE:1&limit=3').json['latest_cursor']
+    assert client.get(f'/api/dashboard/data?device_id=PAGE:1&since={latest}').json['count'] == 0
+    post_reading(client, 'PAGE:1', 30.0)
+    newer = client.get(f'/api/dashboard/data?device_id=PAGE:1&since={latest}').json
+    assert [reading['value'] for reading in newer['data']] == [30.0]
+
+
+def test_malformed_cursor_is_rejected(app_module):
+    response = app_module.app.test_client().get('/api/dashboard/data?cursor=not-a-cursor')
+    assert response.status_code == 400
+    assert response.json == {'error': 'Invalid cursor'}
+
+
+def test_devices_report_counts_from_counters_and_latest_cache(app_module):
+    client = app_module.app.test_client()
+    for value in (20.0, 21.0):
+        assert client.post('/api/sensors', json={'device_id': 'DEV:1', 'sensors': [
+            {'type': 'temperature', 'value': value, 'unit': 'C'},
+            {'type': 'humidity', 'value': 40.0, 'unit': '%'}]}).status_code == 201
+
+    device, = [d for d in client.get('/api/devices').json['devices'] if d['id'] == 'DEV:1']
+    assert device['readings_today'] == 4
+    assert device['latest_readings_count'] == 2
+    assert device['latest_reading_at'] is not None and device['is_online']
+
+
+def test_ingest_rate_is_measured_over_at_least_a_minute(app_module):
+    client = app_module.app.test_client()
+    post_reading(client, 'RATE:1')
+    post_reading(client, 'RATE:1')
+
+    now = datetime.datetime.utcnow()
+    with app_module.app.app_context():
+        app_module.db.session.add(app_module.IngestCounter(
+            device_id='RATE:2', period=app_module.get_iran_time().strftime('%Y-%m-%d'), reading_count=20,
+            first_at=now - datetime.timedelta(minutes=10), last_at=now))
+        app_module.db.session.commit()
+    app_module.response_cache.bump_generation()
+
+    rates = client.get('/api/stats').json['ingest_rates']
+    assert rates['RATE:1']['readings_per_minute'] == 2.0
+    assert rates['RATE:2']['readings_per_minute'] == pytest.approx(2.0, abs=0.05)
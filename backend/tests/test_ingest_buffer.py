@@ -0,0 +1,26 @@
+import datetime
+
+
+def frame(device_id, *values):
+    return [{
+        'device_id': device_id, 'sensor_type': 'temperature', 'value': value, 'unit': 'C',
+        'timestamp': datetime.datetime(2026, 1, 1) + datetime.timedelta(seconds=i), 'seq': None
+    } for i, value in enumerate(values)]
+
+
+def stored(app_module):
+    with app_module.app.app_context():
+        return sorted(value for (value,) in app_module.db.session.query(app_module.SensorReading.value))
+
+
+def test_bad_frame_does_not_sink_the_rest_of_the_batch(app_module, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'ingest_spool', app_module.IngestSpool(str(tmp_path), 1024 * 1024, False, 60, 5000))
+    buffer = app_module.IngestBuffer(10, 100, 0.2)
+    assert buffer.submit(frame('BUF:1', 1.0, 2.0))
+    assert buffer.submit(frame('BUF:2', 3.0, None))
+    assert buffer.submit(frame('BUF:3', 4.0))
+    buffer.shutdown()
+
+    assert stored(app_module) == [1.0, 2.0, 4.0]
+    assert buffer.stats()['rows_flushed'] == 3
+    assert buffer.stats()['rows_failed'] == 2
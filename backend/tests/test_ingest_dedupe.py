@@ -0,0 +1,91 @@
+import datetime
+
+import pytest
+
+RECEIVED_AT = datetime.datetime(2026, 3, 1, 12, 0, 0)
+
+
+def post(client, seq, device_id='SEQ:1', **extra):
+    return client.post('/api/sensors', json={
+        'device_id': device_id, 'seq': seq,
+        'sensors': [{'type': 'temperature', 'value': 21.5, 'unit': 'C'},
+                    {'type': 'humidity', 'value': 40.0, 'unit': '%'}],
+        **extra})
+
+
+def stored_count(app_module):
+    with app_module.app.app_context():
+        return app_module.SensorReading.query.count()
+
+
+def rows(seq, device_id='SEQ:1'):
+    return [{'device_id': device_id, 'seq': seq}]
+
+
+def test_sequence_window_tracks_recent_numbers_per_device(app_module):
+    window = app_module.SequenceWindow(8)
+    window.mark(rows(10) + rows(12) + rows(5, 'SEQ:2'))
+
+    assert window.seen('SEQ:1', 10) and window.seen('SEQ:1', 12)
+    assert not window.seen('SEQ:1', 11)
+    assert not window.seen('SEQ:2', 10)
+
+    window.mark(rows(19))  # slides the window past 10 and 12
+    assert window.seen('SEQ:1', 19) and window.seen('SEQ:1', 12)
+    assert not window.seen('SEQ:1', 10)
+
+    window.mark(rows(13) + rows(11))  # late frames, inside and below the window
+    assert window.seen('SEQ:1', 13)
+    assert not window.seen('SEQ:1', 11)
+    assert window.unseen(rows(13) + rows(14) + rows(None)) == rows(14) + rows(None)
+
+
+def test_retried_frame_is_stored_once(app_module):
+    client = app_module.app.test_client()
+    assert post(client, 1).status_code == 201
+
+    response = post(client, 1)
+    assert response.status_code == 200
+    assert response.json['duplicate'] and response.json['readings_saved'] == 0
+    assert stored_count(app_module) == 2
+
+
+def test_frame_stored_before_a_restart_is_skipped_by_the_unique_key(app_module, monkeypatch):
+    client = app_module.app.test_client()
+    assert post(client, 7, device_id='SEQ:3').status_code == 201
+    # A fresh worker has no window yet: ingest_sequence must catch the retry
+    monkeypatch.setattr(app_module, 'sequence_window', app_module.SequenceWindow(app_module.INGEST_SEQ_WINDOW))
+
+    assert post(client, 7, device_id='SEQ:3').json['duplicate']
+    assert post(client, 8, device_id='SEQ:3').status_code == 201
+    assert stored_count(app_module) == 4
+
+
+def test_batch_keeps_one_copy_of_a_frame_repeated_in_the_request(app_module):
+    frame = {'device_id': 'SEQ:4', 'seq': 3, 'sensors': [{'type': 'temperature', 'value': 20.0, 'unit': 'C'}]}
+    response = app_module.app.test_client().post('/api/sensors/batch', json=[frame, frame])
+    assert response.status_code == 201
+    assert stored_count(app_module) == 1
+
+
+def frame(app_module, timestamp, uptime_ms=None):
+    return app_module.FramePayload('TS:1', [], timestamp, None, uptime_ms)
+
+
+@pytest.mark.parametrize('timestamp, expected', [
+    ('2026-03-01T11:00:00Z', datetime.datetime(2026, 3, 1, 11, 0, 0)),
+    ((datetime.datetime(2026, 3, 1, 11, 30) - datetime.datetime(1970, 1, 1)).total_seconds(),
+     datetime.datetime(2026, 3, 1, 11, 30)),
+    (None, RECEIVED_AT),
+    ('not a date', RECEIVED_AT),
+    (123456, RECEIVED_AT),                     # millis() shortly after boot
+    ('2026-03-01T12:10:00Z', RECEIVED_AT),    # ahead of the server clock
+    ('2025-11-01T12:00:00Z', RECEIVED_AT),    # older than DEVICE_MAX_BACKFILL
+])
+def test_implausible_device_timestamps_fall_back_to_receipt_time(app_module, timestamp, expected):
+    assert app_module.frame_timestamp(frame(app_module, timestamp), RECEIVED_AT) == expected
+
+
+def test_uptime_counter_is_not_taken_for_epoch_seconds(app_module):
+    uptime_ms = 20 * 86400 * 1000  # 20 days of millis() passes for a 2000s epoch value
+    assert app_module.frame_timestamp(frame(app_module, uptime_ms, uptime_ms + 3), RECEIVED_AT) == RECEIVED_AT
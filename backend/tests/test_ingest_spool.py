@@ -0,0 +1,126 @@
+import datetime
+import json
+import os
+import zlib
+
+import pytest
+from sqlalchemy import exc
+
+
+def reading(i, **overrides):
+    return {
+        'device_id': 'SPOOL:1', 'sensor_type': 'temperature', 'value': float(i), 'unit': 'C',
+        'timestamp': datetime.datetime(2026, 1, 1) + datetime.timedelta(seconds=i), 'seq': None,
+        **overrides
+    }
+
+
+def make_spool(app_module, directory, replay_batch=5000):
+    return app_module.IngestSpool(str(directory), 1024 * 1024, False, 60, replay_batch)
+
+
+def stored_values(app_module):
+    with app_module.app.app_context():
+        return sorted(value for (value,) in app_module.db.session.query(app_module.SensorReading.value))
+
+
+def segment_paths(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.endswith(('.log', '.sealed')))
+
+
+def transient_error():
+    return exc.OperationalError('INSERT', {}, Exception('connection refused'))
+
+
+def test_only_connectivity_errors_are_spooled(app_module, tmp_path):
+    spool = make_spool(app_module, tmp_path)
+
+    assert not spool.spool_failed([reading(1)], exc.IntegrityError('INSERT', {}, Exception('bad row')))
+    assert not spool.spool_failed([reading(1)], ValueError('bad row'))
+    assert not spool.bypass_database()
+    assert segment_paths(tmp_path) == []
+
+    assert spool.spool_failed([reading(1)], transient_error())
+    assert spool.bypass_database()
+    assert len(segment_paths(tmp_path)) == 1
+
+
+def test_torn_tail_waits_for_live_writer_and_is_dropped_once_sealed(app_module, tmp_path):
+    spool = make_spool(app_module, tmp_path)
+    spool.append([reading(1), reading(2)])
+    path, = segment_paths(tmp_path)
+    with open(path, 'ab') as handle:
+        handle.write(spool.RECORD_HEADER.pack(100, 0) + b'[[')  # record cut short by a crash
+
+    # Our own segment is still live: the complete record is loaded, the tail kept
+    assert spool.replay() == 2
+    assert os.path.exists(path)
+    assert spool.replay() == 0
+
+    spool.shutdown()
+    assert spool.replay() == 0
+    assert segment_paths(tmp_path) == []
+    assert stored_values(app_module) == [1.0, 2.0]
+
+
+def test_checkpoint_prevents_double_replay_after_crash(app_module, tmp_path, monkeypatch):
+    spool = make_spool(app_module, tmp_path, replay_batch=1)
+    spool.append([reading(1)])
+    spool.append([reading(2)])
+    spool.shutdown()
+
+    store_readings = app_module.store_readings
+    calls = []
+
+    def fail_second_batch(rows, *args, **kwargs):
+        calls.append(rows)
+        if len(calls) == 2:
+            raise transient_error()
+        return store_readings(rows, *args, **kwargs)
+
+    monkeypatch.setattr(app_module, 'store_readings', fail_second_batch)
+    assert spool.replay() == 0
+    assert spool.bypass_database()
+    assert stored_values(app_module) == [1.0]
+
+    monkeypatch.setattr(app_module, 'store_readings', store_readings)
+    assert spool.replay() == 1
+    assert stored_values(app_module) == [1.0, 2.0]
+    assert segment_paths(tmp_path) == []
+
+
+def test_poison_records_are_dead_lettered(app_module, tmp_path):
+    spool = make_spool(app_module, tmp_path)
+    spool.append([reading(i) for i in range(1, 6)] + [reading(6, value=None)] + [reading(7)])
+    # A record with a valid checksum whose payload does not decode
+    payload = b'[["SPOOL:1", "temperature", 1.0, "C", "yesterday", null]]'
+    with open(segment_paths(tmp_path)[0], 'ab') as handle:
+        handle.write(spool.RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+    spool.shutdown()
+
+    assert spool.replay() == 6
+    assert stored_values(app_module) == [1.0, 2.0, 3.0, 4.0, 5.0, 7.0]
+    assert segment_paths(tmp_path) == []
+    assert not spool.bypass_database()
+    assert spool.rows_dead_lettered == 2
+
+    with open(tmp_path / 'dead-letter.jsonl') as handle:
+        entries = [json.loads(line) for line in handle]
+    assert [entry['record'] for entry in entries] == [
+        payload.decode(), ['SPOOL:1', 'temperature', None, 'C', '2026-01-01T00:00:06', None]]
+    assert all(entry['error'] for entry in entries)
+
+
+@pytest.mark.parametrize('error, spooled', [(transient_error(), True), (ValueError('bad row'), False)])
+def test_sync_ingest_spools_only_when_database_is_unreachable(app_module, tmp_path, monkeypatch, error, spooled):
+    monkeypatch.setattr(app_module, 'ingest_spool', make_spool(app_module, tmp_path))
+
+    def fail(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(app_module, 'store_readings', fail)
+    response = app_module.app.test_client().post('/api/sensors', json={
+        'device_id': 'SPOOL:2', 'sensors': [{'type': 'temperature', 'value': 21.5, 'unit': 'C'}]})
+    assert response.status_code == (202 if spooled else 500)
+    assert bool(segment_paths(tmp_path)) == spooled
@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Schema and rows as written by the release before dictionary encoding
+BASELINE_SCHEMA = '''
+CREATE TABLE device (id VARCHAR(50) PRIMARY KEY, name VARCHAR(100), location VARCHAR(200),
+                     first_seen DATETIME, last_seen DATETIME, is_active BOOLEAN);
+CREATE TABLE sensor_reading (id INTEGER PRIMARY KEY, device_id VARCHAR(50) NOT NULL REFERENCES device (id),
+                             sensor_type VARCHAR(50) NOT NULL, value FLOAT NOT NULL, unit VARCHAR(10) NOT NULL,
+                             timestamp DATETIME);
+CREATE INDEX idx_device_sensor_time ON sensor_reading (device_id, sensor_type, timestamp);
+INSERT INTO device VALUES ('AA:01', NULL, NULL, '2026-01-01 09:00:00', '2026-01-01 10:00:00', 1);
+INSERT INTO device VALUES ('AA:02', NULL, NULL, '2026-01-01 09:00:00', '2026-01-01 10:00:00', 1);
+INSERT INTO sensor_reading VALUES (1, 'AA:01', 'temperature', 20.5, 'C', '2026-01-01 10:00:00');
+INSERT INTO sensor_reading VALUES (2, 'AA:01', 'humidity', 40.0, '%', '2026-01-01 10:00:00');
+INSERT INTO sensor_reading VALUES (5, 'AA:02', 'temperature', 21.0, 'C', '2026-01-01 10:01:00');
+INSERT INTO sensor_reading VALUES (6, 'AA:02', 'temperature', 19.0, 'C', NULL);
+'''
+
+
+def start_app(directory):
+    """Import the backend in a fresh process against the database in `directory`"""
+    env = dict(os.environ, FLASK_ENV='development', ROLLUP_ENABLED='false', PYTHONPATH=BACKEND_DIR)
+    subprocess.run([sys.executable, '-c', 'import app'], cwd=directory, env=env, check=True,
+                   capture_output=True, timeout=120)
+    return sqlite3.connect(os.path.join(directory, 'sensor_data.db'))
+
+
+def test_baseline_database_is_migrated_in_place(tmp_path):
+    with sqlite3.connect(tmp_path / 'sensor_data.db') as conn:
+        conn.executescript(BASELINE_SCHEMA)
+
+    conn = start_app(tmp_path)
+    # Ids are kept, strings move to the dictionary tables, legacy NULL timestamps survive
+    assert conn.execute(
+        'SELECT r.id, d.device_id, t.name, t.unit, r.value, r.timestamp FROM sensor_reading r '
+        'JOIN device_key d ON d.id = r.device_key JOIN sensor_type t ON t.id = r.sensor_type_id '
+        'ORDER BY r.id').fetchall() == [
+        (1, 'AA:01', 'temperature', 'C', 20.5, '2026-01-01 10:00:00'),
+        (2, 'AA:01', 'humidity', '%', 40.0, '2026-01-01 10:00:00'),
+        (5, 'AA:02', 'temperature', 'C', 21.0, '2026-01-01 10:01:00'),
+        (6, 'AA:02', 'temperature', 'C', 19.0, None),
+    ]
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert 'sensor_reading_new' not in tables and 'sensor_reading_legacy' not in tables
+    assert 'device_id' not in {row[1] for row in conn.execute('PRAGMA table_info(sensor_reading)')}
+
+    # Counters are backfilled once; the reading without a timestamp has no day to count in
+    assert conn.execute(
+        "SELECT device_id, reading_count FROM ingest_counter WHERE period = 'total' ORDER BY device_id"
+    ).fetchall() == [('AA:01', 2), ('AA:02', 1)]
+    conn.close()
+
+    # A second start finds nothing left to migrate or backfill
+    conn = start_app(tmp_path)
+    assert conn.execute('SELECT COUNT(*) FROM sensor_reading').fetchone() == (4,)
+    assert conn.execute("SELECT SUM(reading_count) FROM ingest_counter WHERE period = 'total'").fetchone() == (3,)
+    conn.close()
+
+
+def test_checkpoints_left_in_rollup_watermark_are_moved(tmp_path):
+    start_app(tmp_path).close()
+    with sqlite3.connect(tmp_path / 'sensor_data.db') as conn:
+        conn.execute('DELETE FROM ingest_checkpoint')
+        conn.executemany('INSERT INTO rollup_watermark (name, last_id) VALUES (?, ?)',
+                         [('spool:segment-1', 4096), ('ingest_counters', 0)])
+
+    conn = start_app(tmp_path)
+    assert conn.execute("SELECT COUNT(*) FROM rollup_watermark WHERE name != 'sensor_reading'").fetchone() == (0,)
+    assert sorted(conn.execute('SELECT name, position FROM ingest_checkpoint')) == [
+        ('ingest_counters', 0), ('spool:segment-1', 4096)]
+    conn.close()
@@ -0,0 +1,72 @@
+import struct
+
+import pytest
+
+SENSOR = {'type': 'temperature', 'value': 21.5, 'unit': 'C'}
+
+
+@pytest.mark.parametrize('data, field', [
+    ([], '$'),
+    ({'sensors': [SENSOR]}, '$.device_id'),
+    ({'device_id': '', 'sensors': [SENSOR]}, '$.device_id'),
+    ({'device_id': 'DEC:1'}, '$.sensors'),
+    ({'device_id': 'DEC:1', 'sensors': {}}, '$.sensors'),
+    ({'device_id': 'DEC:1', 'sensors': []}, '$.sensors'),
+    ({'device_id': 'DEC:1', 'sensors': [1]}, '$.sensors[0]'),
+    ({'device_id': 'DEC:1', 'sensors': [SENSOR, {'type': 'humidity', 'value': 40}]}, '$.sensors[1].unit'),
+    ({'device_id': 'DEC:1', 'sensors': [dict(SENSOR, value='warm')]}, '$.sensors[0].value'),
+    ({'device_id': 'DEC:1', 'sensors': [dict(SENSOR, type='')]}, '$.sensors[0].type'),
+    ({'device_id': 'DEC:1', 'sensors': [dict(SENSOR, unit='C' * 11)]}, '$.sensors[0].unit'),
+    ({'device_id': 'DEC:1', 'seq': -1, 'sensors': [SENSOR]}, '$.seq'),
+])
+@pytest.mark.parametrize('decoder', ['msgspec', 'fallback'])
+def test_both_decoders_report_the_same_json_path(app_module, monkeypatch, data, field, decoder):
+    if decoder == 'msgspec':
+        pytest.importorskip('msgspec')
+    else:
+        monkeypatch.setattr(app_module, 'msgspec', None)
+
+    with pytest.raises(app_module.PayloadError) as error:
+        app_module.coerce_frame(data)
+    assert error.value.to_dict()['field'] == field
+
+
+def packed_frame(*readings, version=1, seq=3, timestamp=0, count=None):
+    body = struct.pack('<BB6sIIB', version, 0, bytes.fromhex('246F28AABBCC'), seq, timestamp,
+                       len(readings) if count is None else count)
+    return body + b''.join(struct.pack('<Bf', code, value) for code, value in readings)
+
+
+def test_packed_frame_decodes_to_the_json_frame(app_module):
+    frame = app_module.decode_packed_frame(packed_frame((1, 23.45), (2, 40.1), timestamp=1767225600))
+    assert frame.device_id == '24:6F:28:AA:BB:CC'
+    assert frame.seq == 3 and frame.timestamp == 1767225600
+    assert [(sensor.type, sensor.value, sensor.unit) for sensor in frame.sensors] == [
+        ('temperature', 23.45, 'C'), ('humidity', 40.1, '%')]
+
+
+def test_packed_frame_zero_seq_and_timestamp_mean_absent(app_module):
+    frame = app_module.decode_packed_frame(packed_frame((3, 1013.25), seq=0))
+    assert frame.seq is None and frame.timestamp is None
+
+
+@pytest.mark.parametrize('body, field', [
+    (b'\x01\x00', None),
+    (packed_frame((1, 20.0), version=2), '$.version'),
+    (packed_frame(), '$.sensors'),
+    (packed_frame((1, 20.0), count=2), None),
+    (packed_frame((1, 20.0), (9, 1.0)), '$.sensors[1].code'),
+])
+def test_malformed_packed_frame_is_rejected(app_module, body, field):
+    with pytest.raises(app_module.PayloadError) as error:
+        app_module.decode_packed_frame(body)
+    assert error.value.field == field
+
+
+def test_packed_frame_is_stored_through_the_ingest_endpoint(app_module):
+    response = app_module.app.test_client().post(
+        '/api/sensors', data=packed_frame((1, 21.5), (6, 300.0)),
+        headers={'Content-Type': 'application/vnd.enviromon.frame'})
+    assert response.status_code == 201
+    assert response.json['device_id'] == '24:6F:28:AA:BB:CC'
+    assert response.json['readings_saved'] == 2
@@ -0,0 +1,65 @@
+import datetime
+
+START = datetime.datetime(2026, 1, 1, 10, 0, 0)
+
+
+def store(app_module, *readings):
+    with app_module.app.app_context():
+        app_module.store_readings([{
+            'device_id': 'ROLL:1', 'sensor_type': 'temperature', 'value': value, 'unit': 'C',
+            'timestamp': START + datetime.timedelta(seconds=seconds), 'seq': None
+        } for seconds, value in readings])
+        app_module.db.session.commit()
+
+
+def rollup_batch(app_module):
+    with app_module.app.app_context():
+        return app_module.process_rollup_batch()
+
+
+def watermark(app_module):
+    with app_module.app.app_context():
+        return app_module.get_rollup_watermark()
+
+
+def minute_buckets(app_module):
+    with app_module.app.app_context():
+        rollup = app_module.SensorRollup
+        return [(row.bucket_start.minute, row.reading_count, row.value_sum, row.value_min, row.value_max)
+                for row in rollup.query.filter_by(resolution=60).order_by(rollup.bucket_start)]
+
+
+def max_reading_id(app_module):
+    with app_module.app.app_context():
+        return app_module.db.session.query(app_module.db.func.max(app_module.SensorReading.id)).scalar()
+
+
+def test_readings_past_the_watermark_are_folded_once(app_module):
+    store(app_module, (0, 20.0), (30, 22.0), (70, 25.0))
+
+    assert rollup_batch(app_module) > 0
+    assert watermark(app_module) == max_reading_id(app_module)
+    assert minute_buckets(app_module) == [(0, 2, 42.0, 20.0, 22.0), (1, 1, 25.0, 25.0, 25.0)]
+    assert rollup_batch(app_module) == 0
+
+    # A later reading in an existing bucket is merged into it, not counted again from scratch
+    store(app_module, (45, 18.0))
+    rollup_batch(app_module)
+    assert minute_buckets(app_module) == [(0, 3, 60.0, 18.0, 22.0), (1, 1, 25.0, 25.0, 25.0)]
+    with app_module.app.app_context():
+        hour, = app_module.SensorRollup.query.filter_by(resolution=3600).all()
+        assert (hour.reading_count, hour.value_min, hour.value_max) == (4, 18.0, 25.0)
+
+
+def test_watermark_advances_one_batch_per_transaction(app_module, monkeypatch):
+    store(app_module, *[(i, float(i)) for i in range(5)])
+    first_id = max_reading_id(app_module) - 4
+    monkeypatch.setattr(app_module, 'ROLLUP_BATCH_SIZE', 2)
+    with app_module.app.app_context():
+        app_module.db.session.add(app_module.RollupWatermark(
+            name=app_module.ROLLUP_WATERMARK_NAME, last_id=first_id - 1))
+        app_module.db.session.commit()
+
+    assert [rollup_batch(app_module) for _ in range(4)] == [2, 2, 1, 0]
+    assert watermark(app_module) == first_id + 4
+    assert minute_buckets(app_module) == [(0, 5, 10.0, 0.0, 4.0)]
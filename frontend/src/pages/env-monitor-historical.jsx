@@ -147,11 +147,12 @@ const Historical = () => {
       if (selectedDevice === 'FC:01:2C:2D:B2:E8') {
         const params = new URLSearchParams();
         params.append('hours', dateRange);
-        params.append('limit', '1000');
+        params.append('points', '300');
         params.append('sensor_type', sensorType);
         params.append('device_id', selectedDevice);
 
-        const response = await fetch(`${API_BASE_URL}/api/dashboard/data?${params}`);
+        // Server-side time buckets (min/max/mean/count) cover the whole range
+        const response = await fetch(`${API_BASE_URL}/api/dashboard/aggregate?${params}`);
         
         if (!response.ok) {
           throw new Error(`HTTP error! status: ${response.status}`);
@@ -173,6 +174,9 @@ const Historical = () => {
             .map(item => ({
               time: processTimeForChart(item.timestamp_utc, parseInt(dateRange)),
               value: parseFloat(item.value),
+              min: item.min,
+              max: item.max,
+              count: item.count,
               device_id: item.device_id,
               sensor_type: item.sensor_type,
               unit: item.unit,
@@ -188,16 +192,16 @@ const Historical = () => {
 
           // Calculate statistics for real data
           if (transformedData.length > 0) {
-            const values = transformedData.map(item => item.value);
-            const average = values.reduce((sum, val) => sum + val, 0) / values.length;
-            const max = Math.max(...values);
-            const min = Math.min(...values);
+            const count = transformedData.reduce((sum, item) => sum + item.count, 0);
+            const average = transformedData.reduce((sum, item) => sum + item.value * item.count, 0) / count;
+            const max = Math.max(...transformedData.map(item => item.max));
+            const min = Math.min(...transformedData.map(item => item.min));
             
             setStats({
               average: average.toFixed(1),
               max: max.toFixed(1),
               min: min.toFixed(1),
-              count: transformedData.length,
+              count: count,
               unit: transformedData[0]?.unit || ''
             });
           } else {